@@ -1,4 +1,7 @@
 import { Injectable } from '@nestjs/common';
+import { createHash } from 'crypto';
+import { promises as fs } from 'fs';
+import * as path from 'path';
 import Redis from 'ioredis';
 import { v4 as uuidv4 } from 'uuid';
 
@@ -12,14 +15,52 @@ export class PythonRedisService {
     host: process.env.REDIS_HOST || 'redis',
     port: parseInt(process.env.REDIS_PORT || '6379', 10),
   }); // default PORT 6379
+  // Must match the Python worker's REDIS_TRANSPORT: 'pubsub' publishes requests, 'streams' appends
+  // them to the worker's consumer group streams. Responses come back over pub/sub either way.
+  private transport = process.env.REDIS_TRANSPORT || 'pubsub';
+  private streamMaxLen = process.env.REDIS_STREAM_MAXLEN || '100000';
+  // 'redis' or 'disk' (a BLOB_STORE_PATH shared with the worker) sends files by reference through the
+  // worker's blob store (python_rag/services/blob_store.py); unset sends them inline as base64
+  private blobStore = process.env.BLOB_STORE || '';
+  private blobStorePath = process.env.BLOB_STORE_PATH || '/app/.cache/blobs';
+  private blobTtl = parseInt(process.env.BLOB_TTL || '86400', 10);
+
+  // Same entry format as enqueue() in python_rag/api/redis_streams.py: one 'data' field holding the JSON
+  private send(channel: string, payload: object): Promise<unknown> {
+    const message = JSON.stringify(payload);
+    if (this.transport === 'streams') {
+      return this.redisPub.xadd(channel, 'MAXLEN', '~', this.streamMaxLen, '*', 'data', message);
+    }
+    return this.redisPub.publish(channel, message);
+  }
+
+  // Writes the file to the blob store; returns the message fields that reference it
+  private async putBlob(requestId: string, fileBuffer: Buffer): Promise<Record<string, unknown>> {
+    const checksum = createHash('sha256').update(fileBuffer).digest('hex');
+    // One blob per request, as the worker's put() names them, so ingests of the same file never share one
+    const ref = `${checksum}-${requestId}`;
+    if (this.blobStore === 'redis') {
+      await this.redisPub.set(`blob:${ref}`, fileBuffer, 'EX', this.blobTtl);
+    } else {
+      // Written under a temp name and renamed, so the worker never maps a partial file
+      await fs.mkdir(this.blobStorePath, { recursive: true });
+      const tmpPath = path.join(this.blobStorePath, `.tmp-${requestId}`);
+      await fs.writeFile(tmpPath, fileBuffer);
+      await fs.rename(tmpPath, path.join(this.blobStorePath, ref));
+    }
+    return { payload_ref: ref, checksum, size: fileBuffer.length };
+  }
 
   async ingestFile(filename: string, fileBuffer: Buffer): Promise<any> {
     const requestId = uuidv4();
-    const fileContent = fileBuffer.toString('base64');
-    const payload = { filename, file_content: fileContent, request_id: requestId };
+    const fileFields =
+      this.blobStore === 'redis' || this.blobStore === 'disk'
+        ? await this.putBlob(requestId, fileBuffer)
+        : { file_content: fileBuffer.toString('base64') };
+    const payload = { filename, request_id: requestId, ...fileFields };
 
-    await this.redisPub.publish('ingest_requests', JSON.stringify(payload));
-    console.log('Published ingest request:', payload.filename, payload.request_id);
+    await this.send('ingest_requests', payload);
+    console.log('Sent ingest request:', payload.filename, payload.request_id);
 
     return new Promise((resolve, reject) => {
       const handler = (channel: string, message: string) => {
@@ -43,7 +84,7 @@ export class PythonRedisService {
     const requestId = uuidv4();
     const payload = { question, request_id: requestId };
 
-    await this.redisPub.publish('query_requests', JSON.stringify(payload));
+    await this.send('query_requests', payload);
 
     return new Promise((resolve, reject) => {
       const handler = (channel: string, message: string) => {
@@ -4,6 +4,8 @@ import { v4 as uuidv4 } from 'uuid';
 jest.mock('ioredis', () => {
   return jest.fn().mockImplementation(() => ({
     publish: jest.fn(),
+    xadd: jest.fn(),
+    set: jest.fn(),
     on: jest.fn(),
     subscribe: jest.fn(),
     removeListener: jest.fn(),
@@ -80,6 +82,61 @@ describe('PythonRedisService', () => {
     expect(subscribeMock).toHaveBeenCalledWith('query_responses');
   });
 
+  it('should append requests to the stream when REDIS_TRANSPORT is streams', async () => {
+    process.env.REDIS_TRANSPORT = 'streams';
+    const streamsService = new PythonRedisService();
+    delete process.env.REDIS_TRANSPORT;
+    const pub = (streamsService as any).redisPub;
+    const sub = (streamsService as any).redisSub;
+
+    let handler: any;
+    (sub.on as jest.Mock).mockImplementation((event, cb) => {
+      if (event === 'message') handler = cb;
+    });
+
+    const promise = streamsService.ingestFile('file.txt', Buffer.from('abc'));
+    await Promise.resolve();
+    handler('ingest_responses', JSON.stringify({ request_id: 'mock-uuid', status: 'success' }));
+
+    await expect(promise).resolves.toEqual({ request_id: 'mock-uuid', status: 'success' });
+    expect(pub.publish).not.toHaveBeenCalled();
+    expect(pub.xadd).toHaveBeenCalledWith('ingest_requests', 'MAXLEN', '~', '100000', '*', 'data', expect.any(String));
+    expect(JSON.parse((pub.xadd as jest.Mock).mock.calls[0][6])).toMatchObject({
+      filename: 'file.txt',
+      request_id: 'mock-uuid',
+    });
+  });
+
+  it('should send the file as a blob reference when BLOB_STORE is redis', async () => {
+    process.env.BLOB_STORE = 'redis';
+    const blobService = new PythonRedisService();
+    delete process.env.BLOB_STORE;
+    const pub = (blobService as any).redisPub;
+    const sub = (blobService as any).redisSub;
+
+    let handler: any;
+    (sub.on as jest.Mock).mockImplementation((event, cb) => {
+      if (event === 'message') handler = cb;
+    });
+
+    const promise = blobService.ingestFile('file.txt', Buffer.from('abc'));
+    // The blob is written before the request is sent
+    await new Promise((resolve) => setImmediate(resolve));
+    handler('ingest_responses', JSON.stringify({ request_id: 'mock-uuid', status: 'success' }));
+    await promise;
+
+    const checksum = 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad';
+    expect(pub.set).toHaveBeenCalledWith(`blob:${checksum}-mock-uuid`, Buffer.from('abc'), 'EX', 86400);
+    const sent = JSON.parse((pub.publish as jest.Mock).mock.calls[0][1]);
+    expect(sent).toEqual({
+      filename: 'file.txt',
+      request_id: 'mock-uuid',
+      payload_ref: `${checksum}-mock-uuid`,
+      checksum,
+      size: 3,
+    });
+  });
+
   it('should timeout if no response is received', async () => {
     jest.useFakeTimers();
     const promise = service.query('timeout test');
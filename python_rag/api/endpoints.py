@@ -4,6 +4,7 @@ from fastapi.responses import JSONResponse
 from models.schemas import QueryRequest, QueryResponse
 from services.embedding import generate_embedding
 from services.file_utils import extract_text_from_file, chunk_text
+from db.vector_codec import to_vector_array
 from config import QA_MODEL
 
 router = APIRouter()
@@ -33,10 +34,10 @@ async def ingest(request: Request, file: UploadFile = File(...)):
         for chunk in chunks:
             if chunk.strip():
                 embedding = await generate_embedding(chunk, model)
-                embedding_str = "[" + ",".join([str(x) for x in embedding.tolist()]) + "]"
+                embedding_vector = to_vector_array(embedding)
                 await conn.execute(
                     "INSERT INTO documents (content, embedding) VALUES ($1, $2)",
-                    chunk, embedding_str
+                    chunk, embedding_vector
                 )
     return {"status": "success"}
 
@@ -52,13 +53,13 @@ async def query(request: Request, query_request: QueryRequest):
     if not question or not question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
     query_embedding = await generate_embedding(question, model)
-    embedding_str = "[" + ",".join([str(x) for x in query_embedding]) + "]"
+    query_vector = to_vector_array(query_embedding)
     async with db_pool.acquire() as conn:
         rows = await conn.fetch("""
             SELECT content FROM documents
             ORDER BY embedding <-> $1::vector
             LIMIT 5
-        """, embedding_str)
+        """, query_vector)
     context = " ".join([r["content"] for r in rows]) if rows else ""
     if context:
         result = qa_pipeline(question=question, context=context)
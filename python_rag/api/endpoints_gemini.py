@@ -1,5 +1,7 @@
 import sys
 import os
+import json
+import time
 
 # Get the directory containing this file (/var/task/api/)
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -10,15 +12,25 @@ if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from models.schemas import QueryRequest, QueryResponse
 from services.file_utils_light import extract_text_from_file, chunk_text_sliding_window
-from services.embedding_gemini import (
-    generate_document_embedding_gemini,
-    generate_query_embedding_gemini,
-    get_answer_gemini,
-    get_cache_stats
-)
+from services.embedding_gemini import get_cache_stats
+from services.batch_processor import process_embeddings_batch
+from services.answer_cache import answer_from_chunks, semantic_answer_cache, stream_answer_from_chunks
+from services.context_packer import context_packer
+from services.retrieval import retrieve
+from services.reranker import get_reranker
+from db.document_manager import DocumentManager
+from db.retrieval_cache import get_retrieval_cache
+from db.retrieval_backend import get_retrieval_backend
+from db.index_manager import get_index_manager
+from services.rate_limiter import embedding_limiter
+from services.admission import INGEST, QUERY, Overloaded, Ticket, get_admission_controller
+from api.redis_worker_upstash import worker_stats
+from utils.logger import logger
+from config import ADMISSION_TENANT_HEADER
 # from config import GEMINI_API_KEY
 from dotenv import load_dotenv
 
@@ -26,10 +38,25 @@ load_dotenv()
 
 router = APIRouter()
 
+def _tenant(request: Request) -> str:
+    """Caller identity for per-tenant admission limits: the trusted tenant header if configured, else the client address"""
+    if ADMISSION_TENANT_HEADER and request.headers.get(ADMISSION_TENANT_HEADER):
+        return request.headers[ADMISSION_TENANT_HEADER]
+    return request.client.host if request.client else "anonymous"
+
+async def _admit(request: Request, request_class: str) -> Ticket:
+    """Admission slot for this request, or an immediate 429/503 with a Retry-After hint"""
+    try:
+        return await get_admission_controller().acquire(request_class, tenant=_tenant(request))
+    except Overloaded as e:
+        logger.warn(f"Rejected {request_class} ({e.status_code}): {e.reason}")
+        raise HTTPException(status_code=e.status_code, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
 @router.post("/ingest/", response_class=JSONResponse)
 async def ingest(request: Request, file: UploadFile = File(...)):
     """
     Ingest a document file, extract text, generate embedding, and store in DB.
+    Rows go through DocumentManager, so caches and local indexes see the change.
     """
     db_pool = request.app.state.db_pool
 
@@ -37,22 +64,19 @@ async def ingest(request: Request, file: UploadFile = File(...)):
     content = await file.read()
     if len(content) > MAX_FILE_SIZE:
         raise HTTPException(status_code=413, detail="File too large (max 5MB).")
-    text = await extract_text_from_file(file, content)
-    if not text or not text.strip():
-        raise HTTPException(status_code=400, detail="No text extracted from file.")
-    
-    # Chunk text
-    chunks = chunk_text_sliding_window(text, chunk_size=400, overlap=50)
-
-    async with db_pool.acquire() as conn:
-        for chunk in chunks:
-            if chunk.strip():
-                embedding = await generate_document_embedding_gemini(chunk)
-                embedding_str = "[" + ",".join([str(x) for x in embedding]) + "]"
-                await conn.execute(
-                    "INSERT INTO documents (content, embedding) VALUES ($1, $2)",
-                    chunk, embedding_str
-                )
+    ticket = await _admit(request, INGEST)
+    try:
+        text = await extract_text_from_file(file, content)
+        if not text or not text.strip():
+            raise HTTPException(status_code=400, detail="No text extracted from file.")
+        
+        # Chunk text
+        chunks = chunk_text_sliding_window(text, chunk_size=400, overlap=50, pre_cleaned=True)
+
+        chunk_embedding_pairs = await process_embeddings_batch(chunks)
+        await DocumentManager(db_pool).insert_documents(chunk_embedding_pairs)
+    finally:
+        ticket.release()
     return {"status": "success"}
 
 @router.post("/query/", response_model=QueryResponse)
@@ -66,25 +90,112 @@ async def query(request: Request, query_request: QueryRequest):
     if not question or not question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
     
-    query_embedding = await generate_query_embedding_gemini(question)
-    embedding_str = "[" + ",".join([str(x) for x in query_embedding]) + "]"
-    
-    async with db_pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT content FROM documents
-            ORDER BY embedding <-> $1::vector
-            LIMIT 5
-        """, embedding_str)
-    
-    context = " ".join([r["content"] for r in rows]) if rows else ""
-    if context:
-        answer = await get_answer_gemini(question, context)
-    else:
-        answer = "No relevant documents found."
+    ticket = await _admit(request, QUERY)
+    try:
+        retrieval = await retrieve(db_pool, question, limit=5)
+        answer = await answer_from_chunks(question, retrieval.query_embedding, retrieval.chunks)
+    finally:
+        ticket.release()
     
     return QueryResponse(answer=answer)
 
+def _sse(event: str, data: dict) -> str:
+    """One server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/query/stream/")
+async def query_stream(request: Request, query_request: QueryRequest):
+    """
+    Like /query/, but the answer is sent as server-sent events while it is generated:
+    a `retrieval` event, `chunk` events with the text so far, then `done` with the
+    full answer (or `error`).
+    """
+    db_pool = request.app.state.db_pool
+
+    question = query_request.question
+    if not question or not question.strip():
+        raise HTTPException(status_code=400, detail="Question cannot be empty.")
+
+    start_time = time.time()
+    # Held until the stream ends, so admission covers generation too
+    ticket = await _admit(request, QUERY)
+    try:
+        retrieval = await retrieve(db_pool, question, limit=5)
+    except BaseException:
+        ticket.release()
+        raise
+
+    async def events():
+        try:
+            yield _sse("retrieval", {"documents_found": len(retrieval.chunks), "mode": retrieval.mode})
+            pieces = []
+            try:
+                async for piece in stream_answer_from_chunks(question, retrieval.query_embedding, retrieval.chunks):
+                    if not pieces:
+                        logger.timing("Time to first token", time.time() - start_time)
+                    pieces.append(piece)
+                    yield _sse("chunk", {"text": piece})
+            except Exception as e:
+                yield _sse("error", {"detail": str(e)})
+                return
+            logger.timing("Streamed answer", time.time() - start_time)
+            yield _sse("done", {"answer": "".join(pieces)})
+        finally:
+            ticket.release()
+
+    # No caching or proxy buffering, so events reach the client as they are written. The background
+    # task also frees the slot when the client disconnects before the generator ever starts.
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                             background=BackgroundTask(ticket.release))
+
 @router.get("/cache-info/")
 async def cache_info():
     """Get cache statistics for monitoring"""
-    return get_cache_stats()
\ No newline at end of file
+    return {
+        **get_cache_stats(),
+        "semantic_answers": semantic_answer_cache.stats(),
+        "retrieval": get_retrieval_cache().stats()
+    }
+
+@router.get("/embedding-limiter/")
+async def embedding_limiter_info():
+    """Current adaptive concurrency limit, in-flight requests and throttle events"""
+    return embedding_limiter.stats()
+
+@router.get("/context-packing/")
+async def context_packing_info():
+    """Prompt token budget and tokens saved by merging and de-duplicating retrieved chunks"""
+    return context_packer.stats()
+
+@router.get("/admission/")
+async def admission_info():
+    """Running and waiting requests per class, service times and 429/503 rejections"""
+    return get_admission_controller().stats()
+
+@router.get("/worker-status/")
+async def worker_status():
+    """Redis worker requests in flight and queued, per class (ingest / query)"""
+    return worker_stats()
+
+@router.get("/reranker/")
+async def reranker_info():
+    """Configured reranking scorer, its budget and how often it fell back to retrieval order"""
+    reranker = get_reranker()
+    return reranker.stats() if reranker is not None else {"scorer": "none"}
+
+@router.get("/retrieval-backend/")
+async def retrieval_backend_info():
+    """Active retrieval backend and, for local indexes, their load state"""
+    return get_retrieval_backend().stats()
+
+@router.get("/index-status/")
+async def index_status(request: Request):
+    """pgvector index definition, size, build state, search settings and whether the planner uses it"""
+    return await get_index_manager().status(request.app.state.db_pool)
+
+@router.post("/index-maintenance/")
+async def index_maintenance(request: Request):
+    """Create, rebuild or REINDEX the pgvector index now if it no longer fits the table"""
+    action = await get_index_manager().ensure_index(request.app.state.db_pool)
+    return {"action": action}
@@ -0,0 +1,184 @@
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from redis.exceptions import ResponseError
+from utils.logger import logger
+from utils.task_dispatcher import TaskDispatcher
+from config import (
+    REDIS_STREAM_GROUP, REDIS_CONSUMER_NAME, REDIS_STREAM_BLOCK_MS, REDIS_CLAIM_IDLE_MS,
+    REDIS_MAX_DELIVERIES, REDIS_STREAM_MAXLEN
+)
+
+Handler = Callable[[dict], Awaitable[Any]]
+Entry = Tuple[str, Optional[Dict[str, str]]]
+
+async def enqueue(redis_conn, stream: str, payload: dict, maxlen: int = REDIS_STREAM_MAXLEN) -> str:
+    """Producer side: append a request to a stream, returning its entry id"""
+    return await redis_conn.xadd(stream, {"data": json.dumps(payload)}, maxlen=maxlen, approximate=True)
+
+class StreamConsumer:
+    """
+    One member of a Redis Streams consumer group.
+
+    Entries are read with XREADGROUP, so each goes to a single consumer, and
+    are XACKed only after the handler returns: a worker that dies mid-request
+    leaves its entries pending. While a handler runs its entry is re-claimed
+    periodically, which keeps it from looking idle. Entries idle for longer
+    than `claim_idle_ms` are taken over with XAUTOCLAIM by whichever consumer
+    checks next. Delivery is at-least-once. An entry delivered more than
+    `max_deliveries` times is moved to `<stream>:dead` and acknowledged.
+    With a `dispatcher`, entries are handled concurrently on it and only as
+    many are read as it has room for.
+    """
+
+    def __init__(self, redis_conn, stream: str, handler: Handler, group: str = REDIS_STREAM_GROUP,
+                 consumer: str = REDIS_CONSUMER_NAME, block_ms: int = REDIS_STREAM_BLOCK_MS, batch: int = 10,
+                 claim_idle_ms: int = REDIS_CLAIM_IDLE_MS, max_deliveries: int = REDIS_MAX_DELIVERIES,
+                 dispatcher: Optional[TaskDispatcher] = None):
+        self.redis = redis_conn
+        self.stream = stream
+        self.handler = handler
+        self.group = group
+        self.consumer = consumer
+        self.block_ms = block_ms
+        self.batch = batch
+        self.claim_idle_ms = claim_idle_ms
+        self.max_deliveries = max_deliveries
+        self.dead_letter_stream = f"{stream}:dead"
+        self.dispatcher = dispatcher
+        self._last_reclaim = 0.0
+        self.processed = 0
+        self.failed = 0
+        self.reclaimed = 0
+        self.dead_lettered = 0
+
+    async def ensure_group(self) -> None:
+        """Create the stream and group if needed; the group starts at the beginning, so nothing queued is skipped"""
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+            logger.info(f"Created consumer group {self.group} on {self.stream}")
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _deliveries(self, entry_ids: List[str]) -> Dict[str, int]:
+        """Delivery counts for pending entries (only looked up on recovery and reclaim)"""
+        counts = {}
+        for entry_id in entry_ids:
+            pending = await self.redis.xpending_range(self.stream, self.group, min=entry_id, max=entry_id, count=1)
+            if pending:
+                counts[entry_id] = pending[0]["times_delivered"]
+        return counts
+
+    async def _keepalive(self, entry_id: str) -> None:
+        """Reset the entry's idle time while it is being worked on"""
+        while True:
+            await asyncio.sleep(self.claim_idle_ms / 3000)
+            await self.redis.xclaim(self.stream, self.group, self.consumer, min_idle_time=0,
+                                    message_ids=[entry_id], justid=True)
+
+    async def _process(self, entry_id: str, fields: Optional[Dict[str, str]], deliveries: int = 1) -> None:
+        if fields is None:
+            # Trimmed from the stream while pending: nothing left to process
+            await self.redis.xack(self.stream, self.group, entry_id)
+            return
+        if deliveries > self.max_deliveries:
+            logger.error(f"{self.stream} entry {entry_id} failed {deliveries - 1} deliveries, moving to {self.dead_letter_stream}")
+            await self.redis.xadd(self.dead_letter_stream, {**fields, "entry_id": entry_id, "deliveries": deliveries},
+                                  maxlen=REDIS_STREAM_MAXLEN, approximate=True)
+            await self.redis.xack(self.stream, self.group, entry_id)
+            self.dead_lettered += 1
+            return
+        try:
+            await self.handler(json.loads(fields["data"]))
+        except Exception as e:
+            # Left pending: it is retried once idle, up to max_deliveries
+            self.failed += 1
+            logger.error(f"{self.stream} entry {entry_id} failed (delivery {deliveries}): {e}")
+            return
+        await self.redis.xack(self.stream, self.group, entry_id)
+        self.processed += 1
+
+    async def _handle_all(self, entries: List[Entry], deliveries: Optional[Dict[str, int]] = None) -> int:
+        for entry_id, fields in entries:
+            count = (deliveries or {}).get(entry_id, 1)
+            # Renewed from the moment it is read, including any time spent queued in the dispatcher
+            keepalive = asyncio.create_task(self._keepalive(entry_id))
+            if self.dispatcher is None:
+                try:
+                    await self._process(entry_id, fields, count)
+                finally:
+                    keepalive.cancel()
+            else:
+                task = await self.dispatcher.submit(self._process, entry_id, fields, count)
+                task.add_done_callback(lambda _, keepalive=keepalive: keepalive.cancel())
+        return len(entries)
+
+    def _read_count(self) -> int:
+        # Never take more entries than the dispatcher can accept; the rest stay in the stream for other workers
+        return self.batch if self.dispatcher is None else max(1, min(self.batch, self.dispatcher.room()))
+
+    async def read(self, block_ms: Optional[int] = None) -> int:
+        """Handle new entries, waiting up to block_ms for some; returns how many were handled"""
+        response = await self.redis.xreadgroup(self.group, self.consumer, {self.stream: ">"}, count=self._read_count(),
+                                               block=self.block_ms if block_ms is None else block_ms)
+        entries = [entry for _, stream_entries in response or [] for entry in stream_entries]
+        return await self._handle_all(entries)
+
+    async def recover(self) -> int:
+        """Handle entries this consumer name read but never acknowledged, e.g. before a restart"""
+        handled = 0
+        last_id = "0"
+        while True:
+            response = await self.redis.xreadgroup(self.group, self.consumer, {self.stream: last_id}, count=self._read_count())
+            entries = [entry for _, stream_entries in response or [] for entry in stream_entries]
+            if not entries:
+                return handled
+            handled += await self._handle_all(entries, await self._deliveries([entry_id for entry_id, _ in entries]))
+            # Failed entries stay pending; carry on after them instead of re-reading them
+            last_id = entries[-1][0]
+
+    async def reclaim(self) -> int:
+        """Take over entries left idle by other consumers and handle them"""
+        self._last_reclaim = time.monotonic()
+        handled = 0
+        start_id = "0-0"
+        while True:
+            response = await self.redis.xautoclaim(self.stream, self.group, self.consumer,
+                                                   min_idle_time=self.claim_idle_ms, start_id=start_id, count=self._read_count())
+            start_id, entries = response[0], response[1]
+            if entries:
+                logger.info(f"Reclaimed {len(entries)} idle {self.stream} entries")
+                self.reclaimed += len(entries)
+                handled += await self._handle_all(entries, await self._deliveries([entry_id for entry_id, _ in entries]))
+            if start_id in ("0-0", b"0-0"):
+                return handled
+
+    async def run(self) -> None:
+        await self.ensure_group()
+        await self.recover()
+        logger.info(f"Consuming {self.stream} as {self.consumer} in group {self.group}")
+        while True:
+            try:
+                if time.monotonic() - self._last_reclaim >= self.claim_idle_ms / 1000:
+                    await self.reclaim()
+                await self.read()
+                # Yield even when a read returns without blocking (e.g. an empty stream on some servers)
+                await asyncio.sleep(0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.stream} consumer error: {e}")
+                await asyncio.sleep(1)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "stream": self.stream,
+            "group": self.group,
+            "consumer": self.consumer,
+            "processed": self.processed,
+            "failed": self.failed,
+            "reclaimed": self.reclaimed,
+            "dead_lettered": self.dead_lettered
+        }
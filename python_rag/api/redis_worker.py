@@ -5,6 +5,7 @@ import json
 import base64
 from services.file_utils import extract_text_from_file, chunk_text
 from services.embedding import generate_embedding
+from db.vector_codec import to_vector_array
 from config import REDIS_HOST, REDIS_PORT, QA_MODEL
 
 REDIS_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}"
@@ -54,18 +55,18 @@ async def handle_ingest(redis_conn, db_pool, model):
             for chunk in chunks:
                 if chunk.strip():
                     embedding = await generate_embedding(chunk, model)
-                    embedding_str = "[" + ",".join([str(x) for x in embedding.tolist()]) + "]"
+                    embedding_vector = to_vector_array(embedding)
                     await conn.execute(
                         "INSERT INTO documents (content, embedding) VALUES ($1, $2)",
-                        chunk, embedding_str
+                        chunk, embedding_vector
                     )
 
-        # Convert embedding to pgvector string format
-        embedding_str = "[" + ",".join(str(x) for x in embedding) + "]"
+        # Store the full-text row with the last chunk embedding
+        embedding_vector = to_vector_array(embedding)
         async with db_pool.acquire() as conn:
             await conn.execute(
                 "INSERT INTO documents (content, embedding) VALUES ($1, $2)",
-                text, embedding_str
+                text, embedding_vector
             )
         print("Publishing ingest success response")
         await redis_conn.publish("ingest_responses", json.dumps({
@@ -90,13 +91,13 @@ async def handle_query(redis_conn, db_pool, model):
             }))
             continue
         query_embedding = await generate_embedding(question, model)
-        embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
+        query_vector = to_vector_array(query_embedding)
         async with db_pool.acquire() as conn:
             rows = await conn.fetch("""
                 SELECT content FROM documents
                 ORDER BY embedding <-> $1::vector
                 LIMIT 5
-            """, embedding_str)
+            """, query_vector)
 
         context = " ".join([r["content"] for r in rows]) if rows else ""
         if context:
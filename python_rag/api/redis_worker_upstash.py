@@ -1,133 +1,124 @@
 import asyncio
+import signal
+import asyncpg
 import redis.asyncio as redis
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
 import json
 import base64
-import hashlib
 import time
 from utils.logger import logger
-from services.embedding_gemini import (
-    generate_query_embedding_gemini,
-    get_answer_gemini,
-    start_heartbeat
-)
-from services.batch_processor import process_embeddings_batch
+from services.embedding_gemini import start_heartbeat
+from services.answer_cache import answer_from_chunks, stream_answer_from_chunks
+from services.retrieval import retrieve
+from services.admission import INGEST, QUERY, Overloaded, get_admission_controller
 from services.text_processor import TextProcessor
+from services.ingest_pipeline import IngestPipeline
+from services.blob_store import get_blob_store
+from services.batch_processor import EmbeddingFailed
+from services.rate_limiter import is_retryable_error
 from db.document_manager import DocumentManager
 from db.database import get_db_pool, create_documents_table
-from config import REDIS_URL
+from db.retrieval_backend import init_retrieval_backend
+from db.index_manager import get_index_manager
+from config import (
+    REDIS_URL, REDIS_TRANSPORT, WORKER_INGEST_CONCURRENCY, WORKER_QUERY_CONCURRENCY, WORKER_QUEUE_SIZE,
+    WORKER_DRAIN_TIMEOUT, INLINE_PAYLOAD_MAX_BYTES, BLOB_DONE_TTL, MAX_INGEST_BYTES, INGEST_CHUNK_TOKENS, EMBEDDING_MAX_TOKENS
+)
+from utils.task_dispatcher import TaskDispatcher
+from api.redis_streams import StreamConsumer
+from typing import List
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Separate pools, so queries never wait behind a long ingest. Each ingest may use up to
+# DB_INSERT_CONCURRENCY pooled connections, so keep WORKER_INGEST_CONCURRENCY small
+ingest_dispatcher = TaskDispatcher("ingest", WORKER_INGEST_CONCURRENCY, WORKER_QUEUE_SIZE)
+query_dispatcher = TaskDispatcher("query", WORKER_QUERY_CONCURRENCY, WORKER_QUEUE_SIZE)
+_stream_consumers: List[StreamConsumer] = []
+
+def query_stream_channel(request_id: str) -> str:
+    """Channel that streamed answer pieces for a query request are published on"""
+    return f"query_stream:{request_id}"
+
 class IngestProcessor:
     """Handle document ingestion workflow"""
     
     def __init__(self, db_pool):
-        self.text_processor = TextProcessor(max_chunk_size=500)
+        max_tokens = min(INGEST_CHUNK_TOKENS, EMBEDDING_MAX_TOKENS) if INGEST_CHUNK_TOKENS > 0 else None
+        self.text_processor = TextProcessor(max_chunk_size=500, max_tokens=max_tokens)
         self.document_manager = DocumentManager(db_pool)
+        self.pipeline = IngestPipeline(self.text_processor, self.document_manager)
     
     async def process_ingest_request(self, data: dict) -> dict:
-        """Process a complete ingest request with hash-based deduplication"""
-        overall_start_time = time.time()
-        
-        file_content = base64.b64decode(data['file_content'])
+        """
+        Process a complete ingest request through the streaming pipeline. The file
+        arrives either inline as base64 (`file_content`) or as a blob store reference
+        (`payload_ref` plus sha256 `checksum`), which is read without copying and
+        expires BLOB_DONE_TTL seconds after the ingest succeeded.
+        """
         filename = data['filename']
         request_id = data['request_id']
         
-        logger.info(f"Processing: {filename} ({len(file_content)} bytes)")
-        
-        # Validate file size
-        validation_start = time.time()
-        self.text_processor.validate_file_size(file_content, max_size_mb=5)
-        validation_time = time.time() - validation_start
-        logger.timing("File validation", validation_time)
-        
-        # Extract and chunk text
-        text_processing_start = time.time()
-        text, chunks = await self.text_processor.process_file_content(filename, file_content)
-        text_processing_time = time.time() - text_processing_start
-        logger.timing("Text extraction & chunking", text_processing_time)
-        logger.debug(f"Generated {len(chunks)} chunks")
+        if 'payload_ref' not in data:
+            file_content = base64.b64decode(data['file_content'])
+            self.text_processor.validate_file_size(len(file_content), max_bytes=INLINE_PAYLOAD_MAX_BYTES)
+            return await self._ingest(filename, request_id, file_content)
         
-        # Generate hashes for all chunks
-        hash_generation_start = time.time()
-        chunk_hash_map = {}
-        chunk_hashes = []
-        for chunk in chunks:
-            content_hash = hashlib.sha256(chunk.encode()).hexdigest()
-            chunk_hash_map[content_hash] = chunk
-            chunk_hashes.append(content_hash)
-        hash_generation_time = time.time() - hash_generation_start
-        logger.timing("Hash generation", hash_generation_time)
+        store = get_blob_store()
+        ref = data['payload_ref']
+        size = await store.size(ref)
+        if size is None:
+            raise ValueError(f"Payload {ref} not found (expired or never written)")
+        self.text_processor.validate_file_size(size)
+        async with store.open(ref, data.get('checksum')) as payload:
+            result = await self._ingest(filename, request_id, payload.view, payload.path)
+        # Not deleted outright: a stream entry redelivered before its ack must still find the file
+        await store.expire(ref, BLOB_DONE_TTL)
+        return result
+    
+    async def _ingest(self, filename: str, request_id: str, file_content, path=None) -> dict:
+        overall_start_time = time.time()
+        logger.info(f"Processing: {filename} ({len(file_content)} bytes)")
         
-        # Bulk check for existing hashes
-        dedup_start_time = time.time()
-        existing_hashes = await self.document_manager.find_existing_chunk_hashes(chunk_hashes)
-        check_time = time.time() - dedup_start_time
-        logger.timing("Database deduplication check", check_time)
+        # Extract -> chunk -> dedup -> embed -> write, overlapped through bounded queues
+        stats = await self.pipeline.run(filename, file_content, ingest_id=request_id, path=path)
+        for stage, stage_time in stats["stage_time"].items():
+            logger.timing(f"Pipeline stage '{stage}'", stage_time)
         
-        # Filter out existing chunks
-        filtering_start = time.time()
-        new_chunks = [chunk_hash_map[h] for h in chunk_hashes if h not in existing_hashes]
-        filtering_time = time.time() - filtering_start
-        logger.timing("Chunk filtering", filtering_time)
+        if not stats["total_chunks"]:
+            raise ValueError("No text extracted from file")
         
-        logger.info(f"Processing: {len(new_chunks)}/{len(chunks)} new chunks (skipping {len(existing_hashes)} duplicates)")
+        total_time = time.time() - overall_start_time
+        logger.info(f"Processed: {stats['processed_chunks']}/{stats['total_chunks']} new chunks (skipped {stats['skipped_chunks']} duplicates)")
         
-        if not new_chunks:
-            total_time = time.time() - overall_start_time
+        if not stats["processed_chunks"]:
             logger.info(f"All chunks already exist - Total time: {total_time:.3f}s")
             return {
                 "status": "success",
                 "request_id": request_id,
                 "processed_chunks": 0,
-                "skipped_chunks": len(existing_hashes),
+                "skipped_chunks": stats["skipped_chunks"],
                 "message": "All chunks already exist",
                 "processing_time": f"{total_time:.2f}s"
             }
         
-        # Generate embeddings for new chunks only
-        embedding_start_time = time.time()
-        logger.info(f"Starting embedding generation for {len(new_chunks)} chunks")
-        
-        # Use Gemini Batch Mode for large files (>500 chunks)
-        use_batch_mode = len(new_chunks) > 500
-        if use_batch_mode:
-            logger.info("Using Gemini Batch Mode for large file processing")
-        
-        chunk_embedding_pairs = await process_embeddings_batch(
-            new_chunks, 
-            batch_size=75,
-            use_gemini_batch=use_batch_mode
-        )
-        embedding_time = time.time() - embedding_start_time
-        logger.timing("Embedding generation", embedding_time)
-        
-        # Insert to database with hash-based deduplication
-        db_start_time = time.time()
-        logger.debug("Starting database insertion")
-        await self.document_manager.batch_insert_documents_with_hash(chunk_embedding_pairs, batch_size=100)
-        db_time = time.time() - db_start_time
-        logger.timing("Database insertion", db_time)
-        
-        # Calculate total time
-        total_time = time.time() - overall_start_time
-        
         # Performance summary (always logged)
         logger.performance({
             "file": filename,
             "total_time": f"{total_time:.2f}s",
-            "processed_chunks": len(chunk_embedding_pairs),
-            "chunks_per_second": f"{len(new_chunks)/total_time:.1f}",
-            "embedding_efficiency": f"{len(chunk_embedding_pairs)/embedding_time:.1f}/s"
+            "time_to_first_row": f"{stats['time_to_first_row']:.2f}s",
+            "processed_chunks": stats["processed_chunks"],
+            "chunks_per_second": f"{stats['processed_chunks']/total_time:.1f}",
+            "max_queue_depth": stats["max_queue_depth"]
         })
         
         return {
             "status": "success",
             "request_id": request_id,
-            "processed_chunks": len(chunk_embedding_pairs),
-            "skipped_chunks": len(existing_hashes),
-            "total_chunks": len(chunks),
+            "processed_chunks": stats["processed_chunks"],
+            "skipped_chunks": stats["skipped_chunks"],
+            "total_chunks": stats["total_chunks"],
             "processing_time": f"{total_time:.2f}s"
         }
 
@@ -135,10 +126,14 @@ class QueryProcessor:
     """Handle query processing workflow"""
     
     def __init__(self, db_pool):
+        self.db_pool = db_pool
         self.document_manager = DocumentManager(db_pool)
     
-    async def process_query_request(self, data: dict) -> dict:
-        """Process a complete query request"""
+    async def process_query_request(self, data: dict, publish=None) -> dict:
+        """
+        Process a complete query request. With `"stream": true` in the request and a
+        `publish(message)` coroutine, answer pieces are published as they are generated.
+        """
         overall_start_time = time.time()
         
         question = data['question']
@@ -149,27 +144,27 @@ class QueryProcessor:
         
         logger.debug(f"Question: {question[:100]}...")
         
-        # Generate query embedding
-        embedding_start_time = time.time()
-        query_embedding = await generate_query_embedding_gemini(question)
-        embedding_time = time.time() - embedding_start_time
-        logger.timing("Query embedding generation", embedding_time)
+        # Embed and search (vector, hybrid or lexical-only depending on RETRIEVAL_MODE)
+        retrieval = await retrieve(self.db_pool, question, limit=5)
+        for leg, seconds in retrieval.timings.items():
+            logger.timing(f"Retrieval {leg}", seconds)
+        documents = retrieval.chunks
+        logger.debug(f"Found {len(documents)} relevant documents ({retrieval.mode})")
         
-        # Search similar documents
-        search_start_time = time.time()
-        documents = await self.document_manager.search_similar_documents(query_embedding, limit=5)
-        search_time = time.time() - search_start_time
-        logger.timing("Document search", search_time)
-        logger.debug(f"Found {len(documents)} relevant documents")
-        
-        # Generate answer
+        # Generate answer (paraphrases over the same chunks hit the semantic cache)
         answer_start_time = time.time()
-        if documents:
-            context = " ".join(documents)
-            logger.debug(f"Generating answer with {len(context)} chars of context")
-            answer = await get_answer_gemini(question, context)
+        first_token_time = None
+        if data.get('stream') and publish is not None:
+            pieces = []
+            async for piece in stream_answer_from_chunks(question, retrieval.query_embedding, documents):
+                if first_token_time is None:
+                    first_token_time = time.time() - overall_start_time
+                await publish({"request_id": request_id, "seq": len(pieces), "text": piece})
+                pieces.append(piece)
+            answer = "".join(pieces)
+            await publish({"request_id": request_id, "seq": len(pieces), "done": True})
         else:
-            answer = "No relevant documents found."
+            answer = await answer_from_chunks(question, retrieval.query_embedding, documents)
         answer_time = time.time() - answer_start_time
         logger.timing("Answer generation", answer_time)
         
@@ -177,11 +172,15 @@ class QueryProcessor:
         total_time = time.time() - overall_start_time
         
         # Performance summary (always logged)
-        logger.performance({
+        summary = {
             "query_time": f"{total_time:.2f}s",
             "documents_found": len(documents),
+            "retrieval_mode": retrieval.mode,
             "answer_length": len(answer)
-        })
+        }
+        if first_token_time is not None:
+            summary["time_to_first_token"] = f"{first_token_time:.2f}s"
+        logger.performance(summary)
         
         return {
             "status": "success",
@@ -191,7 +190,79 @@ class QueryProcessor:
             "documents_found": len(documents)
         }
 
-# Simplified Redis handlers
+def _is_transient(error: BaseException) -> bool:
+    """Failures another delivery may fix: Postgres, Redis or network trouble, Gemini throttling or outages"""
+    if isinstance(error, Overloaded):
+        # Already answered with retry_after; the caller decides when to try again
+        return False
+    if isinstance(error, asyncpg.DataError):
+        return False
+    return isinstance(error, (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, RedisConnectionError,
+                              RedisTimeoutError, EmbeddingFailed)) or is_retryable_error(error)
+
+# Per-message handling, shared by both transports. Every failure is answered; transient ones
+# are raised again afterwards, so the streams transport leaves the entry pending for a retry
+# instead of acknowledging it. Bad input (e.g. a checksum mismatch) is answered and acknowledged.
+async def process_ingest_message(redis_conn, processor: IngestProcessor, data: dict):
+    request_start = time.time()
+    request_id = data.get('request_id', 'unknown')
+    try:
+        logger.debug(f"Received ingest request: {request_id}")
+        # Ingests already wait in Redis, so they queue for leftover capacity instead of being rejected
+        async with get_admission_controller().admit(INGEST, tenant=data.get('tenant'), max_wait=None):
+            result = await processor.process_ingest_request(data)
+        
+        await redis_conn.publish("ingest_responses", json.dumps(result))
+        
+        total_request_time = time.time() - request_start
+        logger.debug(f"Request {request_id} completed in {total_request_time:.3f}s")
+        
+    except Exception as e:
+        logger.error(f"Ingest error: {e}")
+        await redis_conn.publish("ingest_responses", json.dumps({
+            "status": "error",
+            "detail": str(e),
+            "request_id": request_id
+        }))
+        if _is_transient(e):
+            raise
+
+async def process_query_message(redis_conn, processor: QueryProcessor, data: dict):
+    request_start = time.time()
+    request_id = data.get('request_id', 'unknown')
+    try:
+        logger.debug(f"Received query request: {request_id}")
+        
+        async def publish_piece(piece, channel=query_stream_channel(request_id)):
+            await redis_conn.publish(channel, json.dumps(piece))
+        
+        # The full result still goes to query_responses, streamed or not
+        async with get_admission_controller().admit(QUERY, tenant=data.get('tenant')):
+            result = await processor.process_query_request(data, publish=publish_piece)
+        
+        await redis_conn.publish("query_responses", json.dumps(result))
+        
+        total_request_time = time.time() - request_start
+        logger.debug(f"Query {request_id} completed in {total_request_time:.3f}s")
+        
+    except Exception as e:
+        logger.error(f"Query error: {e}")
+        error = {
+            "status": "error",
+            "detail": str(e),
+            "request_id": request_id
+        }
+        if isinstance(e, Overloaded):
+            # Same meaning as the HTTP API's 429 / 503 + Retry-After
+            error.update(status_code=e.status_code, retry_after=e.retry_after)
+        if data.get('stream'):
+            # Stream subscribers would otherwise wait for a "done" that never comes
+            await redis_conn.publish(query_stream_channel(request_id), json.dumps({**error, "done": True}))
+        await redis_conn.publish("query_responses", json.dumps(error))
+        if _is_transient(e):
+            raise
+
+# Pub/sub transport: every subscribed worker receives every message
 async def handle_ingest(redis_conn, db_pool):
     """Handle ingest requests from Redis"""
     pubsub = redis_conn.pubsub()
@@ -203,27 +274,13 @@ async def handle_ingest(redis_conn, db_pool):
     async for message in pubsub.listen():
         if message is None or message['type'] != 'message':
             continue
-            
         try:
-            request_start = time.time()
             data = json.loads(message['data'])
-            request_id = data.get('request_id', 'unknown')
-            
-            logger.debug(f"Received ingest request: {request_id}")
-            result = await processor.process_ingest_request(data)
-            
-            await redis_conn.publish("ingest_responses", json.dumps(result))
-            
-            total_request_time = time.time() - request_start
-            logger.debug(f"Request {request_id} completed in {total_request_time:.3f}s")
-            
-        except Exception as e:
-            logger.error(f"Ingest error: {e}")
-            await redis_conn.publish("ingest_responses", json.dumps({
-                "status": "error",
-                "detail": str(e),
-                "request_id": data.get('request_id', 'unknown')
-            }))
+        except ValueError as e:
+            logger.error(f"Ingest error: malformed message: {e}")
+            continue
+        # Returns once queued, so the next message is read while this one is processed
+        await ingest_dispatcher.submit(process_ingest_message, redis_conn, processor, data)
 
 async def handle_query(redis_conn, db_pool):
     """Handle query requests from Redis"""
@@ -236,31 +293,30 @@ async def handle_query(redis_conn, db_pool):
     async for message in pubsub.listen():
         if message is None or message['type'] != 'message':
             continue
-            
         try:
-            request_start = time.time()
             data = json.loads(message['data'])
-            request_id = data.get('request_id', 'unknown')
-            
-            logger.debug(f"Received query request: {request_id}")
-            result = await processor.process_query_request(data)
-            
-            await redis_conn.publish("query_responses", json.dumps(result))
-            
-            total_request_time = time.time() - request_start
-            logger.debug(f"Query {request_id} completed in {total_request_time:.3f}s")
-            
-        except Exception as e:
-            logger.error(f"Query error: {e}")
-            await redis_conn.publish("query_responses", json.dumps({
-                "status": "error",
-                "detail": str(e),
-                "request_id": data.get('request_id', 'unknown')
-            }))
+        except ValueError as e:
+            logger.error(f"Query error: malformed message: {e}")
+            continue
+        await query_dispatcher.submit(process_query_message, redis_conn, processor, data)
+
+# Streams transport: one consumer group per stream, each request handled by one worker
+def stream_consumers(redis_conn, db_pool) -> List[StreamConsumer]:
+    """Consumers for the ingest_requests and query_requests streams (see api/redis_streams.py)"""
+    ingest_processor = IngestProcessor(db_pool)
+    query_processor = QueryProcessor(db_pool)
+    return [
+        StreamConsumer(redis_conn, "ingest_requests",
+                       lambda data: process_ingest_message(redis_conn, ingest_processor, data),
+                       dispatcher=ingest_dispatcher),
+        StreamConsumer(redis_conn, "query_requests",
+                       lambda data: process_query_message(redis_conn, query_processor, data),
+                       dispatcher=query_dispatcher)
+    ]
 
 async def start_redis_worker(app):
     """Start Redis worker with heartbeat"""
-    logger.info("Redis worker starting")
+    logger.info(f"Redis worker starting ({REDIS_TRANSPORT} transport)")
     
     await start_heartbeat()
     
@@ -272,26 +328,53 @@ async def start_redis_worker(app):
     
     logger.info("Worker ready to process requests!")
     
-    await asyncio.gather(
-        handle_ingest(redis_conn, app.state.db_pool),
-        handle_query(redis_conn, app.state.db_pool)
-    )
+    if REDIS_TRANSPORT == "streams":
+        _stream_consumers[:] = stream_consumers(redis_conn, app.state.db_pool)
+        await asyncio.gather(*[consumer.run() for consumer in _stream_consumers])
+    else:
+        await asyncio.gather(
+            handle_ingest(redis_conn, app.state.db_pool),
+            handle_query(redis_conn, app.state.db_pool)
+        )
+
+async def stop_redis_worker(worker_task: asyncio.Task, timeout: float = WORKER_DRAIN_TIMEOUT):
+    """Stop reading new messages, then give in-flight requests up to timeout to finish"""
+    worker_task.cancel()
+    await asyncio.gather(worker_task, return_exceptions=True)
+    # Stream entries cancelled here stay pending and are picked up again by another worker
+    cancelled = await asyncio.gather(ingest_dispatcher.drain(timeout), query_dispatcher.drain(timeout))
+    logger.info(f"Redis worker stopped ({sum(cancelled)} requests cancelled)")
+
+def worker_stats() -> dict:
+    """In-flight and queued requests per class, plus stream consumer counters"""
+    return {
+        "transport": REDIS_TRANSPORT,
+        "ingest": ingest_dispatcher.stats(),
+        "query": query_dispatcher.stats(),
+        "consumers": [consumer.stats() for consumer in _stream_consumers]
+    }
 
 # Main function for standalone execution
 async def main():
     """For running the worker standalone"""
     from fastapi import FastAPI
     
-    class AppState:
-        def __init__(self):
-            self.db_pool = None
-    
-    app = AppState()
-    app.db_pool = await get_db_pool()
-    await create_documents_table(app.db_pool)
+    # start_redis_worker reads app.state.db_pool, like it does on the FastAPI app
+    app = FastAPI()
+    app.state.db_pool = await get_db_pool()
+    await create_documents_table(app.state.db_pool)
+    # The API process maintains the index; the worker only needs its probes / ef_search
+    await get_index_manager().refresh(app.state.db_pool)
+    await init_retrieval_backend(app.state.db_pool)
     
     logger.info("Starting Redis worker...")
-    await start_redis_worker(app)
+    worker = asyncio.create_task(start_redis_worker(app))
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await asyncio.wait([worker, asyncio.create_task(stop.wait())], return_when=asyncio.FIRST_COMPLETED)
+    await stop_redis_worker(worker)
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
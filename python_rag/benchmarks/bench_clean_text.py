@@ -0,0 +1,56 @@
+"""
+Benchmark: clean_text_for_db against the previous multi-pass implementation
+
+Usage (from python_rag/):
+    python -m benchmarks.bench_clean_text --sizes 1 5 50
+"""
+import argparse
+import random
+import re
+import time
+from services.file_utils_light import clean_text_for_db
+
+def legacy_clean_text_for_db(text: str) -> str:
+    """The original translate + per-character filter + regex implementation"""
+    if not text:
+        return ""
+    text = text.translate(str.maketrans('', '', '\x00\x08\x0b\x0c\x0e\x0f'))
+    text = ''.join(char for char in text if ord(char) >= 32 or char in '\t\n\r')
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+def make_text(size_mb: float, non_ascii: bool, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyzéü" if non_ascii else "abcdefghijklmnopqrstuvwxyz"
+    words = ["".join(rng.choice(letters) for _ in range(rng.randint(1, 10))) for _ in range(5000)]
+    separators = [" "] * 12 + ["\n", "  ", "\t", " \x00", "\x0c", "\r\n"]
+    target = int(size_mb * 1024 * 1024)
+    parts = []
+    length = 0
+    while length < target:
+        part = rng.choice(words) + rng.choice(separators)
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+def _time(func, text: str) -> float:
+    start = time.perf_counter()
+    func(text)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 5, 50], help="input sizes in MB")
+    args = parser.parse_args()
+
+    for size in args.sizes:
+        for non_ascii in (False, True):
+            text = make_text(size, non_ascii)
+            assert clean_text_for_db(text) == legacy_clean_text_for_db(text)
+            legacy = _time(legacy_clean_text_for_db, text)
+            current = _time(clean_text_for_db, text)
+            label = f"{size:g} MB {'non-ASCII' if non_ascii else 'ASCII'}"
+            print(f"📊 {label:<16} legacy {legacy:7.3f}s  single-pass {current:7.3f}s  ({legacy / current:4.1f}x)")
+
+if __name__ == "__main__":
+    main()
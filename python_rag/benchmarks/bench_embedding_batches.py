@@ -0,0 +1,42 @@
+"""
+Offline throughput benchmark: one embedding request per chunk vs batched requests
+
+Uses FakeEmbeddingBackend, which simulates a per-request round trip plus a small
+per-item cost, so no API key or network is needed.
+
+Usage (from python_rag/):
+    python -m benchmarks.bench_embedding_batches --chunks 1000 --latency 0.05
+"""
+import argparse
+import asyncio
+import time
+from services.batch_processor import process_embeddings_batch
+from services.embedding_backend import FakeEmbeddingBackend, set_embedding_backend, GEMINI_MAX_BATCH_ITEMS
+from services.embedding_cache import EmbeddingCache, set_embedding_cache
+
+async def run(chunks, max_batch_items: int, latency: float, label: str = "") -> None:
+    backend = FakeEmbeddingBackend(request_latency=latency, max_batch_items=max_batch_items)
+    set_embedding_backend(backend)
+    start = time.perf_counter()
+    pairs = await process_embeddings_batch(chunks, batch_size=max_batch_items)
+    elapsed = time.perf_counter() - start
+    print(f"📊 {max_batch_items:>3} items/request{label}: {backend.calls:>5} requests, "
+          f"{elapsed:6.2f}s, {len(pairs) / elapsed:8.1f} chunks/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--chunk-size", type=int, default=500, help="characters per chunk")
+    parser.add_argument("--latency", type=float, default=0.05, help="simulated seconds per request")
+    args = parser.parse_args()
+
+    chunks = [f"{i} " + "x" * args.chunk_size for i in range(args.chunks)]
+    for max_batch_items in (1, 25, GEMINI_MAX_BATCH_ITEMS):
+        # Fresh cache per run, so every chunk goes to the (fake) API
+        set_embedding_cache(EmbeddingCache(":memory:"))
+        asyncio.run(run(chunks, max_batch_items, args.latency))
+    # Same chunks again: served from the embedding cache
+    asyncio.run(run(chunks, GEMINI_MAX_BATCH_ITEMS, args.latency, label=" (warm cache)"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Quantization report: for full float32, int8 scalar and product-quantized
+storage in the memory-mapped store, prints disk size, the bytes a query scans
+(the hot set that has to stay in memory), recall@k against exact search and
+p50/p99 latency.
+
+Synthetic clustered unit vectors stand in for embeddings. With --from-db the
+vectors come from the documents table instead (DB_* settings) and queries are
+drawn from the corpus itself.
+
+Usage (from python_rag/):
+    python -m benchmarks.bench_quantization --rows 50000 --queries 200 --k 10
+    python -m benchmarks.bench_quantization --from-db --pq-subvectors 96 192 --rerank 4 10
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import numpy as np
+from benchmarks.bench_retrieval_backends import DIM, exact_neighbors, make_data
+from db.mmap_store import MmapVectorStore
+from db.quantization import ProductQuantizer, ScalarQuantizer
+
+async def load_documents() -> np.ndarray:
+    from db.database import get_db_pool
+    from db.retrieval_backend import copy_documents
+    pool = await get_db_pool()
+    batches = []
+    await copy_documents(pool, lambda rows: batches.append(np.stack([np.asarray(v, dtype=np.float32) for _, _, v in rows])))
+    await pool.close()
+    return np.concatenate(batches) if batches else np.empty((0, DIM), dtype=np.float32)
+
+def disk_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+def megabytes(size: int) -> str:
+    return f"{size / 1e6:8.1f}MB"
+
+def bench_store(label: str, quantizer, rerank: int, vectors, queries, truth, k: int) -> None:
+    with tempfile.TemporaryDirectory() as path:
+        store = MmapVectorStore(path, DIM, quantizer, rerank)
+        store.append([(i, "", vector) for i, vector in enumerate(vectors)])
+        start = time.perf_counter()
+        store.compact()
+        build_time = time.perf_counter() - start
+        stats = store.stats()
+        # Per query: every code (or vector) plus the norms, and rerank * k full vectors
+        scanned = (stats["code_bytes"] or stats["vector_bytes"]) + 4 * len(vectors)
+        if stats["code_bytes"]:
+            scanned += rerank * k * DIM * 4
+        found, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            found.append([chunk_id for chunk_id, _, _ in store.search(query, k)])
+            latencies.append(time.perf_counter() - start)
+        recall = np.mean([len(set(f) & set(t.tolist())) / k for f, t in zip(found, truth)])
+        latencies = np.array(latencies) * 1000
+        print(f"📊 {label:<22} disk {megabytes(disk_size(path))}  scanned/query {megabytes(scanned)}"
+              f"  recall@{k} {recall:.3f}  p50 {np.percentile(latencies, 50):6.2f}ms"
+              f"  p99 {np.percentile(latencies, 99):6.2f}ms  build {build_time:6.2f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[4])
+    parser.add_argument("--pq-subvectors", type=int, nargs="+", default=[96])
+    parser.add_argument("--from-db", action="store_true", help="use the embeddings in the documents table")
+    args = parser.parse_args()
+
+    if args.from_db:
+        vectors = asyncio.run(load_documents())
+        rng = np.random.default_rng(1)
+        queries = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+        queries = queries + 0.01 * rng.standard_normal(queries.shape).astype(np.float32)
+    else:
+        vectors, queries = make_data(args.rows, args.queries)
+    truth = exact_neighbors(vectors, queries, args.k)
+    print(f"🔎 {len(vectors)} rows x {DIM} dims, {len(queries)} queries, k={args.k}")
+
+    bench_store("float32", None, 1, vectors, queries, truth, args.k)
+    for rerank in args.rerank:
+        bench_store(f"int8 rerank={rerank}", ScalarQuantizer(DIM), rerank, vectors, queries, truth, args.k)
+        for subvectors in args.pq_subvectors:
+            bench_store(f"pq{subvectors} rerank={rerank}", ProductQuantizer(DIM, subvectors), rerank,
+                        vectors, queries, truth, args.k)
+
+if __name__ == "__main__":
+    main()
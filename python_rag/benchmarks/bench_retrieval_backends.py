@@ -0,0 +1,144 @@
+"""
+Retrieval benchmark: recall@k and p50/p99 latency of the local HNSW index
+(NumPy, and hnswlib when installed) and the memory-mapped store against exact
+brute force, and optionally against pgvector's ivfflat index.
+
+Synthetic clustered unit vectors stand in for embeddings. The pgvector leg
+needs a reachable database (DB_* settings) and loads a scratch table
+`bench_documents`, which is dropped afterwards.
+
+Usage (from python_rag/):
+    python -m benchmarks.bench_retrieval_backends --rows 5000 --queries 200 --k 10
+    python -m benchmarks.bench_retrieval_backends --rows 20000 --pgvector --probes 1 10
+"""
+import argparse
+import asyncio
+import math
+import tempfile
+import time
+import numpy as np
+from db.hnsw_index import HNSWIndex, HnswlibIndex, hnswlib
+from db.mmap_store import MmapVectorStore
+
+DIM = 768
+
+def make_data(rows: int, queries: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(10, rows // 200), DIM))
+
+    def sample(count):
+        points = centers[rng.integers(0, len(centers), count)] + 0.6 * rng.standard_normal((count, DIM))
+        return (points / np.linalg.norm(points, axis=1, keepdims=True)).astype(np.float32)
+
+    return sample(rows), sample(queries)
+
+def exact_neighbors(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    # |q - v|^2 ranks the same as -2 q.v for unit vectors
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+def report(label: str, found, truth: np.ndarray, latencies, build_time=None) -> None:
+    k = truth.shape[1]
+    recall = np.mean([len(set(f) & set(t.tolist())) / k for f, t in zip(found, truth)])
+    latencies = np.array(latencies) * 1000
+    build = f"  build {build_time:7.2f}s" if build_time is not None else ""
+    print(f"📊 {label:<24} recall@{k} {recall:.3f}  p50 {np.percentile(latencies, 50):7.2f}ms"
+          f"  p99 {np.percentile(latencies, 99):7.2f}ms{build}")
+
+def bench_index(label: str, index, vectors, queries, truth, k: int, ef_values) -> None:
+    start = time.perf_counter()
+    index.add(range(len(vectors)), vectors)
+    build_time = time.perf_counter() - start
+    for ef in ef_values:
+        found, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            labels, _ = index.search(query, k, ef=ef)
+            latencies.append(time.perf_counter() - start)
+            found.append(labels)
+        report(f"{label} ef={ef}", found, truth, latencies, build_time)
+
+def bench_brute_force(vectors, queries, truth, k: int) -> None:
+    found, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        scores = vectors @ query
+        top = np.argpartition(-scores, k)[:k]
+        found.append(top[np.argsort(-scores[top])].tolist())
+        latencies.append(time.perf_counter() - start)
+    report("numpy brute force", found, truth, latencies)
+
+def bench_mmap(vectors, queries, truth, k: int) -> None:
+    with tempfile.TemporaryDirectory() as path:
+        store = MmapVectorStore(path, DIM)
+        start = time.perf_counter()
+        store.append([(i, "", vector) for i, vector in enumerate(vectors)])
+        store.compact()
+        build_time = time.perf_counter() - start
+        start = time.perf_counter()
+        store = MmapVectorStore(path, DIM)
+        print(f"📊 {'mmap store open':<24} {(time.perf_counter() - start) * 1000:.2f}ms")
+        found, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            found.append([chunk_id for chunk_id, _, _ in store.search(query, k)])
+            latencies.append(time.perf_counter() - start)
+        report("mmap store", found, truth, latencies, build_time)
+
+async def bench_pgvector(vectors, queries, truth, k: int, probes_list) -> None:
+    from db.database import get_db_pool
+    pool = await get_db_pool()
+    lists = max(1, int(math.sqrt(len(vectors))))
+    async with pool.acquire() as conn:
+        await conn.execute("DROP TABLE IF EXISTS bench_documents")
+        await conn.execute("CREATE TABLE bench_documents (id INTEGER PRIMARY KEY, embedding vector(768) NOT NULL)")
+        start = time.perf_counter()
+        await conn.copy_records_to_table(
+            "bench_documents",
+            records=[(i, vector) for i, vector in enumerate(vectors)],
+            columns=["id", "embedding"]
+        )
+        await conn.execute(f"CREATE INDEX ON bench_documents USING ivfflat (embedding vector_l2_ops) WITH (lists = {lists})")
+        await conn.execute("ANALYZE bench_documents")
+        build_time = time.perf_counter() - start
+        try:
+            for probes in probes_list:
+                found, latencies = [], []
+                for query in queries:
+                    start = time.perf_counter()
+                    async with conn.transaction():
+                        await conn.execute(f"SET LOCAL ivfflat.probes = {int(probes)}")
+                        rows = await conn.fetch(
+                            "SELECT id FROM bench_documents ORDER BY embedding <-> $1::vector LIMIT $2", query, k
+                        )
+                    latencies.append(time.perf_counter() - start)
+                    found.append([row["id"] for row in rows])
+                report(f"pgvector ivfflat p={probes}", found, truth, latencies, build_time)
+        finally:
+            await conn.execute("DROP TABLE IF EXISTS bench_documents")
+    await pool.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--pgvector", action="store_true", help="also benchmark pgvector ivfflat (needs DB_* settings)")
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 10])
+    args = parser.parse_args()
+
+    vectors, queries = make_data(args.rows, args.queries)
+    truth = exact_neighbors(vectors, queries, args.k)
+    print(f"🔎 {args.rows} rows x {DIM} dims, {args.queries} queries, k={args.k}")
+
+    bench_brute_force(vectors, queries, truth, args.k)
+    bench_mmap(vectors, queries, truth, args.k)
+    bench_index("numpy hnsw", HNSWIndex(DIM), vectors, queries, truth, args.k, args.ef_search)
+    if hnswlib is not None:
+        bench_index("hnswlib", HnswlibIndex(DIM), vectors, queries, truth, args.k, args.ef_search)
+    if args.pgvector:
+        asyncio.run(bench_pgvector(vectors, queries, truth, args.k, args.probes))
+
+if __name__ == "__main__":
+    main()
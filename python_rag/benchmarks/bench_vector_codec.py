@@ -0,0 +1,52 @@
+"""
+Micro-benchmark: pgvector text literals vs the binary vector codec
+
+Usage (from python_rag/):
+    python -m benchmarks.bench_vector_codec --counts 1000 100000
+"""
+import argparse
+import time
+import numpy as np
+from db.vector_codec import encode_vector, decode_vector
+
+DIM = 768
+
+def encode_text(embedding) -> str:
+    return "[" + ",".join([str(x) for x in embedding]) + "]"
+
+def decode_text(literal: str) -> list:
+    return [float(x) for x in literal[1:-1].split(",")]
+
+def _time(label: str, func, items) -> float:
+    start = time.perf_counter()
+    out = [func(item) for item in items]
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<28} {elapsed:8.3f}s  ({len(items) / elapsed:>12,.0f} vectors/s)")
+    return out
+
+def run(count: int) -> None:
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((count, DIM)).astype(np.float32)
+    # Gemini returns plain Python lists, so time the text path on those
+    as_lists = matrix.tolist()
+
+    print(f"\n📊 {count:,} vectors x {DIM} dims")
+    literals = _time("text encode (str/join)", encode_text, as_lists)
+    payloads = _time("binary encode (list input)", encode_vector, as_lists)
+    _time("binary encode (ndarray)", encode_vector, list(matrix))
+    _time("text decode (float parse)", decode_text, literals)
+    _time("binary decode", decode_vector, payloads)
+
+    text_bytes = sum(len(s) for s in literals)
+    binary_bytes = sum(len(b) for b in payloads)
+    print(f"  wire size: text {text_bytes / 1e6:.1f} MB vs binary {binary_bytes / 1e6:.1f} MB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 100000])
+    args = parser.parse_args()
+    for count in args.counts:
+        run(count)
+
+if __name__ == "__main__":
+    main()
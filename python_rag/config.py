@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -22,17 +23,139 @@ DB_USER = os.getenv("DB_USER", "postgres")
 DB_PASSWORD = os.getenv("DB_PASS", "")
 DB_HOST = os.getenv("DB_HOST", "aws-0-us-east-2.pooler.supabase.com")
 DB_PORT = os.getenv("DB_PORT", "6543")
+# Max pooled connections a single ingest may use for sharded inserts (pool max_size is 10)
+DB_INSERT_CONCURRENCY = int(os.getenv("DB_INSERT_CONCURRENCY", "4"))
 
 # Upstash Redis
 REDIS_URL = os.getenv('REDIS_URL', "cunning-marlin-19914.upstash.io")
 REDIS_HOST = os.getenv("REDIS_HOST", "cunning-marlin-19914.upstash.io")
 REDIS_PORT = os.getenv("REDIS_PORT", "6379")
 # REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", "your-redis-password")
+# Worker transport: "pubsub" (every worker sees every message) or "streams" (Redis Streams
+# consumer group: each request goes to one worker, unacknowledged ones are reclaimed)
+REDIS_TRANSPORT = os.getenv("REDIS_TRANSPORT", "pubsub")
+REDIS_STREAM_GROUP = os.getenv("REDIS_STREAM_GROUP", "rag-workers")
+REDIS_CONSUMER_NAME = os.getenv("REDIS_CONSUMER_NAME", f"{socket.gethostname()}-{os.getpid()}")
+REDIS_STREAM_BLOCK_MS = int(os.getenv("REDIS_STREAM_BLOCK_MS", "5000"))
+# Entries pending this long on a consumer that stopped renewing them are claimed by another
+REDIS_CLAIM_IDLE_MS = int(os.getenv("REDIS_CLAIM_IDLE_MS", "60000"))
+# Deliveries after which an entry is moved to <stream>:dead instead of retried again
+REDIS_MAX_DELIVERIES = int(os.getenv("REDIS_MAX_DELIVERIES", "5"))
+REDIS_STREAM_MAXLEN = int(os.getenv("REDIS_STREAM_MAXLEN", "100000"))
+# Requests the worker handles at once, per class, and how many more may wait for a slot
+WORKER_INGEST_CONCURRENCY = int(os.getenv("WORKER_INGEST_CONCURRENCY", "2"))
+WORKER_QUERY_CONCURRENCY = int(os.getenv("WORKER_QUERY_CONCURRENCY", "16"))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "100"))
+# On shutdown, seconds in-flight requests get to finish before they are cancelled
+WORKER_DRAIN_TIMEOUT = float(os.getenv("WORKER_DRAIN_TIMEOUT", "30"))
+# Admission control shared by the API and the worker: at most ADMISSION_CAPACITY requests run
+# at once, ADMISSION_QUERY_RESERVE of them only for queries. Requests that would queue longer
+# than their SLO (seconds) get 503 + Retry-After; a tenant over ADMISSION_TENANT_LIMIT gets 429
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", "10"))
+ADMISSION_QUERY_RESERVE = int(os.getenv("ADMISSION_QUERY_RESERVE", "8"))
+ADMISSION_QUERY_SLO = float(os.getenv("ADMISSION_QUERY_SLO", "5"))
+ADMISSION_INGEST_SLO = float(os.getenv("ADMISSION_INGEST_SLO", "30"))
+ADMISSION_TENANT_LIMIT = int(os.getenv("ADMISSION_TENANT_LIMIT", "8"))
+# Tenants are keyed by client address. Name a header here (e.g. X-Tenant-ID) only when a trusted
+# gateway sets it after authenticating the caller; clients could otherwise pick any tenant
+ADMISSION_TENANT_HEADER = os.getenv("ADMISSION_TENANT_HEADER", "")
+# Ingest file payloads: base64 inside the message (at most INLINE_PAYLOAD_MAX_BYTES), or written
+# once to a blob store with only a reference and a sha256 checksum in the message. BLOB_STORE is
+# "disk" (files in BLOB_STORE_PATH, shared with the producer) or "redis" (keys expiring after BLOB_TTL s)
+BLOB_STORE = os.getenv("BLOB_STORE", "disk")
+BLOB_STORE_PATH = os.getenv("BLOB_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "blobs"))
+BLOB_TTL = int(os.getenv("BLOB_TTL", "86400"))
+# After a successful ingest the blob is kept this much longer (seconds), so a redelivered stream entry still finds it
+BLOB_DONE_TTL = int(os.getenv("BLOB_DONE_TTL", "600"))
+INLINE_PAYLOAD_MAX_BYTES = int(os.getenv("INLINE_PAYLOAD_MAX_BYTES", str(5 * 1024 * 1024)))
+MAX_INGEST_BYTES = int(os.getenv("MAX_INGEST_BYTES", str(200 * 1024 * 1024)))
+
+# Text extraction (PDF/DOCX parsing runs in a process pool; 0 runs it in a thread instead)
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACTION_PAGE_TIMEOUT = float(os.getenv("EXTRACTION_PAGE_TIMEOUT", "30"))
 
 # Models
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", 'sentence-transformers/all-MiniLM-L6-v2')
 QA_MODEL = os.getenv("QA_MODEL", 'distilbert-base-cased-distilled-squad')
 
+# Input window of the Gemini embedding model (text-embedding-004)
+EMBEDDING_MAX_TOKENS = int(os.getenv("EMBEDDING_MAX_TOKENS", "2048"))
+# Worker ingest chunk size in estimated tokens; 0 keeps 500-character chunks (split further
+# only where one would exceed EMBEDDING_MAX_TOKENS)
+INGEST_CHUNK_TOKENS = int(os.getenv("INGEST_CHUNK_TOKENS", "0"))
+# Total characters sent in one batched embedding request
+EMBEDDING_BATCH_MAX_CHARS = int(os.getenv("EMBEDDING_BATCH_MAX_CHARS", "200000"))
+# Embedding requests in flight: the adaptive limiter starts at the initial value
+# and grows up to the maximum while the API responds without throttling
+EMBEDDING_INITIAL_CONCURRENCY = int(os.getenv("EMBEDDING_INITIAL_CONCURRENCY", "4"))
+EMBEDDING_MAX_CONCURRENT_REQUESTS = int(os.getenv("EMBEDDING_MAX_CONCURRENT_REQUESTS", "32"))
+# Persistent embedding cache shared by the API and the Redis worker
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_MB = int(os.getenv("EMBEDDING_CACHE_MAX_MB", "512"))
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "4096"))
+# Where nearest-neighbour search runs: "pgvector" (Postgres), "hnsw" (in-process index)
+# or "mmap" (exact search over memory-mapped files in MMAP_STORE_PATH)
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "pgvector")
+# Local backends pick up other processes' writes when the corpus version moves, and at least
+# this often (seconds) in case a write bypassed the corpus version trigger
+LOCAL_INDEX_SYNC_SECONDS = float(os.getenv("LOCAL_INDEX_SYNC_SECONDS", "60"))
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "100"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+MMAP_STORE_PATH = os.getenv("MMAP_STORE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "vectors"))
+# Fold the mmap store's append log into its base segment once it holds this many rows
+MMAP_COMPACT_ROWS = int(os.getenv("MMAP_COMPACT_ROWS", "20000"))
+# Compressed search in the mmap store: "none", "int8" (scalar) or "pq" (product quantization,
+# PQ_SUBVECTORS bytes per vector); the best QUANTIZATION_RERANK * k candidates are re-ranked exactly
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+PQ_SUBVECTORS = int(os.getenv("PQ_SUBVECTORS", "96"))
+QUANTIZATION_RERANK = int(os.getenv("QUANTIZATION_RERANK", "4"))
+# pgvector ANN index on documents.embedding (see db/index_manager.py): "ivfflat" or "hnsw",
+# distance "cosine", "l2" or "ip"; probes / ef_search follow the recall target unless set explicitly
+PGVECTOR_INDEX_TYPE = os.getenv("PGVECTOR_INDEX_TYPE", "ivfflat")
+PGVECTOR_DISTANCE = os.getenv("PGVECTOR_DISTANCE", "cosine")
+PGVECTOR_RECALL_TARGET = float(os.getenv("PGVECTOR_RECALL_TARGET", "0.95"))
+PGVECTOR_PROBES = int(os.getenv("PGVECTOR_PROBES", "0"))
+PGVECTOR_EF_SEARCH = int(os.getenv("PGVECTOR_EF_SEARCH", "0"))
+PGVECTOR_HNSW_M = int(os.getenv("PGVECTOR_HNSW_M", "16"))
+PGVECTOR_HNSW_EF_CONSTRUCTION = int(os.getenv("PGVECTOR_HNSW_EF_CONSTRUCTION", "64"))
+# Rebuild the ivfflat index once the table has grown by this factor since the last build
+PGVECTOR_REINDEX_GROWTH = float(os.getenv("PGVECTOR_REINDEX_GROWTH", "2.0"))
+PGVECTOR_INDEX_BUILD_TIMEOUT = float(os.getenv("PGVECTOR_INDEX_BUILD_TIMEOUT", "3600"))
+# Retrieval mode: "vector" or "hybrid" (Postgres full-text and vector search fused with RRF).
+# In hybrid mode keyword-like queries (codes, error strings) try full-text alone first and
+# skip the embedding call when it finds matches
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "vector")
+FULLTEXT_CONFIG = os.getenv("FULLTEXT_CONFIG", "english")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+LEXICAL_FAST_PATH = os.getenv("LEXICAL_FAST_PATH", "true").lower() == "true"
+# Reranking: over-fetch RERANK_CANDIDATES chunks and keep the best RERANK_TOP_K for the prompt.
+# RERANKER is "none", "heuristic", "onnx" (cross-encoder in RERANK_MODEL_DIR: model.onnx +
+# tokenizer.json) or "auto" (onnx when available, else heuristic)
+RERANKER = os.getenv("RERANKER", "none")
+RERANK_MODEL_DIR = os.getenv("RERANK_MODEL_DIR", "")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", "3"))
+RERANK_BATCH_SIZE = int(os.getenv("RERANK_BATCH_SIZE", "16"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "2"))
+# Corpus version (a counter in Postgres every write to documents bumps): how long (seconds) a read of it is reused
+CORPUS_VERSION_MAX_AGE = float(os.getenv("CORPUS_VERSION_MAX_AGE", "1"))
+# Retrieval cache: top-k results per quantized query embedding, tagged with the corpus version
+RETRIEVAL_CACHE_PATH = os.getenv("RETRIEVAL_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "retrieval.sqlite3"))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "10000"))
+RETRIEVAL_CACHE_MEMORY_ITEMS = int(os.getenv("RETRIEVAL_CACHE_MEMORY_ITEMS", "1024"))
+# Semantic answer cache: paraphrased questions that retrieve the same chunks reuse an answer
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.92"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Context packing: merged, de-duplicated chunks are packed best-first into at most this many
+# prompt tokens; chunks overlapping by at least CONTEXT_MIN_OVERLAP_CHARS are stitched together
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+CONTEXT_DEDUP_SIMILARITY = float(os.getenv("CONTEXT_DEDUP_SIMILARITY", "0.85"))
+CONTEXT_MIN_OVERLAP_CHARS = int(os.getenv("CONTEXT_MIN_OVERLAP_CHARS", "20"))
+
 DATASET = os.getenv("DATASET", 'ag_news')
 
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '');
\ No newline at end of file
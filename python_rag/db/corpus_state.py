@@ -0,0 +1,88 @@
+import asyncio
+import time
+from typing import Callable, List, Optional
+from config import CORPUS_VERSION_MAX_AGE
+from utils.logger import logger
+
+CorpusListener = Callable[[str], None]
+
+_listeners: List[CorpusListener] = []
+
+class CorpusVersion:
+    """
+    Monotonically increasing version of the document set, kept in Postgres.
+    A statement trigger on documents (db/database.py) bumps it inside the
+    writing transaction, so every writer moves it - this process, stream
+    workers on other hosts, the Vercel app - and the new version becomes
+    visible together with the rows. Caches tag entries with the version they
+    were computed at and treat older entries as stale.
+
+    A read is reused for up to max_age seconds; this process's own writes
+    invalidate it at once through notify_corpus_change.
+    """
+
+    def __init__(self, max_age: float = CORPUS_VERSION_MAX_AGE):
+        self.max_age = max_age
+        self.last_seen: Optional[int] = None
+        self._read_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> bool:
+        return self.last_seen is not None and time.monotonic() - self._read_at < self.max_age
+
+    async def _read(self, db_pool) -> int:
+        conn = await db_pool.acquire()
+        try:
+            # Writers bump one of several slots, so the version is their sum
+            return await conn.fetchval("SELECT COALESCE(SUM(version), 0) FROM corpus_version")
+        finally:
+            await db_pool.release(conn)
+
+    async def current(self, db_pool) -> int:
+        if self._fresh():
+            return self.last_seen
+        async with self._lock:
+            if self._fresh():
+                return self.last_seen
+            generation = self._generation
+            version = int(await self._read(db_pool))
+            self.last_seen = version
+            # A write that landed while reading must not be hidden for max_age
+            if generation == self._generation:
+                self._read_at = time.monotonic()
+            return version
+
+    def invalidate(self) -> None:
+        """Read the version from Postgres again on the next call"""
+        self._generation += 1
+        self._read_at = 0.0
+
+_version: Optional[CorpusVersion] = None
+
+def get_corpus_version() -> CorpusVersion:
+    """Process-wide reader of the corpus version in Postgres"""
+    global _version
+    if _version is None:
+        _version = CorpusVersion()
+    return _version
+
+def set_corpus_version(version: Optional[CorpusVersion]) -> None:
+    """Swap the corpus version reader, e.g. for a fake one in tests"""
+    global _version
+    _version = version
+
+def on_corpus_change(listener: CorpusListener) -> CorpusListener:
+    """Register a callback run whenever documents are inserted or removed"""
+    _listeners.append(listener)
+    return listener
+
+async def notify_corpus_change(reason: str) -> None:
+    """Tell caches in this process that depend on the document set; the version in Postgres moved with the write"""
+    get_corpus_version().invalidate()
+    logger.debug(f"Corpus changed ({reason})")
+    for listener in list(_listeners):
+        try:
+            listener(reason)
+        except Exception as e:
+            logger.error(f"Corpus change listener failed: {e}")
@@ -1,8 +1,13 @@
+import re
 import asyncpg
-from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, FULLTEXT_CONFIG
+from db.vector_codec import register_vector_codec
 
 db_pool = None
 
+# FULLTEXT_CONFIG is written into DDL, where it cannot be a bind parameter
+_FULLTEXT_CONFIG_RE = re.compile(r'[a-z_]+')
+
 async def get_db_pool():
     global db_pool
     if db_pool is None:
@@ -15,7 +20,8 @@ async def get_db_pool():
             min_size=1,
             max_size=10,
             statement_cache_size=0,
-            command_timeout=60
+            command_timeout=60,
+            init=register_vector_codec
         )
     return db_pool
 
@@ -37,6 +43,13 @@ async def get_db_pool():
 #             ON documents USING ivfflat (embedding vector_cosine_ops)
 #         """)
 
+async def checked_fulltext_config(conn) -> str:
+    """FULLTEXT_CONFIG, once it is known to name an installed text search configuration"""
+    if not _FULLTEXT_CONFIG_RE.fullmatch(FULLTEXT_CONFIG) or not await conn.fetchval(
+            "SELECT 1 FROM pg_ts_config WHERE cfgname = $1", FULLTEXT_CONFIG):
+        raise ValueError(f"FULLTEXT_CONFIG {FULLTEXT_CONFIG!r} is not a text search configuration in pg_ts_config")
+    return FULLTEXT_CONFIG
+
 # Add this function to create the updated table schema
 
 async def create_documents_table_with_hash(db_pool):
@@ -61,8 +74,8 @@ async def create_documents_table_with_hash(db_pool):
                 );
                 
                 CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents(content_hash);
-                CREATE INDEX IF NOT EXISTS idx_documents_embedding ON documents USING ivfflat (embedding vector_cosine_ops);
             """)
+            # The embedding index is created by db/index_manager.py once there are rows to train it on
             # Add content_hash column if it doesn't exist
             await conn.execute("""
                 ALTER TABLE documents 
@@ -77,6 +90,48 @@ async def create_documents_table_with_hash(db_pool):
             
             print("✅ Added content_hash column and index to documents table")
         
+        # Full-text leg of hybrid retrieval: a generated tsvector kept in step with content
+        fulltext_config = await checked_fulltext_config(conn)
+        await conn.execute(f"""
+            ALTER TABLE documents 
+            ADD COLUMN IF NOT EXISTS content_tsv tsvector 
+            GENERATED ALWAYS AS (to_tsvector('{fulltext_config}', content)) STORED
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_documents_content_tsv 
+            ON documents USING GIN (content_tsv)
+        """)
+        
+        # Rows are tagged with the ingest that wrote them so a failed ingest can be cleaned up
+        await conn.execute("""
+            ALTER TABLE documents 
+            ADD COLUMN IF NOT EXISTS ingest_id VARCHAR(64)
+        """)
+        await conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_documents_ingest_id 
+            ON documents(ingest_id)
+        """)
+        
+        # Corpus version (db/corpus_state.py): every statement writing documents bumps it in the same
+        # transaction, whichever process or app made the write. Writers update one of 16 slots picked
+        # by backend pid, so parallel insert shards don't queue on a single row until they commit.
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS corpus_version (
+                slot INTEGER PRIMARY KEY,
+                version BIGINT NOT NULL DEFAULT 0
+            );
+            INSERT INTO corpus_version (slot) SELECT generate_series(0, 15) ON CONFLICT (slot) DO NOTHING;
+            CREATE OR REPLACE FUNCTION bump_corpus_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE corpus_version SET version = version + 1 WHERE slot = pg_backend_pid() % 16;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+            CREATE OR REPLACE TRIGGER documents_corpus_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON documents
+                FOR EACH STATEMENT EXECUTE FUNCTION bump_corpus_version();
+        """)
+        
     finally:
         await db_pool.release(conn)
 
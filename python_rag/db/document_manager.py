@@ -1,7 +1,22 @@
-# import asyncio
+import asyncio
 import hashlib
-from typing import List, Tuple
+import time
+import uuid
+from typing import List, Optional, Tuple
 # import asyncpg
+from db.vector_codec import to_vector_array, VectorLike
+from config import DB_INSERT_CONCURRENCY, FULLTEXT_CONFIG
+from utils.logger import logger
+from utils.single_flight import retrieval_flight
+from db.corpus_state import get_corpus_version, notify_corpus_change
+from db.retrieval_cache import get_retrieval_cache, retrieval_key
+from db.retrieval_backend import get_retrieval_backend
+from db.index_manager import get_index_manager
+
+# Above this many rows a binary COPY into a staging table beats multi-row INSERTs
+COPY_THRESHOLD_ROWS = 500
+# Above this many rows the load is split into shards written on separate pooled connections
+PARALLEL_THRESHOLD_ROWS = 2000
 
 class DocumentManager:
     """Handle database operations for documents and embeddings"""
@@ -26,10 +41,11 @@ class DocumentManager:
         finally:
             await self.db_pool.release(conn)
     
-    async def batch_insert_documents_with_hash(self, chunk_embedding_pairs: List[Tuple[str, List[float]]], batch_size: int = 50) -> None:
-        """Insert documents with content hash for deduplication"""
+    async def batch_insert_documents_with_hash(self, chunk_embedding_pairs: List[Tuple[str, VectorLike]], batch_size: int = 50, ingest_id: Optional[str] = None) -> int:
+        """Insert documents with content hash for deduplication. Returns number of new rows."""
         print(f"💾 Inserting {len(chunk_embedding_pairs)} documents in batches of {batch_size}")
         
+        inserted = 0
         conn = await self.db_pool.acquire()
         try:
             for i in range(0, len(chunk_embedding_pairs), batch_size):
@@ -39,42 +55,230 @@ class DocumentManager:
                 values = []
                 for chunk, embedding in batch:
                     content_hash = hashlib.sha256(chunk.encode()).hexdigest()
-                    embedding_str = "[" + ",".join([str(x) for x in embedding]) + "]"
-                    values.append((chunk, content_hash, embedding_str))
+                    values.append((chunk, content_hash, to_vector_array(embedding), ingest_id))
                 
                 # Batch insert with ON CONFLICT DO NOTHING for deduplication
                 if values:
                     query = """
-                        INSERT INTO documents (content, content_hash, embedding) 
-                        VALUES """ + ",".join([f"(${i*3+1}, ${i*3+2}, ${i*3+3})" for i in range(len(values))]) + """
+                        INSERT INTO documents (content, content_hash, embedding, ingest_id) 
+                        VALUES """ + ",".join([f"(${i*4+1}, ${i*4+2}, ${i*4+3}, ${i*4+4})" for i in range(len(values))]) + """
                         ON CONFLICT (content_hash) DO NOTHING
                     """
-                    flat_values = [item for triple in values for item in triple]
-                    await conn.execute(query, *flat_values)
+                    flat_values = [item for row in values for item in row]
+                    status = await conn.execute(query, *flat_values)
+                    inserted += int(status.split()[-1])
                     
                 print(f"💾 Inserted batch {i//batch_size + 1}/{(len(chunk_embedding_pairs) + batch_size - 1)//batch_size}")
+            
+            return inserted
         
         finally:
             await self.db_pool.release(conn)
     
-    # Keep existing methods...
-    async def search_similar_documents(self, query_embedding: List[float], limit: int = 5) -> List[str]:
-        """Search for documents similar to the query embedding"""
-        embedding_str = "[" + ",".join([str(x) for x in query_embedding]) + "]"
+    async def copy_insert_documents_with_hash(self, chunk_embedding_pairs: List[Tuple[str, VectorLike]], ingest_id: Optional[str] = None) -> int:
+        """
+        Bulk load documents with binary COPY into a staging table, then merge
+        into documents in the same transaction. Returns number of new rows.
+        """
+        records = [
+            (chunk, hashlib.sha256(chunk.encode()).hexdigest(), to_vector_array(embedding), ingest_id)
+            for chunk, embedding in chunk_embedding_pairs
+        ]
         
         conn = await self.db_pool.acquire()
         try:
-            rows = await conn.fetch("""
-                SELECT content FROM documents
-                ORDER BY embedding <-> $1::vector
-                LIMIT $2
-            """, embedding_str, limit)
-            
-            return [row["content"] for row in rows]
+            async with conn.transaction():
+                await conn.execute("""
+                    CREATE TEMP TABLE documents_staging (
+                        content TEXT NOT NULL,
+                        content_hash VARCHAR(64) NOT NULL,
+                        embedding vector(768) NOT NULL,
+                        ingest_id VARCHAR(64)
+                    ) ON COMMIT DROP
+                """)
+                await conn.copy_records_to_table(
+                    'documents_staging',
+                    records=records,
+                    columns=['content', 'content_hash', 'embedding', 'ingest_id']
+                )
+                status = await conn.execute("""
+                    INSERT INTO documents (content, content_hash, embedding, ingest_id)
+                    SELECT content, content_hash, embedding, ingest_id FROM documents_staging
+                    ON CONFLICT (content_hash) DO NOTHING
+                """)
+            # Status looks like "INSERT 0 <rows>"
+            return int(status.split()[-1])
         
         finally:
             await self.db_pool.release(conn)
     
+    async def _insert_shard(self, chunk_embedding_pairs: List[Tuple[str, VectorLike]], batch_size: int, ingest_id: Optional[str]) -> int:
+        """Write one shard on its own connection, using COPY for large shards"""
+        if len(chunk_embedding_pairs) >= COPY_THRESHOLD_ROWS:
+            return await self.copy_insert_documents_with_hash(chunk_embedding_pairs, ingest_id=ingest_id)
+        return await self.batch_insert_documents_with_hash(chunk_embedding_pairs, batch_size=batch_size, ingest_id=ingest_id)
+    
+    async def parallel_insert_documents_with_hash(
+        self,
+        chunk_embedding_pairs: List[Tuple[str, VectorLike]],
+        ingest_id: str,
+        shards: Optional[int] = None,
+        max_concurrency: int = DB_INSERT_CONCURRENCY,
+        batch_size: int = 100
+    ) -> int:
+        """
+        Split the rows into shards and write them concurrently on separate pooled
+        connections. If any shard fails, the others are cancelled and every row
+        tagged with ingest_id is deleted before the error is re-raised.
+        """
+        max_concurrency = max(1, max_concurrency)
+        shards = max(1, shards or max_concurrency)
+        shard_size = (len(chunk_embedding_pairs) + shards - 1) // shards
+        semaphore = asyncio.Semaphore(max_concurrency)
+        
+        async def write_shard(shard):
+            async with semaphore:
+                return await self._insert_shard(shard, batch_size, ingest_id)
+        
+        tasks = [
+            asyncio.create_task(write_shard(chunk_embedding_pairs[i:i + shard_size]))
+            for i in range(0, len(chunk_embedding_pairs), shard_size)
+        ]
+        logger.debug(f"Writing {len(chunk_embedding_pairs)} rows in {len(tasks)} shards (concurrency {max_concurrency})")
+        
+        try:
+            return sum(await asyncio.gather(*tasks))
+        except (Exception, asyncio.CancelledError):
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    
+    async def insert_documents(
+        self,
+        chunk_embedding_pairs: List[Tuple[str, VectorLike]],
+        batch_size: int = 100,
+        ingest_id: Optional[str] = None
+    ) -> int:
+        """
+        Insert documents, picking parallel shards, COPY or multi-row INSERT based
+        on row count. The request is all-or-nothing: rows are tagged with
+        ingest_id and removed again if any part of the write fails.
+        """
+        if not chunk_embedding_pairs:
+            return 0
+        
+        ingest_id = ingest_id or uuid.uuid4().hex
+        start_time = time.time()
+        row_count = len(chunk_embedding_pairs)
+        try:
+            if row_count >= PARALLEL_THRESHOLD_ROWS:
+                mode = "parallel"
+                inserted = await self.parallel_insert_documents_with_hash(chunk_embedding_pairs, ingest_id, batch_size=batch_size)
+            elif row_count >= COPY_THRESHOLD_ROWS:
+                mode = "copy"
+                inserted = await self.copy_insert_documents_with_hash(chunk_embedding_pairs, ingest_id=ingest_id)
+            else:
+                mode = "insert"
+                inserted = await self.batch_insert_documents_with_hash(chunk_embedding_pairs, batch_size=batch_size, ingest_id=ingest_id)
+        except (Exception, asyncio.CancelledError) as e:
+            logger.error(f"Insert for ingest {ingest_id} failed, rolling back: {e}")
+            await asyncio.shield(self.delete_ingest(ingest_id))
+            raise
+        elapsed = time.time() - start_time
+        
+        logger.performance({
+            "db_insert_mode": mode,
+            "ingest_id": ingest_id,
+            "rows": row_count,
+            "inserted_rows": inserted,
+            "db_time": f"{elapsed:.2f}s",
+            "rows_per_second": f"{row_count / elapsed:.1f}" if elapsed > 0 else "n/a"
+        })
+        if inserted:
+            await self._sync_backend_after_insert(chunk_embedding_pairs, ingest_id)
+            await notify_corpus_change("insert")
+            get_index_manager().note_inserted(self.db_pool, inserted)
+        
+        return inserted
+    
+    async def _sync_backend_after_insert(self, chunk_embedding_pairs: List[Tuple[str, VectorLike]], ingest_id: str) -> None:
+        """Add the rows this ingest actually inserted to a local retrieval index"""
+        backend = get_retrieval_backend()
+        if not backend.is_local:
+            return
+        by_hash = {
+            hashlib.sha256(chunk.encode()).hexdigest(): (chunk, embedding)
+            for chunk, embedding in chunk_embedding_pairs
+        }
+        conn = await self.db_pool.acquire()
+        try:
+            # Only ids and hashes come back; content and vectors are already here
+            rows = await conn.fetch("""
+                SELECT id, content_hash FROM documents
+                WHERE ingest_id = $1 AND content_hash = ANY($2::text[])
+            """, ingest_id, list(by_hash))
+        finally:
+            await self.db_pool.release(conn)
+        new_rows = []
+        for row in rows:
+            chunk, embedding = by_hash[row["content_hash"]]
+            new_rows.append((row["id"], chunk, to_vector_array(embedding)))
+        await asyncio.to_thread(backend.add, new_rows)
+    
+    async def delete_ingest(self, ingest_id: str) -> int:
+        """Delete every row written by one ingest. Returns number of deleted rows."""
+        conn = await self.db_pool.acquire()
+        try:
+            rows = await conn.fetch("DELETE FROM documents WHERE ingest_id = $1 RETURNING id", ingest_id)
+        finally:
+            await self.db_pool.release(conn)
+        if rows:
+            get_retrieval_backend().remove([row["id"] for row in rows])
+            await notify_corpus_change("delete")
+        return len(rows)
+    
+    # Keep existing methods...
+    async def search_similar_documents(self, query_embedding: VectorLike, limit: int = 5) -> List[str]:
+        """Search for documents similar to the query embedding"""
+        return [content for _, content in await self.search_similar_chunks(query_embedding, limit)]
+    
+    async def search_similar_chunks(self, query_embedding: VectorLike, limit: int = 5) -> List[Tuple[int, str]]:
+        """Nearest chunks to the query embedding as (id, content) pairs"""
+        query_vector = to_vector_array(query_embedding)
+        cache = get_retrieval_cache()
+        cache_key = retrieval_key(query_vector, limit)
+        # Read the version before searching, so a concurrent insert leaves this entry stale
+        version = await get_corpus_version().current(self.db_pool)
+        cached = await asyncio.to_thread(cache.get, cache_key, version)
+        if cached is not None:
+            return cached
+        
+        # Identical concurrent searches share one DB round trip
+        key = (hashlib.sha1(query_vector.tobytes()).hexdigest(), limit)
+        backend = get_retrieval_backend()
+        chunks = await retrieval_flight.do(key, lambda: backend.search(self.db_pool, query_vector, limit))
+        await asyncio.to_thread(cache.put, cache_key, version, chunks)
+        return chunks
+    
+    async def search_lexical_chunks(self, question: str, limit: int = 5) -> List[Tuple[int, str]]:
+        """Full-text matches for the question as (id, content) pairs, best ts_rank_cd first"""
+        
+        async def search():
+            conn = await self.db_pool.acquire()
+            try:
+                rows = await conn.fetch("""
+                    SELECT id, content FROM documents, websearch_to_tsquery($1::regconfig, $2) AS query
+                    WHERE content_tsv @@ query
+                    ORDER BY ts_rank_cd(content_tsv, query) DESC
+                    LIMIT $3
+                """, FULLTEXT_CONFIG, question, limit)
+                return [(row["id"], row["content"]) for row in rows]
+            finally:
+                await self.db_pool.release(conn)
+        
+        return await retrieval_flight.do(("lexical", question, limit), search)
+    
     async def get_document_count(self) -> int:
         """Get total number of documents in the database"""
         conn = await self.db_pool.acquire()
@@ -88,7 +292,10 @@ class DocumentManager:
         """Clear all documents from the database. Returns number of deleted documents."""
         conn = await self.db_pool.acquire()
         try:
-            row = await conn.fetchrow("DELETE FROM documents RETURNING COUNT(*)")
-            return row["count"] if row else 0
+            status = await conn.execute("DELETE FROM documents")
+            deleted = int(status.split()[-1])
         finally:
-            await self.db_pool.release(conn)
\ No newline at end of file
+            await self.db_pool.release(conn)
+        get_retrieval_backend().clear()
+        await notify_corpus_change("clear")
+        return deleted
\ No newline at end of file
@@ -0,0 +1,239 @@
+import heapq
+import math
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import numpy as np
+
+try:
+    import hnswlib
+except ImportError:  # optional, the NumPy implementation is used instead
+    hnswlib = None
+
+# Once this share of the graph's nodes are tombstones, it is rebuilt from the live ones
+COMPACT_DELETED_FRACTION = 0.2
+
+class HNSWIndex:
+    """
+    Hierarchical Navigable Small World graph over float32 vectors (squared L2),
+    in NumPy. Vectors live in one growable matrix; each node keeps a neighbor
+    list per layer. Deletes are tombstones filtered out at query time; the
+    search widens by their count, and the graph is rebuilt without them once
+    they pass COMPACT_DELETED_FRACTION.
+    """
+
+    def __init__(self, dim: int, m: int = 16, ef_construction: int = 100, ef_search: int = 64, seed: int = 42):
+        self.dim = dim
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_mult = 1.0 / math.log(m)
+        self._rng = np.random.default_rng(seed)
+        self._vectors = np.empty((1024, dim), dtype=np.float32)
+        self._reset()
+
+    def _reset(self) -> None:
+        self._labels: List[int] = []
+        self._label_to_node: Dict[int, int] = {}
+        self._neighbors: List[List[List[int]]] = []
+        self._deleted: Set[int] = set()
+        self._entry = -1
+        self._max_level = -1
+
+    def __len__(self) -> int:
+        return len(self._labels) - len(self._deleted)
+
+    def _distances(self, query: np.ndarray, nodes: Sequence[int]) -> np.ndarray:
+        diff = self._vectors[nodes] - query
+        return np.einsum("ij,ij->i", diff, diff)
+
+    def _search_layer(self, query: np.ndarray, entry_points: List[Tuple[float, int]], ef: int, level: int) -> List[Tuple[float, int]]:
+        """Best ef (distance, node) pairs on one layer, nearest first"""
+        visited = {node for _, node in entry_points}
+        candidates = list(entry_points)
+        heapq.heapify(candidates)
+        # Max-heap of the current results via negated distances
+        results = [(-dist, node) for dist, node in entry_points]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            dist, node = heapq.heappop(candidates)
+            if dist > -results[0][0] and len(results) >= ef:
+                break
+            fresh = [n for n in self._neighbors[node][level] if n not in visited]
+            if not fresh:
+                continue
+            visited.update(fresh)
+            for neighbor_dist, neighbor in zip(self._distances(query, fresh).tolist(), fresh):
+                if len(results) < ef or neighbor_dist < -results[0][0]:
+                    heapq.heappush(candidates, (neighbor_dist, neighbor))
+                    heapq.heappush(results, (-neighbor_dist, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-neg, node) for neg, node in results)
+
+    def _select_neighbors(self, candidates: List[Tuple[float, int]], m: int) -> List[int]:
+        """
+        Neighbor selection heuristic from the HNSW paper: keep a candidate only if
+        it is closer to the base than to any neighbor already kept, then top up
+        with the closest pruned ones. Keeps the graph navigable across clusters.
+        """
+        if len(candidates) <= m:
+            return [node for _, node in candidates]
+        nodes = [node for _, node in candidates]
+        dists = np.array([dist for dist, _ in candidates], dtype=np.float32)
+        vectors = self._vectors[nodes]
+        norms = np.einsum("ij,ij->i", vectors, vectors)
+        # All candidate-to-candidate distances in one product instead of one call per candidate
+        pairwise = norms[:, None] + norms[None, :] - 2.0 * (vectors @ vectors.T)
+        alive = np.ones(len(nodes), dtype=bool)
+        selected: List[int] = []
+        pruned: List[int] = []
+        for index in range(len(nodes)):
+            if len(selected) >= m:
+                break
+            if not alive[index]:
+                pruned.append(index)
+                continue
+            selected.append(index)
+            # Candidates closer to this neighbor than to the base are covered by it
+            alive &= pairwise[index] >= dists
+        for index in pruned:
+            if len(selected) >= m:
+                break
+            selected.append(index)
+        return [nodes[index] for index in selected]
+
+    def _grow(self, needed: int) -> None:
+        if needed > len(self._vectors):
+            capacity = max(needed, 2 * len(self._vectors))
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown[:len(self._labels)] = self._vectors[:len(self._labels)]
+            self._vectors = grown
+
+    def add(self, labels: Iterable[int], vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        labels = list(labels)
+        self._grow(len(self._labels) + len(labels))
+        for label, vector in zip(labels, vectors):
+            if label in self._label_to_node:
+                self._deleted.discard(self._label_to_node[label])
+                continue
+            self._insert(label, vector)
+
+    def _insert(self, label: int, vector: np.ndarray) -> None:
+        node = len(self._labels)
+        self._vectors[node] = vector
+        self._labels.append(label)
+        self._label_to_node[label] = node
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+        self._neighbors.append([[] for _ in range(level + 1)])
+
+        if self._entry < 0:
+            self._entry, self._max_level = node, level
+            return
+
+        entry = [(float(self._distances(vector, [self._entry])[0]), self._entry)]
+        # Greedy descent through the layers above the new node's level
+        for layer in range(self._max_level, level, -1):
+            entry = self._search_layer(vector, entry, 1, layer)[:1]
+
+        for layer in range(min(level, self._max_level), -1, -1):
+            candidates = self._search_layer(vector, entry, self.ef_construction, layer)
+            max_links = self.m0 if layer == 0 else self.m
+            neighbors = self._select_neighbors(candidates, self.m)
+            self._neighbors[node][layer] = neighbors
+            for neighbor in neighbors:
+                links = self._neighbors[neighbor][layer]
+                links.append(node)
+                if len(links) > max_links:
+                    dists = self._distances(self._vectors[neighbor], links)
+                    ranked = sorted(zip(dists.tolist(), links))
+                    self._neighbors[neighbor][layer] = self._select_neighbors(ranked, max_links)
+            entry = candidates
+
+        if level > self._max_level:
+            self._entry, self._max_level = node, level
+
+    def remove(self, labels: Iterable[int]) -> None:
+        for label in labels:
+            node = self._label_to_node.get(label)
+            if node is not None:
+                self._deleted.add(node)
+        if len(self._deleted) > COMPACT_DELETED_FRACTION * len(self._labels):
+            self._compact()
+
+    def _compact(self) -> None:
+        live = [node for node in range(len(self._labels)) if node not in self._deleted]
+        labels = [self._labels[node] for node in live]
+        vectors = self._vectors[live]
+        self._reset()
+        self.add(labels, vectors)
+
+    def search(self, query: np.ndarray, k: int, ef: Optional[int] = None) -> Tuple[List[int], List[float]]:
+        """Labels and squared L2 distances of the k nearest live vectors"""
+        if self._entry < 0 or not len(self):
+            return [], []
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        # Tombstones still take places in the candidate list, so leave room for k live nodes after them
+        ef = max(ef or self.ef_search, k + len(self._deleted))
+        entry = [(float(self._distances(query, [self._entry])[0]), self._entry)]
+        for layer in range(self._max_level, 0, -1):
+            entry = self._search_layer(query, entry, 1, layer)[:1]
+        found = [(dist, node) for dist, node in self._search_layer(query, entry, ef, 0) if node not in self._deleted]
+        found = found[:k]
+        return [self._labels[node] for _, node in found], [dist for dist, _ in found]
+
+class HnswlibIndex:
+    """Same interface as HNSWIndex, backed by the hnswlib C++ library"""
+
+    def __init__(self, dim: int, m: int = 16, ef_construction: int = 100, ef_search: int = 64, seed: int = 42):
+        self.dim = dim
+        self.ef_search = ef_search
+        self._index = hnswlib.Index(space="l2", dim=dim)
+        self._index.init_index(max_elements=1024, ef_construction=ef_construction, M=m, random_seed=seed, allow_replace_deleted=True)
+        self._index.set_ef(ef_search)
+        self._count = 0
+        self._deleted: Set[int] = set()
+
+    def __len__(self) -> int:
+        return self._count - len(self._deleted)
+
+    def add(self, labels: Iterable[int], vectors: np.ndarray) -> None:
+        labels = np.asarray(list(labels), dtype=np.int64)
+        if not len(labels):
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        needed = self._count + len(labels)
+        if needed > self._index.get_max_elements():
+            self._index.resize_index(max(needed, 2 * self._index.get_max_elements()))
+        for label in labels.tolist():
+            if label in self._deleted:
+                self._index.unmark_deleted(label)
+                self._deleted.discard(label)
+        self._index.add_items(vectors, labels)
+        self._count = self._index.get_current_count()
+
+    def remove(self, labels: Iterable[int]) -> None:
+        for label in labels:
+            if label not in self._deleted:
+                try:
+                    self._index.mark_deleted(label)
+                    self._deleted.add(label)
+                except RuntimeError:
+                    pass
+
+    def search(self, query: np.ndarray, k: int, ef: Optional[int] = None) -> Tuple[List[int], List[float]]:
+        k = min(k, len(self))
+        if k <= 0:
+            return [], []
+        self._index.set_ef(max(ef or self.ef_search, k))
+        labels, dists = self._index.knn_query(np.asarray(query, dtype=np.float32).reshape(1, self.dim), k=k)
+        return labels[0].tolist(), dists[0].tolist()
+
+def make_hnsw_index(dim: int, m: int = 16, ef_construction: int = 100, ef_search: int = 64, prefer_hnswlib: bool = True):
+    """hnswlib when installed, otherwise the NumPy implementation"""
+    if prefer_hnswlib and hnswlib is not None:
+        return HnswlibIndex(dim, m, ef_construction, ef_search)
+    return HNSWIndex(dim, m, ef_construction, ef_search)
@@ -0,0 +1,307 @@
+import asyncio
+import json
+import math
+import re
+import uuid
+from typing import Dict, List, Optional
+from config import (PGVECTOR_INDEX_TYPE, PGVECTOR_DISTANCE, PGVECTOR_RECALL_TARGET, PGVECTOR_PROBES, PGVECTOR_EF_SEARCH,
+                    PGVECTOR_HNSW_M, PGVECTOR_HNSW_EF_CONSTRUCTION, PGVECTOR_REINDEX_GROWTH, PGVECTOR_INDEX_BUILD_TIMEOUT)
+from utils.logger import logger
+
+INDEX_NAME = "idx_documents_embedding"
+# Below this many rows ivfflat centroids are not worth training; a sequential scan is exact and fast
+IVFFLAT_MIN_ROWS = 1000
+# A lease row keeps API and worker from rebuilding at once. Session advisory locks would leak
+# through a transaction-mode pooler (Supabase port 6543), where each statement may use another backend.
+LEASE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS index_maintenance_lock (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        owner TEXT NOT NULL,
+        locked_until TIMESTAMPTZ NOT NULL
+    )
+"""
+# The lease is renewed before every build statement and outlives each by this margin (seconds),
+# so a process that dies mid-build frees it soon after
+LEASE_MARGIN = 60
+
+# pgvector opclass for each distance, and the operator its index can serve
+DISTANCE_OPCLASS = {"l2": "vector_l2_ops", "cosine": "vector_cosine_ops", "ip": "vector_ip_ops"}
+OPCLASS_OPERATOR = {"vector_l2_ops": "<->", "vector_cosine_ops": "<=>", "vector_ip_ops": "<#>"}
+
+# (recall target, ivfflat probes as a multiple of sqrt(lists), hnsw.ef_search)
+RECALL_TIERS = [(0.90, 1, 40), (0.95, 2, 80), (0.98, 4, 160), (0.99, 8, 320)]
+
+def ivfflat_lists(rows: int) -> int:
+    """pgvector's guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond"""
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+def parse_index_definition(indexdef: str) -> Dict:
+    """Method, opclass and options of a pg_indexes.indexdef for the embedding column"""
+    match = re.search(r"USING (\w+) \(embedding (\w+)\)", indexdef)
+    options = dict(re.findall(r"(\w+)='?(\d+)'?", indexdef.split("WITH", 1)[1])) if " WITH " in indexdef else {}
+    return {
+        "method": match.group(1) if match else None,
+        "opclass": match.group(2) if match else None,
+        "options": {key: int(value) for key, value in options.items()}
+    }
+
+class IndexManager:
+    """
+    Owns the ANN index on documents.embedding: creates it with an opclass that
+    matches the query operator, sizes ivfflat `lists` from the row count,
+    rebuilds it after large ingests and picks per-query probes / ef_search
+    from a recall target.
+
+    Rebuilds that change the definition build a new index CONCURRENTLY and swap
+    it in; an ivfflat index whose definition still fits is refreshed with
+    REINDEX CONCURRENTLY so its centroids reflect the data. The row count at
+    build time is kept as the index comment, so every process sees it.
+    """
+
+    def __init__(self, index_type: str = PGVECTOR_INDEX_TYPE, distance: str = PGVECTOR_DISTANCE,
+                 recall_target: float = PGVECTOR_RECALL_TARGET, reindex_growth: float = PGVECTOR_REINDEX_GROWTH):
+        if index_type not in ("ivfflat", "hnsw"):
+            raise ValueError(f"Unknown pgvector index type: {index_type}")
+        if distance not in DISTANCE_OPCLASS:
+            raise ValueError(f"Unknown pgvector distance: {distance}")
+        self.index_type = index_type
+        self.distance = distance
+        self.opclass = DISTANCE_OPCLASS[distance]
+        self.operator = OPCLASS_OPERATOR[self.opclass]
+        self.recall_target = recall_target
+        self.reindex_growth = reindex_growth
+        self.state: Optional[Dict] = None
+        self._pending_rows = 0
+        self._maintenance: Optional[asyncio.Task] = None
+        self._lease_owner: Optional[str] = None
+        self.last_action: Optional[str] = None
+
+    async def refresh(self, db_pool) -> Optional[Dict]:
+        """Read the current index definition, validity, size and build-time row count"""
+        conn = await db_pool.acquire()
+        try:
+            row = await conn.fetchrow("""
+                SELECT i.indexdef, x.indisvalid, pg_relation_size(c.oid) AS size_bytes,
+                       obj_description(c.oid, 'pg_class') AS note, s.idx_scan
+                FROM pg_indexes i
+                JOIN pg_class c ON c.relname = i.indexname
+                JOIN pg_index x ON x.indexrelid = c.oid
+                LEFT JOIN pg_stat_user_indexes s ON s.indexrelid = c.oid
+                WHERE i.tablename = 'documents' AND i.indexname = $1
+            """, INDEX_NAME)
+        finally:
+            await db_pool.release(conn)
+        if row is None:
+            self.state = None
+            return None
+        note = re.search(r"rows=(\d+)", row["note"] or "")
+        self.state = {
+            **parse_index_definition(row["indexdef"]),
+            "definition": row["indexdef"],
+            "valid": row["indisvalid"],
+            "size_bytes": row["size_bytes"],
+            "rows_at_build": int(note.group(1)) if note else None,
+            "index_scans": row["idx_scan"]
+        }
+        return self.state
+
+    def _create_sql(self, name: str, rows: int) -> str:
+        if self.index_type == "ivfflat":
+            options = f"lists = {ivfflat_lists(rows)}"
+        else:
+            options = f"m = {PGVECTOR_HNSW_M}, ef_construction = {PGVECTOR_HNSW_EF_CONSTRUCTION}"
+        return f"CREATE INDEX CONCURRENTLY {name} ON documents USING {self.index_type} (embedding {self.opclass}) WITH ({options})"
+
+    def plan(self, rows: int) -> Optional[str]:
+        """What the index needs for a table of `rows` rows: "create", "rebuild", "reindex" or None"""
+        state = self.state
+        if state is None:
+            if self.index_type == "ivfflat" and rows < IVFFLAT_MIN_ROWS:
+                return None
+            return "create"
+        if not state["valid"] or state["method"] != self.index_type or state["opclass"] != self.opclass:
+            return "rebuild"
+        if self.index_type == "ivfflat":
+            lists, ideal = state["options"].get("lists", 100), ivfflat_lists(rows)
+            if rows >= IVFFLAT_MIN_ROWS and not ideal / 2 <= lists <= ideal * 2:
+                return "rebuild"
+            built = state["rows_at_build"] or 0
+            if rows >= IVFFLAT_MIN_ROWS and rows >= built * self.reindex_growth:
+                return "reindex"
+        return None
+
+    async def ensure_index(self, db_pool) -> Optional[str]:
+        """Bring the index in line with the configuration and row count; returns the action taken"""
+        conn = await db_pool.acquire()
+        try:
+            if not await self._take_lease(conn):
+                logger.info("Index maintenance already running elsewhere, skipping")
+                return None
+            try:
+                await self.refresh(db_pool)
+                rows = await conn.fetchval("SELECT COUNT(*) FROM documents")
+                action = self.plan(rows)
+                if action is not None:
+                    await self._apply(conn, action, rows)
+                    await self.refresh(db_pool)
+                self._pending_rows = 0
+                return action
+            finally:
+                await self._release_lease(conn)
+        finally:
+            await db_pool.release(conn)
+
+    async def _take_lease(self, conn) -> bool:
+        """Claim the maintenance lease unless another process holds an unexpired one"""
+        await conn.execute(LEASE_TABLE_SQL)
+        owner = uuid.uuid4().hex
+        taken = await conn.fetchval("""
+            INSERT INTO index_maintenance_lock (id, owner, locked_until)
+            VALUES (1, $1, now() + make_interval(secs => $2))
+            ON CONFLICT (id) DO UPDATE SET owner = EXCLUDED.owner, locked_until = EXCLUDED.locked_until
+            WHERE index_maintenance_lock.locked_until < now()
+            RETURNING owner
+        """, owner, PGVECTOR_INDEX_BUILD_TIMEOUT + LEASE_MARGIN)
+        if taken is None:
+            return False
+        self._lease_owner = owner
+        return True
+
+    async def _renew_lease(self, conn) -> None:
+        await conn.execute("""
+            UPDATE index_maintenance_lock SET locked_until = now() + make_interval(secs => $2)
+            WHERE id = 1 AND owner = $1
+        """, self._lease_owner, PGVECTOR_INDEX_BUILD_TIMEOUT + LEASE_MARGIN)
+
+    async def _release_lease(self, conn) -> None:
+        await conn.execute(
+            "UPDATE index_maintenance_lock SET locked_until = '-infinity' WHERE id = 1 AND owner = $1", self._lease_owner)
+        self._lease_owner = None
+
+    async def _apply(self, conn, action: str, rows: int) -> None:
+        timeout = PGVECTOR_INDEX_BUILD_TIMEOUT
+        logger.info(f"{action} {self.index_type} index on documents.embedding ({rows} rows)")
+        if action == "reindex":
+            await conn.execute(f"REINDEX INDEX CONCURRENTLY {INDEX_NAME}", timeout=timeout)
+        elif action == "create":
+            await conn.execute(self._create_sql(INDEX_NAME, rows), timeout=timeout)
+        else:
+            # Build the replacement next to the old index so searches keep an index throughout
+            staging = f"{INDEX_NAME}_new"
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {staging}", timeout=timeout)
+            await self._renew_lease(conn)
+            await conn.execute(self._create_sql(staging, rows), timeout=timeout)
+            await self._renew_lease(conn)
+            # Swap in one short transaction, so no search ever runs without a vector index.
+            # The plain DROP waits for running searches; give up rather than queue new ones behind it
+            async with conn.transaction():
+                await conn.execute("SET LOCAL lock_timeout = '10s'")
+                await conn.execute(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+                await conn.execute(f"ALTER INDEX {staging} RENAME TO {INDEX_NAME}")
+        await conn.execute(f"COMMENT ON INDEX {INDEX_NAME} IS 'rows={rows}'")
+        await self._renew_lease(conn)
+        await conn.execute("ANALYZE documents", timeout=timeout)
+        self.last_action = action
+
+    async def start(self, db_pool) -> None:
+        """Load the index state, then check it in the background (a build can take minutes)"""
+        await self.refresh(db_pool)
+        self._maintenance = asyncio.get_running_loop().create_task(self._maintain(db_pool))
+
+    def note_inserted(self, db_pool, rows: int) -> None:
+        """Count rows from an ingest and start maintenance in the background once they add up"""
+        self._pending_rows += rows
+        if self._maintenance is not None and not self._maintenance.done():
+            return
+        built = (self.state or {}).get("rows_at_build") or 0
+        if self._pending_rows >= max(IVFFLAT_MIN_ROWS, built * (self.reindex_growth - 1)):
+            self._maintenance = asyncio.get_running_loop().create_task(self._maintain(db_pool))
+
+    async def _maintain(self, db_pool) -> None:
+        try:
+            await self.ensure_index(db_pool)
+        except Exception as e:
+            logger.error(f"Index maintenance failed: {e}")
+
+    def search_params(self, limit: int, recall_target: Optional[float] = None) -> Dict[str, int]:
+        """ivfflat.probes or hnsw.ef_search for a recall target; empty when unknown"""
+        target = recall_target if recall_target is not None else self.recall_target
+        tier = next((tier for tier in RECALL_TIERS if target <= tier[0]), None)
+        if self.index_type == "hnsw":
+            ef_search = PGVECTOR_EF_SEARCH or (tier[2] if tier else 400)
+            return {"hnsw.ef_search": max(ef_search, limit)}
+        lists = (self.state or {}).get("options", {}).get("lists")
+        if PGVECTOR_PROBES:
+            return {"ivfflat.probes": PGVECTOR_PROBES}
+        if not lists:
+            return {}
+        probes = math.ceil(math.sqrt(lists) * tier[1]) if tier else lists
+        return {"ivfflat.probes": min(lists, probes)}
+
+    def search_settings(self, limit: int, recall_target: Optional[float] = None) -> List[str]:
+        """SET LOCAL statements to run in the search transaction"""
+        return [f"SET LOCAL {name} = {int(value)}" for name, value in self.search_params(limit, recall_target).items()]
+
+    async def explain(self, db_pool, limit: int = 5) -> Optional[Dict]:
+        """Planner choice for a typical search, using a stored embedding as the query"""
+        conn = await db_pool.acquire()
+        try:
+            async with conn.transaction():
+                for statement in self.search_settings(limit):
+                    await conn.execute(statement)
+                plan = await conn.fetchval(f"""
+                    EXPLAIN (FORMAT JSON)
+                    SELECT id FROM documents
+                    ORDER BY embedding {self.operator} (SELECT embedding FROM documents LIMIT 1)
+                    LIMIT {int(limit)}
+                """)
+        finally:
+            await db_pool.release(conn)
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        nodes, stack = [], [plan[0]["Plan"]]
+        while stack:
+            node = stack.pop()
+            nodes.append(node)
+            stack.extend(node.get("Plans", []))
+        index_nodes = [node for node in nodes if node.get("Index Name") == INDEX_NAME]
+        return {
+            "uses_index": bool(index_nodes),
+            "scan": index_nodes[0]["Node Type"] if index_nodes else [node["Node Type"] for node in nodes],
+            "estimated_cost": plan[0]["Plan"].get("Total Cost")
+        }
+
+    async def status(self, db_pool) -> Dict:
+        await self.refresh(db_pool)
+        conn = await db_pool.acquire()
+        try:
+            rows = await conn.fetchval("SELECT COUNT(*) FROM documents")
+        finally:
+            await db_pool.release(conn)
+        return {
+            "configured": {"index_type": self.index_type, "distance": self.distance,
+                           "opclass": self.opclass, "operator": self.operator, "recall_target": self.recall_target},
+            "index": self.state,
+            "rows": rows,
+            "ideal_lists": ivfflat_lists(rows) if self.index_type == "ivfflat" else None,
+            "pending_action": self.plan(rows),
+            "last_action": self.last_action,
+            "maintenance_running": self._maintenance is not None and not self._maintenance.done(),
+            "search_params": self.search_params(5),
+            "planner": await self.explain(db_pool) if rows else None
+        }
+
+_manager: Optional[IndexManager] = None
+
+def get_index_manager() -> IndexManager:
+    """Index manager configured by the PGVECTOR_* settings"""
+    global _manager
+    if _manager is None:
+        _manager = IndexManager()
+    return _manager
+
+def set_index_manager(manager: Optional[IndexManager]) -> None:
+    """Swap the index manager, e.g. for tests"""
+    global _manager
+    _manager = manager
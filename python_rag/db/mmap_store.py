@@ -0,0 +1,355 @@
+import fcntl
+import mmap
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from typing import Iterable, List, Tuple
+import numpy as np
+from db.quantization import fit_quantizer
+
+# Rows scored per matrix-vector product; keeps temporaries small on large corpora
+SEARCH_BLOCK_ROWS = 65536
+# Quantized codes are widened to float32 per block; smaller blocks keep that in cache
+CODE_BLOCK_ROWS = 4096
+
+class MmapVectorStore:
+    """
+    Embeddings in memory-mapped files, searched exactly with NumPy.
+
+    Rows live in two segments with the same layout: a compacted base of `.npy`
+    files and an append log of raw files that only ever grow, so both can be
+    mapped without reading them into RAM and a torn append is simply ignored.
+    Side arrays hold chunk ids, squared norms and (offset, length) of each
+    chunk's UTF-8 content in contents.bin. Deletes are appended to deleted.log.
+
+    With a quantizer, compact() also writes compact codes for the base segment
+    (codes.npy, trained state in quantizer.npz). Search then scans the codes,
+    which are 4x (int8) to 32x (pq) smaller than the vectors, and re-ranks the
+    best `rerank * k` candidates with their exact vectors, so only those rows
+    of vectors.npy are ever paged in.
+
+    Files in `path`:
+        vectors.npy ids.npy norms.npy         compacted base segment
+        vectors.log ids.log norms.log         append log (raw float32 / int64)
+        offsets.log contents.bin              content locations, all rows in order
+        deleted.log                           deleted chunk ids
+        codes.npy quantizer.npz               optional quantized base segment
+        generation                            bumped by every compact() and clear()
+        write.lock rebuild.lock               flock files for writers and rebuilds
+
+    Several processes may map the same store. Each one remaps the base segment
+    when the generation moves, so a compaction elsewhere never leaves it
+    searching a base whose log has already been folded away.
+    """
+
+    def __init__(self, path: str, dim: int = 768, quantizer=None, rerank: int = 4):
+        self.path = path
+        self.dim = dim
+        self.quantizer = quantizer
+        self.rerank = rerank
+        self._lock = threading.RLock()
+        self._write_locked = False
+        os.makedirs(path, exist_ok=True)
+        self._open()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclusive across processes sharing the store; callers hold self._lock"""
+        with open(self._file("write.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._write_locked = True
+            try:
+                yield
+            finally:
+                self._write_locked = False
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def rebuild_lock(self):
+        """
+        Held while the store is checked against Postgres and rebuilt, so only
+        one of the processes sharing it rebuilds; the others wait and then
+        find it in sync.
+        """
+        with open(self._file("rebuild.lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _disk_generation(self) -> int:
+        try:
+            with open(self._file("generation")) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _bump_generation(self, generation: int) -> None:
+        with open(self._file("generation.tmp"), "w") as f:
+            f.write(str(generation + 1))
+        os.replace(self._file("generation.tmp"), self._file("generation"))
+
+    def _reopen(self) -> None:
+        """Remap everything once the writer that changed the base is done"""
+        if self._write_locked:
+            self._open()
+        else:
+            with self._write_lock():
+                self._open()
+
+    def _map_raw(self, name: str, dtype, rows: int, width: int = 1) -> np.ndarray:
+        if rows == 0:
+            return np.empty((0, width) if width > 1 else 0, dtype=dtype)
+        shape = (rows, width) if width > 1 else (rows,)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=shape)
+
+    def _file_rows(self, name: str, row_bytes: int) -> int:
+        try:
+            return os.path.getsize(self._file(name)) // row_bytes
+        except FileNotFoundError:
+            return 0
+
+    def _open(self) -> None:
+        with self._lock:
+            self._generation = self._disk_generation()
+            if os.path.exists(self._file("ids.npy")):
+                self._base_vectors = np.load(self._file("vectors.npy"), mmap_mode="r")
+                self._base_ids = np.load(self._file("ids.npy"), mmap_mode="r")
+                self._base_norms = np.load(self._file("norms.npy"), mmap_mode="r")
+            else:
+                self._base_vectors = np.empty((0, self.dim), dtype=np.float32)
+                self._base_ids = np.empty(0, dtype=np.int64)
+                self._base_norms = np.empty(0, dtype=np.float32)
+            self._codes = None
+            if self.quantizer is not None and os.path.exists(self._file("codes.npy")):
+                state = np.load(self._file("quantizer.npz"))
+                if str(state["kind"]) == self.quantizer.kind:
+                    self.quantizer.load_state(state)
+                    self._codes = np.load(self._file("codes.npy"), mmap_mode="r")
+            self._log_rows = -1
+            self._deleted_size = -1
+            self._refresh()
+
+    def _refresh(self) -> None:
+        """Remap the append log and deleted ids if another writer extended them"""
+        if self._disk_generation() != self._generation:
+            self._reopen()
+            return
+        # Rows count only once every side file has them, so a torn append stays invisible
+        log_rows = min(
+            self._file_rows("ids.log", 8),
+            self._file_rows("norms.log", 4),
+            self._file_rows("vectors.log", 4 * self.dim),
+            self._file_rows("offsets.log", 16) - len(self._base_ids)
+        )
+        log_rows = max(0, log_rows)
+        if log_rows < self._log_rows:
+            # The log only shrinks while another process compacts or clears the store
+            self._reopen()
+            return
+        if log_rows != self._log_rows:
+            self._log_vectors = self._map_raw("vectors.log", np.float32, log_rows, self.dim)
+            self._log_ids = self._map_raw("ids.log", np.int64, log_rows)
+            self._log_norms = self._map_raw("norms.log", np.float32, log_rows)
+            self._offsets = self._map_raw("offsets.log", np.int64, len(self._base_ids) + log_rows, 2)
+            self._contents = None
+            self._log_rows = log_rows
+            self._deleted_size = -1
+        deleted_size = os.path.getsize(self._file("deleted.log")) if os.path.exists(self._file("deleted.log")) else 0
+        if deleted_size != self._deleted_size:
+            deleted = np.fromfile(self._file("deleted.log"), dtype=np.int64) if deleted_size else np.empty(0, dtype=np.int64)
+            self._base_live = ~np.isin(self._base_ids, deleted)
+            self._log_live = ~np.isin(self._log_ids, deleted)
+            self._deleted_size = deleted_size
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return int(self._base_live.sum() + self._log_live.sum())
+
+    def ids(self) -> np.ndarray:
+        """Ids of the live rows"""
+        with self._lock:
+            self._refresh()
+            return np.concatenate([self._base_ids[self._base_live], self._log_ids[self._log_live]])
+
+    def max_id(self) -> int:
+        with self._lock:
+            self._refresh()
+            ids = [segment[live].max() for segment, live in ((self._base_ids, self._base_live), (self._log_ids, self._log_live))
+                   if live.any()]
+            return int(max(ids)) if ids else 0
+
+    def append(self, rows: List[Tuple[int, str, np.ndarray]]) -> None:
+        """Append (id, content, embedding) rows to the log, skipping ids the store already has"""
+        if not rows:
+            return
+        with self._lock, self._write_lock():
+            self._truncate_torn_append()
+            # Another process sharing the store may have appended the same rows already
+            ids = np.array([chunk_id for chunk_id, _, _ in rows], dtype=np.int64)
+            stored = np.concatenate([self._base_ids, self._log_ids])
+            if len(stored) and ids.min() <= stored.max():
+                rows = [row for row, known in zip(rows, np.isin(ids, stored)) if not known]
+                if not rows:
+                    return
+                ids = np.array([chunk_id for chunk_id, _, _ in rows], dtype=np.int64)
+            vectors = np.stack([np.asarray(vector, dtype=np.float32).reshape(self.dim) for _, _, vector in rows])
+            norms = np.einsum("ij,ij->i", vectors, vectors).astype(np.float32)
+            encoded = [content.encode("utf-8") for _, content, _ in rows]
+            with open(self._file("contents.bin"), "ab") as contents:
+                start = contents.tell()
+                contents.write(b"".join(encoded))
+            lengths = np.array([len(data) for data in encoded], dtype=np.int64)
+            offsets = np.column_stack([start + np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths])
+            # Side arrays first, vectors last: a row exists once its vector is complete
+            for name, array in (("offsets.log", offsets), ("ids.log", ids), ("norms.log", norms), ("vectors.log", vectors)):
+                with open(self._file(name), "ab") as f:
+                    f.write(np.ascontiguousarray(array).tobytes())
+            self._refresh()
+
+    def _truncate_torn_append(self) -> None:
+        """Cut every log back to the last complete row before appending"""
+        self._log_rows = -1
+        self._refresh()
+        rows = self._log_rows
+        for name, row_bytes, count in (("ids.log", 8, rows), ("norms.log", 4, rows), ("vectors.log", 4 * self.dim, rows),
+                                       ("offsets.log", 16, len(self._base_ids) + rows)):
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) != count * row_bytes:
+                with open(self._file(name), "r+b") as f:
+                    f.truncate(count * row_bytes)
+
+    def remove(self, ids: Iterable[int]) -> None:
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if not len(ids):
+            return
+        with self._lock, self._write_lock():
+            with open(self._file("deleted.log"), "ab") as f:
+                f.write(ids.tobytes())
+            self._refresh()
+
+    def clear(self) -> None:
+        with self._lock, self._write_lock():
+            generation = self._disk_generation()
+            shutil.rmtree(self._file("compact.tmp"), ignore_errors=True)
+            for name in os.listdir(self.path):
+                if name not in ("write.lock", "rebuild.lock"):
+                    os.remove(self._file(name))
+            self._bump_generation(generation)
+            self._open()
+
+    def compact(self) -> None:
+        """Fold the append log and deletions into a new base segment"""
+        with self._lock, self._write_lock():
+            self._refresh()
+            keep_base = np.flatnonzero(self._base_live)
+            keep_log = np.flatnonzero(self._log_live)
+            vectors = np.concatenate([self._base_vectors[keep_base], self._log_vectors[keep_log]])
+            ids = np.concatenate([self._base_ids[keep_base], self._log_ids[keep_log]])
+            norms = np.concatenate([self._base_norms[keep_base], self._log_norms[keep_log]])
+            offsets = np.concatenate([self._offsets[keep_base], self._offsets[len(self._base_ids) + keep_log]])
+            staging = self._file("compact.tmp")
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            for name, array in (("vectors.npy", vectors), ("ids.npy", ids), ("norms.npy", norms)):
+                np.save(os.path.join(staging, name), array)
+            offsets.astype(np.int64).tofile(os.path.join(staging, "offsets.log"))
+            staged = ["offsets.log", "vectors.npy", "ids.npy", "norms.npy"]
+            if self.quantizer is not None and len(vectors):
+                fit_quantizer(self.quantizer, vectors)
+                codes = np.concatenate([self.quantizer.encode(vectors[start:start + SEARCH_BLOCK_ROWS])
+                                        for start in range(0, len(vectors), SEARCH_BLOCK_ROWS)])
+                np.save(os.path.join(staging, "codes.npy"), codes)
+                np.savez(os.path.join(staging, "quantizer.npz"), kind=self.quantizer.kind, **self.quantizer.state())
+                staged += ["codes.npy", "quantizer.npz"]
+            for name in ("vectors.log", "ids.log", "norms.log", "deleted.log", "codes.npy", "quantizer.npz"):
+                if os.path.exists(self._file(name)):
+                    os.remove(self._file(name))
+            for name in staged:
+                os.replace(os.path.join(staging, name), self._file(name))
+            os.rmdir(staging)
+            self._bump_generation(self._generation)
+            self._open()
+
+    def _content(self, row: int) -> str:
+        if self._contents is None:
+            with open(self._file("contents.bin"), "rb") as f:
+                self._contents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self._file("contents.bin")) else b""
+        offset, length = self._offsets[row]
+        return bytes(self._contents[offset:offset + length]).decode("utf-8")
+
+    @staticmethod
+    def _top(dists: np.ndarray, k: int) -> np.ndarray:
+        if len(dists) > k:
+            return np.argpartition(dists, k)[:k]
+        return np.arange(len(dists))
+
+    def _scan(self, query: np.ndarray, vectors: np.ndarray, norms: np.ndarray, live: np.ndarray,
+              k: int, codes: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Best k (rows, distances) of one segment, block by block"""
+        rows: List[np.ndarray] = []
+        dists: List[np.ndarray] = []
+        block_rows = CODE_BLOCK_ROWS if codes is not None else SEARCH_BLOCK_ROWS
+        for start in range(0, len(vectors), block_rows):
+            end = min(start + block_rows, len(vectors))
+            if codes is not None:
+                block = self.quantizer.distances(query, codes[start:end], norms[start:end])
+            else:
+                # |v - q|^2 minus the constant |q|^2: norms - 2 v.q
+                block = norms[start:end] - 2.0 * (vectors[start:end] @ query)
+            block[~live[start:end]] = np.inf
+            top = self._top(block, k)
+            rows.append(start + top)
+            dists.append(block[top])
+        if not rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows, dists = np.concatenate(rows), np.concatenate(dists)
+        top = self._top(dists, k)
+        return rows[top], dists[top]
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, str, float]]:
+        """k nearest rows by squared L2 distance as (id, content, distance)"""
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        with self._lock:
+            self._refresh()
+            base_count = len(self._base_ids)
+            if self._codes is not None:
+                rows, approx = self._scan(query, self._base_vectors, self._base_norms, self._base_live,
+                                          max(k * self.rerank, k), self._codes)
+                # Exact re-ranking touches only the candidates' rows of vectors.npy
+                rows = np.sort(rows[np.isfinite(approx)])
+                base_dists = self._base_norms[rows] - 2.0 * (self._base_vectors[rows] @ query)
+                top = self._top(base_dists, k)
+                base_rows, base_dists = rows[top], base_dists[top]
+            else:
+                base_rows, base_dists = self._scan(query, self._base_vectors, self._base_norms, self._base_live, k)
+            log_rows, log_dists = self._scan(query, self._log_vectors, self._log_norms, self._log_live, k)
+            rows = np.concatenate([base_rows, base_count + log_rows])
+            dists = np.concatenate([base_dists, log_dists])
+            order = np.argsort(dists, kind="stable")[:k]
+            results = []
+            q_norm = float(query @ query)
+            for row, dist in zip(rows[order].tolist(), dists[order].tolist()):
+                if not np.isfinite(dist):
+                    break
+                chunk_id = self._base_ids[row] if row < base_count else self._log_ids[row - base_count]
+                results.append((int(chunk_id), self._content(row), dist + q_norm))
+            return results
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refresh()
+            return {
+                "rows": len(self),
+                "base_rows": len(self._base_ids),
+                "log_rows": self._log_rows,
+                "deleted_rows": int((~self._base_live).sum() + (~self._log_live).sum()),
+                "quantization": self.quantizer.kind if self._codes is not None else "none",
+                "vector_bytes": int(self._base_vectors.nbytes + self._log_vectors.nbytes),
+                "code_bytes": int(self._codes.nbytes) if self._codes is not None else 0
+            }
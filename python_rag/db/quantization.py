@@ -0,0 +1,154 @@
+from typing import Optional
+import numpy as np
+
+# Vectors used to fit a quantizer; more adds training time without better codes
+TRAINING_SAMPLE = 20000
+# k-means points per PQ centroid; sub-spaces are small, so this is plenty
+PQ_POINTS_PER_CENTROID = 40
+
+class ScalarQuantizer:
+    """
+    int8 scalar quantization: each dimension is mapped linearly from the
+    trained [min, max] range onto 256 levels. One byte per dimension, a
+    quarter of float32.
+    """
+
+    kind = "int8"
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.low: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+
+    def fit(self, vectors: np.ndarray) -> "ScalarQuantizer":
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.low = vectors.min(axis=0)
+        self.scale = np.maximum(vectors.max(axis=0) - self.low, 1e-12) / 255.0
+        return self
+
+    @property
+    def code_size(self) -> int:
+        return self.dim
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        levels = np.round((np.asarray(vectors, dtype=np.float32) - self.low) / self.scale)
+        return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return self.low + (codes.astype(np.float32) + 128) * self.scale
+
+    def inner_products(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Approximate v.q for each coded v, without decoding the block"""
+        scaled = self.scale * query
+        # v = low + (c + 128) * scale, so v.q = c.(scale*q) + a per-query constant
+        return codes.astype(np.float32) @ scaled + float(self.low @ query + 128 * scaled.sum())
+
+    def distances(self, query: np.ndarray, codes: np.ndarray, norms: np.ndarray) -> np.ndarray:
+        """Approximate squared L2 minus |q|^2, using the exact stored norms"""
+        return norms - 2.0 * self.inner_products(query, codes)
+
+    def state(self) -> dict:
+        return {"low": self.low, "scale": self.scale}
+
+    def load_state(self, state) -> None:
+        self.low, self.scale = state["low"], state["scale"]
+
+class ProductQuantizer:
+    """
+    Product quantization: the vector is split into `subvectors` slices and each
+    slice is replaced by the id of its nearest of 256 k-means centroids, so a
+    768-dim vector takes `subvectors` bytes. Distances to a query come from a
+    per-query lookup table (asymmetric distance computation).
+    """
+
+    kind = "pq"
+
+    def __init__(self, dim: int, subvectors: int = 96, iterations: int = 10, seed: int = 0):
+        if dim % subvectors:
+            raise ValueError(f"dim {dim} is not divisible by {subvectors} subvectors")
+        self.dim = dim
+        self.subvectors = subvectors
+        self.sub_dim = dim // subvectors
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None  # (subvectors, 256, sub_dim)
+
+    @property
+    def code_size(self) -> int:
+        return self.subvectors
+
+    def _slices(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, dim) -> (subvectors, n, sub_dim)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors.reshape(len(vectors), self.subvectors, self.sub_dim).transpose(1, 0, 2)
+
+    def fit(self, vectors: np.ndarray) -> "ProductQuantizer":
+        rng = np.random.default_rng(self.seed)
+        if len(vectors) > 256 * PQ_POINTS_PER_CENTROID:
+            vectors = vectors[np.sort(rng.choice(len(vectors), 256 * PQ_POINTS_PER_CENTROID, replace=False))]
+        slices = self._slices(vectors)
+        clusters = min(256, slices.shape[1])
+        self.centroids = np.zeros((self.subvectors, 256, self.sub_dim), dtype=np.float32)
+        for index, points in enumerate(slices):
+            points = np.ascontiguousarray(points)
+            centroids = points[rng.choice(len(points), clusters, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignment = self._nearest(points, centroids)
+                counts = np.bincount(assignment, minlength=clusters)
+                sums = np.stack([np.bincount(assignment, weights=points[:, d], minlength=clusters)
+                                 for d in range(self.sub_dim)], axis=1)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            self.centroids[index, :clusters] = centroids
+            # Unused ids repeat a real centroid so every code decodes to something sensible
+            self.centroids[index, clusters:] = centroids[0]
+        return self
+
+    @staticmethod
+    def _nearest(points: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        dists = (centroids * centroids).sum(axis=1)[None, :] - 2.0 * (points @ centroids.T)
+        return dists.argmin(axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        slices = self._slices(vectors)
+        codes = np.empty((slices.shape[1], self.subvectors), dtype=np.uint8)
+        for index, points in enumerate(slices):
+            codes[:, index] = self._nearest(np.ascontiguousarray(points), self.centroids[index])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        parts = self.centroids[np.arange(self.subvectors), codes]  # (n, subvectors, sub_dim)
+        return parts.reshape(len(codes), self.dim)
+
+    def distances(self, query: np.ndarray, codes: np.ndarray, norms: np.ndarray = None) -> np.ndarray:
+        """Approximate squared L2 minus |q|^2 from the lookup table"""
+        query_slices = np.asarray(query, dtype=np.float32).reshape(self.subvectors, 1, self.sub_dim)
+        # table[j, c] = |c_jc|^2 - 2 q_j.c_jc, so the sum over j drops the constant |q|^2 like the other paths
+        table = (self.centroids * self.centroids).sum(axis=2) - 2.0 * (self.centroids * query_slices).sum(axis=2)
+        # Offsetting each column's codes into the flattened table turns the lookup into one take
+        offsets = np.arange(self.subvectors, dtype=np.intp) * 256
+        return np.take(table.ravel(), codes + offsets).sum(axis=1)
+
+    def state(self) -> dict:
+        return {"centroids": self.centroids}
+
+    def load_state(self, state) -> None:
+        self.centroids = state["centroids"]
+        self.subvectors, _, self.sub_dim = self.centroids.shape
+
+def make_quantizer(kind: str, dim: int, subvectors: int = 96):
+    """Quantizer for VECTOR_QUANTIZATION, or None for full float32 search"""
+    if kind in ("", "none", None):
+        return None
+    if kind == "int8":
+        return ScalarQuantizer(dim)
+    if kind == "pq":
+        return ProductQuantizer(dim, subvectors)
+    raise ValueError(f"Unknown vector quantization: {kind}")
+
+def fit_quantizer(quantizer, vectors: np.ndarray, seed: int = 0):
+    """Fit on at most TRAINING_SAMPLE rows of vectors"""
+    if len(vectors) > TRAINING_SAMPLE:
+        rows = np.sort(np.random.default_rng(seed).choice(len(vectors), TRAINING_SAMPLE, replace=False))
+        vectors = vectors[rows]
+    return quantizer.fit(np.asarray(vectors, dtype=np.float32))
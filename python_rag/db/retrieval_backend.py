@@ -0,0 +1,352 @@
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from config import (RETRIEVAL_BACKEND, LOCAL_INDEX_SYNC_SECONDS, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH, MMAP_STORE_PATH, MMAP_COMPACT_ROWS,
+                    VECTOR_QUANTIZATION, PQ_SUBVECTORS, QUANTIZATION_RERANK)
+from db.corpus_state import get_corpus_version
+from db.hnsw_index import make_hnsw_index
+from db.index_manager import get_index_manager
+from db.mmap_store import MmapVectorStore
+from db.quantization import make_quantizer
+from utils.logger import logger
+
+# Matches embedding vector(768) in the documents table
+EMBEDDING_DIM = 768
+# Rows fetched per round trip when building a local index from Postgres
+LOAD_BATCH_ROWS = 5000
+
+Chunks = List[Tuple[int, str]]
+
+class RetrievalBackend(ABC):
+    """
+    Where nearest-neighbour search runs. Postgres always holds the documents;
+    local backends keep a copy of the embeddings (see LocalBackend).
+    """
+
+    name = "base"
+    is_local = False
+
+    async def load(self, db_pool) -> None:
+        """Build local state from the documents table (no-op for pgvector)"""
+
+    @abstractmethod
+    async def search(self, db_pool, query_vector: np.ndarray, limit: int) -> Chunks:
+        """Nearest chunks as (id, content) pairs, closest first"""
+
+    def add(self, rows: List[Tuple[int, str, np.ndarray]]) -> None:
+        """Index newly inserted (id, content, embedding) rows"""
+
+    def remove(self, ids: Iterable[int]) -> None:
+        """Forget deleted rows"""
+
+    def clear(self) -> None:
+        """Forget every row"""
+
+    def stats(self) -> Dict:
+        return {"backend": self.name}
+
+class PgVectorBackend(RetrievalBackend):
+    """
+    Search in Postgres with pgvector, using the operator that matches the
+    index opclass and the probes / ef_search chosen by the IndexManager
+    """
+
+    name = "pgvector"
+
+    async def search(self, db_pool, query_vector: np.ndarray, limit: int) -> Chunks:
+        manager = get_index_manager()
+        query = f"""
+            SELECT id, content FROM documents
+            ORDER BY embedding {manager.operator} $1::vector
+            LIMIT $2
+        """
+        settings = manager.search_settings(limit)
+        conn = await db_pool.acquire()
+        try:
+            if settings:
+                # SET LOCAL only lasts for the transaction, which also suits a transaction-mode pooler
+                async with conn.transaction():
+                    for statement in settings:
+                        await conn.execute(statement)
+                    rows = await conn.fetch(query, query_vector, limit)
+            else:
+                rows = await conn.fetch(query, query_vector, limit)
+
+            return [(row["id"], row["content"]) for row in rows]
+
+        finally:
+            await db_pool.release(conn)
+
+async def copy_documents(db_pool, add, after_id: int = 0) -> None:
+    """Feed every (id, content, embedding) row with id > after_id to add, LOAD_BATCH_ROWS at a time"""
+    conn = await db_pool.acquire()
+    try:
+        async with conn.transaction():
+            batch = []
+            query = "SELECT id, content, embedding FROM documents WHERE id > $1 ORDER BY id"
+            async for record in conn.cursor(query, after_id, prefetch=LOAD_BATCH_ROWS):
+                batch.append((record["id"], record["content"], record["embedding"]))
+                if len(batch) >= LOAD_BATCH_ROWS:
+                    await asyncio.to_thread(add, batch)
+                    batch = []
+            if batch:
+                await asyncio.to_thread(add, batch)
+    finally:
+        await db_pool.release(conn)
+
+class LocalBackend(RetrievalBackend):
+    """
+    A backend searching its own copy of the embeddings; until it is loaded,
+    searches fall back to pgvector. DocumentManager applies this process's
+    inserts, rollbacks and clears as they happen. Writes from other processes
+    (the standalone worker, stream consumers) are caught up from Postgres
+    before the next search once the CorpusVersion in Postgres has moved, and
+    at least every LOCAL_INDEX_SYNC_SECONDS in case a write bypassed it.
+    """
+
+    is_local = True
+
+    def __init__(self):
+        self._fallback = PgVectorBackend()
+        self._sync_lock = asyncio.Lock()
+        self.ready = False
+        self.load_time: Optional[float] = None
+        self.synced_version: Optional[int] = None
+        self._synced_at = 0.0
+        self.catch_ups = 0
+
+    @abstractmethod
+    def indexed_ids(self) -> np.ndarray:
+        """Ids of the rows currently searchable"""
+
+    @abstractmethod
+    def _search(self, query_vector: np.ndarray, limit: int) -> Chunks:
+        """Nearest chunks from the local copy"""
+
+    async def search(self, db_pool, query_vector: np.ndarray, limit: int) -> Chunks:
+        if not self.ready:
+            return await self._fallback.search(db_pool, query_vector, limit)
+        await self.catch_up(db_pool)
+        return await asyncio.to_thread(self._search, query_vector, limit)
+
+    def _in_sync(self, version: int) -> bool:
+        return version == self.synced_version and time.monotonic() - self._synced_at < LOCAL_INDEX_SYNC_SECONDS
+
+    def _mark_synced(self, version: int) -> None:
+        self.synced_version = version
+        self._synced_at = time.monotonic()
+
+    async def catch_up(self, db_pool) -> None:
+        """Apply the inserts and deletes made since the last sync, if the corpus changed"""
+        # The version moves in the writing transaction, so everything up to it is visible here
+        version = await get_corpus_version().current(db_pool)
+        if self._in_sync(version):
+            return
+        async with self._sync_lock:
+            if self._in_sync(version):
+                return
+            await self._apply_changes(db_pool)
+            self._mark_synced(version)
+
+    async def _apply_changes(self, db_pool) -> None:
+        ids = await asyncio.to_thread(self.indexed_ids)
+        await copy_documents(db_pool, self.add, int(ids.max()) if len(ids) else 0)
+        ids = await asyncio.to_thread(self.indexed_ids)
+        conn = await db_pool.acquire()
+        try:
+            rows = await conn.fetchval("SELECT COUNT(*) FROM documents")
+            if rows == len(ids):
+                return
+            self.catch_ups += 1
+            if rows == 0:
+                await asyncio.to_thread(self.clear)
+                return
+            # Rows were deleted, or committed below the highest id: compare the id sets
+            stored = np.array([row["id"] for row in await conn.fetch("SELECT id FROM documents")], dtype=np.int64)
+            missing = np.setdiff1d(stored, ids)
+            if len(missing):
+                records = await conn.fetch(
+                    "SELECT id, content, embedding FROM documents WHERE id = ANY($1::bigint[])", missing.tolist())
+                await asyncio.to_thread(self.add, [(r["id"], r["content"], r["embedding"]) for r in records])
+            deleted = np.setdiff1d(ids, stored)
+            if len(deleted):
+                await asyncio.to_thread(self.remove, deleted.tolist())
+        finally:
+            await db_pool.release(conn)
+        logger.debug(f"{self.name} caught up: {len(missing)} rows added, {len(deleted)} removed")
+
+class HNSWBackend(LocalBackend):
+    """
+    In-process HNSW graph (hnswlib when installed, otherwise NumPy) built from
+    the documents table at startup. Searches skip the network entirely.
+    """
+
+    name = "hnsw"
+
+    def __init__(self, dim: int = EMBEDDING_DIM, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+                 ef_search: int = HNSW_EF_SEARCH, prefer_hnswlib: bool = True):
+        super().__init__()
+        self.dim = dim
+        self._settings = (dim, m, ef_construction, ef_search, prefer_hnswlib)
+        self.index = make_hnsw_index(*self._settings)
+        self._contents: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    async def load(self, db_pool) -> None:
+        start_time = time.time()
+        version = await get_corpus_version().current(db_pool)
+        await copy_documents(db_pool, self.add)
+        self._mark_synced(version)
+        self.ready = True
+        self.load_time = time.time() - start_time
+        logger.info(f"{self.name} index loaded: {len(self._contents)} rows in {self.load_time:.2f}s")
+
+    def indexed_ids(self) -> np.ndarray:
+        with self._lock:
+            return np.fromiter(self._contents, dtype=np.int64, count=len(self._contents))
+
+    def _search(self, query_vector: np.ndarray, limit: int) -> Chunks:
+        with self._lock:
+            ids, _ = self.index.search(query_vector, limit)
+            return [(chunk_id, self._contents[chunk_id]) for chunk_id in ids]
+
+    def add(self, rows: List[Tuple[int, str, np.ndarray]]) -> None:
+        if not rows:
+            return
+        vectors = np.stack([np.asarray(vector, dtype=np.float32) for _, _, vector in rows])
+        with self._lock:
+            self.index.add([chunk_id for chunk_id, _, _ in rows], vectors)
+            for chunk_id, content, _ in rows:
+                self._contents[chunk_id] = content
+
+    def remove(self, ids: Iterable[int]) -> None:
+        ids = list(ids)
+        with self._lock:
+            self.index.remove(ids)
+            for chunk_id in ids:
+                self._contents.pop(chunk_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.index = make_hnsw_index(*self._settings)
+            self._contents = {}
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "implementation": type(self.index).__name__,
+            "ready": self.ready,
+            "rows": len(self._contents),
+            "load_time": self.load_time,
+            "synced_version": self.synced_version,
+            "catch_ups": self.catch_ups
+        }
+
+class MmapBackend(LocalBackend):
+    """
+    Exact search over embeddings kept in memory-mapped files (see MmapVectorStore).
+    The files persist across restarts, so startup only maps them and checks
+    them against the documents table; they are rebuilt from Postgres when the
+    row count or highest id disagree. Processes on one host can share the
+    files (MMAP_STORE_PATH); only one of them rebuilds. With VECTOR_QUANTIZATION set, searches
+    scan int8 or PQ codes and re-rank the best candidates exactly.
+    """
+
+    name = "mmap"
+
+    def __init__(self, path: str = MMAP_STORE_PATH, dim: int = EMBEDDING_DIM, quantization: str = VECTOR_QUANTIZATION,
+                 compact_rows: int = MMAP_COMPACT_ROWS):
+        super().__init__()
+        quantizer = make_quantizer(quantization, dim, PQ_SUBVECTORS)
+        self.store = MmapVectorStore(path, dim, quantizer, QUANTIZATION_RERANK)
+        self.compact_rows = compact_rows
+        self.rebuilt = False
+
+    async def load(self, db_pool) -> None:
+        start_time = time.time()
+        version = await get_corpus_version().current(db_pool)
+        # The API and the workers may share the store: one checks and rebuilds, the rest wait and reopen
+        rebuild_lock = self.store.rebuild_lock()
+        await asyncio.to_thread(rebuild_lock.__enter__)
+        try:
+            conn = await db_pool.acquire()
+            try:
+                row = await conn.fetchrow("SELECT COUNT(*) AS rows, COALESCE(MAX(id), 0) AS max_id FROM documents")
+            finally:
+                await db_pool.release(conn)
+            self.rebuilt = (row["rows"], row["max_id"]) != (len(self.store), self.store.max_id())
+            if self.rebuilt:
+                await asyncio.to_thread(self.store.clear)
+                await copy_documents(db_pool, self.store.append)
+                await asyncio.to_thread(self.store.compact)
+            elif self.store.quantizer is not None and self.store.stats()["quantization"] == "none":
+                # Quantization was switched on for an existing store: build its codes
+                await asyncio.to_thread(self.store.compact)
+        finally:
+            rebuild_lock.__exit__(None, None, None)
+        self._mark_synced(version)
+        self.ready = True
+        self.load_time = time.time() - start_time
+        action = "rebuilt" if self.rebuilt else "opened"
+        logger.info(f"{self.name} store {action}: {len(self.store)} rows in {self.load_time:.2f}s")
+
+    def indexed_ids(self) -> np.ndarray:
+        return self.store.ids()
+
+    def _search(self, query_vector: np.ndarray, limit: int) -> Chunks:
+        return [(chunk_id, content) for chunk_id, content, _ in self.store.search(query_vector, limit)]
+
+    def add(self, rows: List[Tuple[int, str, np.ndarray]]) -> None:
+        self.store.append(rows)
+        if self.store.stats()["log_rows"] >= self.compact_rows:
+            self.store.compact()
+
+    def remove(self, ids: Iterable[int]) -> None:
+        self.store.remove(ids)
+
+    def clear(self) -> None:
+        self.store.clear()
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.name,
+            "ready": self.ready,
+            "rebuilt": self.rebuilt,
+            "load_time": self.load_time,
+            "synced_version": self.synced_version,
+            "catch_ups": self.catch_ups,
+            **self.store.stats()
+        }
+
+_backend: Optional[RetrievalBackend] = None
+
+def create_retrieval_backend(name: str = RETRIEVAL_BACKEND) -> RetrievalBackend:
+    if name == "pgvector":
+        return PgVectorBackend()
+    if name == "hnsw":
+        return HNSWBackend()
+    if name == "mmap":
+        return MmapBackend()
+    raise ValueError(f"Unknown retrieval backend: {name}")
+
+def get_retrieval_backend() -> RetrievalBackend:
+    """Backend configured by RETRIEVAL_BACKEND"""
+    global _backend
+    if _backend is None:
+        _backend = create_retrieval_backend()
+    return _backend
+
+def set_retrieval_backend(backend: Optional[RetrievalBackend]) -> None:
+    """Swap the retrieval backend, e.g. for tests or benchmarks"""
+    global _backend
+    _backend = backend
+
+async def init_retrieval_backend(db_pool) -> RetrievalBackend:
+    """Build the configured backend's local state at startup"""
+    backend = get_retrieval_backend()
+    if backend.is_local:
+        await backend.load(db_pool)
+    return backend
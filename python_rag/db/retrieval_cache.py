@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import RETRIEVAL_CACHE_PATH, RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVAL_CACHE_MEMORY_ITEMS
+from db.corpus_state import get_corpus_version, on_corpus_change
+from db.vector_codec import to_vector_array, VectorLike
+
+Chunks = List[Tuple[int, str]]
+
+def retrieval_key(query_embedding: VectorLike, limit: int) -> str:
+    """
+    Cache key for a search: the normalized query embedding quantized to int8,
+    so float noise between identical questions maps to the same key.
+    """
+    vector = to_vector_array(query_embedding)
+    norm = float(np.linalg.norm(vector))
+    if norm:
+        vector = vector / norm
+    quantized = np.round(vector * 127).astype(np.int8)
+    return f"{limit}:{hashlib.sha1(quantized.tobytes()).hexdigest()}"
+
+class RetrievalCache:
+    """
+    Top-k (id, content) results per quantized query embedding, persisted in
+    SQLite with an in-memory LRU in front. Entries carry the corpus version they
+    were computed at; an entry from an older version is dropped when read.
+    """
+
+    def __init__(self, path: str = RETRIEVAL_CACHE_PATH, max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES,
+                 memory_items: int = RETRIEVAL_CACHE_MEMORY_ITEMS):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_items = memory_items
+        self._memory: "OrderedDict[str, Tuple[int, Chunks]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._puts_since_trim = 0
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS retrieval_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    corpus_version INTEGER NOT NULL,
+                    results TEXT NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_retrieval_cache_last_used ON retrieval_cache (last_used)")
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: str, version: int, chunks: Chunks) -> None:
+        self._memory[key] = (version, chunks)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key: str, version: int) -> Optional[Chunks]:
+        """Cached results for key at the given corpus version"""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                row = self._connect().execute(
+                    "SELECT corpus_version, results FROM retrieval_cache WHERE cache_key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = (row[0], [tuple(chunk) for chunk in json.loads(row[1])])
+                    if entry[0] == version:
+                        self._conn.execute("UPDATE retrieval_cache SET last_used = ? WHERE cache_key = ?", (time.time(), key))
+                        self._conn.commit()
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] != version:
+                # Lazily drop entries computed against an older document set
+                self._memory.pop(key, None)
+                self._connect().execute("DELETE FROM retrieval_cache WHERE cache_key = ?", (key,))
+                self._conn.commit()
+                self.stale += 1
+                self.misses += 1
+                return None
+            self._remember(key, *entry)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, version: int, chunks: Chunks) -> None:
+        with self._lock:
+            self._remember(key, version, chunks)
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO retrieval_cache (cache_key, corpus_version, results, last_used) VALUES (?, ?, ?, ?)",
+                (key, version, json.dumps(chunks), time.time())
+            )
+            self._puts_since_trim += 1
+            if self._puts_since_trim >= 100:
+                self._puts_since_trim = 0
+                conn.execute("""
+                    DELETE FROM retrieval_cache WHERE cache_key IN (
+                        SELECT cache_key FROM retrieval_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                    )
+                """, (self.max_entries,))
+            conn.commit()
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "corpus_version": get_corpus_version().last_seen
+        }
+
+_cache: Optional[RetrievalCache] = None
+
+def get_retrieval_cache() -> RetrievalCache:
+    """Process-wide retrieval cache backed by RETRIEVAL_CACHE_PATH"""
+    global _cache
+    if _cache is None:
+        _cache = RetrievalCache()
+    return _cache
+
+def set_retrieval_cache(cache: Optional[RetrievalCache]) -> None:
+    """Swap the retrieval cache, e.g. for a temporary one in tests"""
+    global _cache
+    _cache = cache
+
+@on_corpus_change
+def _drop_memory_entries(reason: str) -> None:
+    # The version check would catch these too; clearing frees the memory right away
+    if _cache is not None:
+        _cache.clear_memory()
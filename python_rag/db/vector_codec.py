@@ -0,0 +1,45 @@
+import struct
+from typing import Sequence, Union
+import numpy as np
+
+# pgvector binary wire format: uint16 dimension, uint16 unused, then big-endian float32 values
+_HEADER = struct.Struct('>HH')
+_WIRE_DTYPE = np.dtype('>f4')
+
+VectorLike = Union[np.ndarray, Sequence[float]]
+
+def to_vector_array(embedding: VectorLike) -> np.ndarray:
+    """Convert an embedding (list, tuple or array) to a contiguous float32 array"""
+    return np.ascontiguousarray(embedding, dtype=np.float32)
+
+def encode_vector(embedding: VectorLike) -> bytes:
+    """Encode an embedding into pgvector's binary representation"""
+    values = np.asarray(embedding, dtype=_WIRE_DTYPE)
+    if values.ndim != 1:
+        raise ValueError(f"Expected a 1-D embedding, got shape {values.shape}")
+    return _HEADER.pack(values.shape[0], 0) + values.tobytes()
+
+def decode_vector(data: bytes) -> np.ndarray:
+    """Decode pgvector's binary representation into a float32 array"""
+    dim, _ = _HEADER.unpack_from(data)
+    return np.frombuffer(data, dtype=_WIRE_DTYPE, count=dim, offset=_HEADER.size).astype(np.float32)
+
+# pgvector may be installed outside `public` (Supabase enables dashboard extensions into `extensions`)
+_VECTOR_SCHEMA_SQL = """
+    SELECT n.nspname FROM pg_extension e JOIN pg_namespace n ON n.oid = e.extnamespace
+    WHERE e.extname = 'vector'
+"""
+
+async def register_vector_codec(conn) -> None:
+    """Register the binary vector codec on a connection (used as the pool `init` hook)"""
+    schema = await conn.fetchval(_VECTOR_SCHEMA_SQL)
+    if schema is None:
+        # Without the extension there is no type to bind; failing here would fail every connection
+        return
+    await conn.set_type_codec(
+        'vector',
+        schema=schema,
+        encoder=encode_vector,
+        decoder=decode_vector,
+        format='binary'
+    )
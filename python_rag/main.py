@@ -4,10 +4,13 @@ from contextlib import asynccontextmanager
 # from api.endpoints import router
 from api.endpoints_gemini import router
 from db.database import get_db_pool, create_documents_table
+from db.retrieval_backend import init_retrieval_backend
+from db.index_manager import get_index_manager
+from services.file_utils_light import shutdown_extraction_pool
 # from services.embedding import load_model
 
 # from api.redis_worker import start_redis_worker
-from api.redis_worker_upstash import start_redis_worker
+from api.redis_worker_upstash import start_redis_worker, stop_redis_worker
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -28,9 +31,14 @@ async def lifespan(app: FastAPI):
     app.state.db_pool = await get_db_pool()
     # app.state.model = await load_model()
     await create_documents_table(app.state.db_pool)
+    await get_index_manager().start(app.state.db_pool)
+    await init_retrieval_backend(app.state.db_pool)
     # Start Redis worker as a background task
-    asyncio.create_task(start_redis_worker(app))
+    worker = asyncio.create_task(start_redis_worker(app))
     yield
+    # Finish requests already taken off Redis before the pool goes away
+    await stop_redis_worker(worker)
+    shutdown_extraction_pool()
     # await app.state.db_pool.close()
     # Shutdown: close DB pool with timeout
     try:
@@ -0,0 +1,218 @@
+import asyncio
+import math
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional, Tuple
+from config import (
+    ADMISSION_CAPACITY, ADMISSION_QUERY_RESERVE, ADMISSION_QUERY_SLO, ADMISSION_INGEST_SLO, ADMISSION_TENANT_LIMIT
+)
+
+# Request classes, highest priority first
+QUERY = "query"
+INGEST = "ingest"
+PRIORITY = (QUERY, INGEST)
+# Smoothing for the per-class service time used to predict queue waits
+SERVICE_TIME_ALPHA = 0.2
+MAX_RETRY_AFTER = 60
+
+_SLO = object()
+
+class Overloaded(Exception):
+    """Request turned away: 429 when the tenant is over its share, 503 when the service is saturated"""
+
+    def __init__(self, status_code: int, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.reason = reason
+
+class Ticket:
+    """A granted slot; release it exactly once when the work is done (further calls are no-ops)"""
+
+    __slots__ = ("controller", "request_class", "tenant", "started", "released")
+
+    def __init__(self, controller: "AdmissionController", request_class: str, tenant: Optional[str]):
+        self.controller = controller
+        self.request_class = request_class
+        self.tenant = tenant
+        self.started = 0.0
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+class AdmissionController:
+    """
+    Priority admission for queries and ingests sharing the Gemini quota, the
+    DB pool and the event loop.
+
+    At most `capacity` requests run at once. Ingests may only take
+    `capacity - query_reserve` of those slots, so interactive queries always
+    have room; a freed slot goes to a waiting query before any ingest. A
+    request that would wait longer than its class's SLO (predicted from the
+    queue ahead of it and the class's recent service time, or observed while
+    waiting) is rejected with 503 and a Retry-After hint instead of hanging.
+    A tenant with `tenant_limit` requests running or waiting gets 429.
+    """
+
+    def __init__(self, capacity: int = ADMISSION_CAPACITY, query_reserve: int = ADMISSION_QUERY_RESERVE,
+                 query_slo: float = ADMISSION_QUERY_SLO, ingest_slo: float = ADMISSION_INGEST_SLO,
+                 tenant_limit: int = ADMISSION_TENANT_LIMIT):
+        self.capacity = capacity
+        self.limits = {QUERY: capacity, INGEST: max(1, capacity - query_reserve)}
+        self.slo = {QUERY: query_slo, INGEST: ingest_slo}
+        self.tenant_limit = tenant_limit
+        self.running = {request_class: 0 for request_class in PRIORITY}
+        self._waiters: Dict[str, Deque[Tuple[asyncio.Future, Ticket]]] = {request_class: deque() for request_class in PRIORITY}
+        self._service_time: Dict[str, Optional[float]] = {request_class: None for request_class in PRIORITY}
+        self._tenants: Counter = Counter()
+        self.admitted: Counter = Counter()
+        self.rejected: Counter = Counter()
+
+    def _can_start(self, request_class: str) -> bool:
+        return sum(self.running.values()) < self.capacity and self.running[request_class] < self.limits[request_class]
+
+    def _ahead(self, request_class: str) -> int:
+        """Waiters that would be served before a new request of this class"""
+        return sum(len(self._waiters[c]) for c in PRIORITY[:PRIORITY.index(request_class) + 1])
+
+    def estimated_wait(self, request_class: str) -> Optional[float]:
+        """Predicted queue wait for a new request of this class, None until a service time is known"""
+        service_time = self._service_time[request_class]
+        if service_time is None:
+            return None
+        # Slots free up about every service_time / limit seconds while the class is saturated
+        return (self._ahead(request_class) + 1) / self.limits[request_class] * service_time
+
+    def _retry_after(self, request_class: str, wait: Optional[float] = None) -> int:
+        wait = wait if wait is not None else self._service_time[request_class] or 1.0
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(wait)))
+
+    def _reject(self, request_class: str, status_code: int, retry_after: int, reason: str) -> Overloaded:
+        self.rejected[(request_class, status_code)] += 1
+        return Overloaded(status_code, retry_after, reason)
+
+    def _start(self, ticket: Ticket) -> None:
+        ticket.started = time.monotonic()
+        self.running[ticket.request_class] += 1
+        self.admitted[ticket.request_class] += 1
+
+    def _drop_tenant(self, ticket: Ticket) -> None:
+        if ticket.tenant is not None:
+            self._tenants[ticket.tenant] -= 1
+            if self._tenants[ticket.tenant] <= 0:
+                del self._tenants[ticket.tenant]
+
+    def _release(self, ticket: Ticket) -> None:
+        request_class = ticket.request_class
+        self.running[request_class] -= 1
+        self._drop_tenant(ticket)
+        elapsed = time.monotonic() - ticket.started
+        previous = self._service_time[request_class]
+        self._service_time[request_class] = elapsed if previous is None else (
+            SERVICE_TIME_ALPHA * elapsed + (1 - SERVICE_TIME_ALPHA) * previous)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiters, queries first"""
+        for request_class in PRIORITY:
+            waiters = self._waiters[request_class]
+            while waiters and self._can_start(request_class):
+                future, ticket = waiters.popleft()
+                if future.done():
+                    continue
+                self._start(ticket)
+                future.set_result(ticket)
+
+    def _forget(self, future: asyncio.Future, ticket: Ticket) -> None:
+        try:
+            self._waiters[ticket.request_class].remove((future, ticket))
+        except ValueError:
+            pass
+        self._drop_tenant(ticket)
+
+    async def acquire(self, request_class: str, tenant: Optional[str] = None, max_wait=_SLO) -> Ticket:
+        """
+        Wait for a slot, at most max_wait seconds (the class SLO by default;
+        None waits as long as it takes). Raises Overloaded when turned away.
+        """
+        if max_wait is _SLO:
+            max_wait = self.slo[request_class]
+        if tenant is not None and self._tenants[tenant] >= self.tenant_limit:
+            raise self._reject(request_class, 429, self._retry_after(request_class),
+                               f"Too many concurrent requests for {tenant}")
+        ticket = Ticket(self, request_class, tenant)
+        if not self._ahead(request_class) and self._can_start(request_class):
+            if tenant is not None:
+                self._tenants[tenant] += 1
+            self._start(ticket)
+            return ticket
+        estimate = self.estimated_wait(request_class)
+        if max_wait is not None and estimate is not None and estimate > max_wait:
+            raise self._reject(request_class, 503, self._retry_after(request_class, estimate),
+                               f"Server busy: estimated {request_class} wait {estimate:.1f}s exceeds {max_wait:.0f}s")
+        if tenant is not None:
+            self._tenants[tenant] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[request_class].append((future, ticket))
+        self._dispatch()
+        try:
+            await asyncio.wait({future}, timeout=max_wait)
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                ticket.release()
+            else:
+                future.cancel()
+                self._forget(future, ticket)
+            raise
+        if future.done():
+            return ticket
+        future.cancel()
+        self._forget(future, ticket)
+        raise self._reject(request_class, 503, self._retry_after(request_class, estimate),
+                           f"Server busy: no {request_class} slot within {max_wait:.0f}s")
+
+    @asynccontextmanager
+    async def admit(self, request_class: str, tenant: Optional[str] = None, max_wait=_SLO):
+        ticket = await self.acquire(request_class, tenant, max_wait)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> Dict:
+        return {
+            "capacity": self.capacity,
+            "tenants": len(self._tenants),
+            **{
+                request_class: {
+                    "limit": self.limits[request_class],
+                    "running": self.running[request_class],
+                    "waiting": len(self._waiters[request_class]),
+                    "slo_s": self.slo[request_class],
+                    "service_time_s": round(self._service_time[request_class], 3)
+                    if self._service_time[request_class] is not None else None,
+                    "estimated_wait_s": self.estimated_wait(request_class),
+                    "admitted": self.admitted[request_class],
+                    "rejected_429": self.rejected[(request_class, 429)],
+                    "rejected_503": self.rejected[(request_class, 503)]
+                }
+                for request_class in PRIORITY
+            }
+        }
+
+_admission_controller: Optional[AdmissionController] = None
+
+def get_admission_controller() -> AdmissionController:
+    global _admission_controller
+    if _admission_controller is None:
+        _admission_controller = AdmissionController()
+    return _admission_controller
+
+def set_admission_controller(controller: Optional[AdmissionController]) -> None:
+    """Swap the controller, e.g. for tests"""
+    global _admission_controller
+    _admission_controller = controller
@@ -0,0 +1,153 @@
+import threading
+import time
+from typing import AsyncIterator, Dict, FrozenSet, Iterable, List, Optional, Tuple
+import numpy as np
+from config import ANSWER_CACHE_SIZE, ANSWER_CACHE_SIMILARITY, ANSWER_CACHE_TTL
+from db.corpus_state import on_corpus_change
+from db.vector_codec import to_vector_array, VectorLike
+from utils.logger import logger
+from .context_packer import context_packer
+from .embedding_gemini import get_answer_gemini, stream_answer_gemini
+
+class SemanticAnswerCache:
+    """
+    Answers keyed by query embedding similarity.
+
+    Query embeddings live in one preallocated, L2-normalized float32 matrix, so a
+    lookup is a single matrix-vector product. A cached answer is reused only when
+    the new query is at least `threshold` cosine-similar AND retrieved exactly the
+    same chunk ids, i.e. the LLM would have seen the same context. Entries expire
+    after `ttl` seconds; when full, the least recently used slot is replaced.
+    """
+
+    def __init__(self, capacity: int = ANSWER_CACHE_SIZE, threshold: float = ANSWER_CACHE_SIMILARITY,
+                 ttl: float = ANSWER_CACHE_TTL, dim: int = 768):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.ttl = ttl
+        self.dim = dim
+        self._embeddings = np.zeros((capacity, dim), dtype=np.float32)
+        self._expires = np.zeros(capacity, dtype=np.float64)
+        self._last_used = np.zeros(capacity, dtype=np.float64)
+        self._valid = np.zeros(capacity, dtype=bool)
+        self._chunk_ids: List[Optional[FrozenSet[int]]] = [None] * capacity
+        self._answers: List[Optional[str]] = [None] * capacity
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _normalize(self, embedding: VectorLike) -> Optional[np.ndarray]:
+        vector = to_vector_array(embedding)
+        norm = float(np.linalg.norm(vector))
+        if vector.shape != (self.dim,) or norm == 0.0:
+            return None
+        return vector / norm
+
+    def get(self, query_embedding: VectorLike, chunk_ids: Iterable[int]) -> Optional[str]:
+        """Cached answer for a similar query over the same chunks, if any"""
+        query = self._normalize(query_embedding)
+        if query is None:
+            return None
+        wanted = frozenset(chunk_ids)
+        now = time.time()
+        with self._lock:
+            self._valid &= self._expires > now
+            slots = np.flatnonzero(self._valid)
+            if slots.size:
+                similarities = self._embeddings[slots] @ query
+                order = np.argsort(-similarities)
+                for index in order:
+                    if similarities[index] < self.threshold:
+                        break
+                    slot = slots[index]
+                    if self._chunk_ids[slot] == wanted:
+                        self._last_used[slot] = now
+                        self.hits += 1
+                        return self._answers[slot]
+            self.misses += 1
+            return None
+
+    def put(self, query_embedding: VectorLike, chunk_ids: Iterable[int], answer: str) -> None:
+        query = self._normalize(query_embedding)
+        if query is None:
+            return
+        now = time.time()
+        with self._lock:
+            free = np.flatnonzero(~self._valid)
+            slot = int(free[0]) if free.size else int(np.argmin(self._last_used))
+            self._embeddings[slot] = query
+            self._expires[slot] = now + self.ttl
+            self._last_used[slot] = now
+            self._valid[slot] = True
+            self._chunk_ids[slot] = frozenset(chunk_ids)
+            self._answers[slot] = answer
+
+    def clear(self) -> None:
+        with self._lock:
+            self._valid[:] = False
+            self._chunk_ids = [None] * self.capacity
+            self._answers = [None] * self.capacity
+            self.invalidations += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": int(self._valid.sum()),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations
+        }
+
+semantic_answer_cache = SemanticAnswerCache()
+
+@on_corpus_change
+def _invalidate_answers(reason: str) -> None:
+    # New or removed documents can change what the right answer is
+    semantic_answer_cache.clear()
+
+def _cached_or_packed(query_embedding: Optional[VectorLike], chunk_ids: List[int], chunks: List[Tuple[int, str]]):
+    """(cached answer, None) on a semantic cache hit, else (None, packed context)"""
+    # Lexical-only retrieval has no query embedding to match on
+    if query_embedding is not None:
+        answer = semantic_answer_cache.get(query_embedding, chunk_ids)
+        if answer is not None:
+            return answer, None
+    packed = context_packer.pack(chunks)
+    logger.performance({"context_" + key: value for key, value in packed.stats.items()})
+    return None, packed
+
+async def answer_from_chunks(question: str, query_embedding: Optional[VectorLike], chunks: List[Tuple[int, str]]) -> str:
+    """Answer from retrieved (id, content) chunks, reusing a semantically cached answer when possible"""
+    if not chunks:
+        return "No relevant documents found."
+    chunk_ids = [chunk_id for chunk_id, _ in chunks]
+    answer, packed = _cached_or_packed(query_embedding, chunk_ids, chunks)
+    if answer is not None:
+        return answer
+    answer = await get_answer_gemini(question, packed.text)
+    # Failed generations come back as "Error ..." strings and must not be reused
+    if query_embedding is not None and not answer.startswith("Error"):
+        semantic_answer_cache.put(query_embedding, chunk_ids, answer)
+    return answer
+
+async def stream_answer_from_chunks(question: str, query_embedding: Optional[VectorLike],
+                                    chunks: List[Tuple[int, str]]) -> AsyncIterator[str]:
+    """answer_from_chunks, yielding the answer in pieces as it is generated; cached once complete"""
+    if not chunks:
+        yield "No relevant documents found."
+        return
+    chunk_ids = [chunk_id for chunk_id, _ in chunks]
+    answer, packed = _cached_or_packed(query_embedding, chunk_ids, chunks)
+    if answer is not None:
+        yield answer
+        return
+    pieces = []
+    # A failed generation raises here, after any pieces already sent, and is not cached
+    async for piece in stream_answer_gemini(question, packed.text):
+        pieces.append(piece)
+        yield piece
+    if query_embedding is not None:
+        semantic_answer_cache.put(query_embedding, chunk_ids, "".join(pieces))
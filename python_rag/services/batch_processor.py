@@ -4,68 +4,110 @@ import json
 import tempfile
 import os
 import time
-from typing import List, Tuple
-from .embedding_gemini import _generate_embedding_api_call
+from typing import List, Optional, Tuple
+from .embedding_backend import get_embedding_backend, split_into_batches
+from .embedding_cache import content_hash, get_embedding_cache
+from .rate_limiter import call_with_retry, embedding_limiter
 
 batch_processing_limit_fallback = 20
 
-async def process_embeddings_batch(chunks: List[str], batch_size: int = 50, use_gemini_batch: bool = False) -> List[Tuple[str, List[float]]]:
+class EmbeddingFailed(Exception):
+    """Chunks left without an embedding after retries; `positions` index the chunks passed in"""
+
+    def __init__(self, positions: List[int], errors: List[str]):
+        self.positions = positions
+        self.errors = errors
+        shown = ", ".join(map(str, positions[:20])) + (", ..." if len(positions) > 20 else "")
+        super().__init__(f"{len(positions)} chunks got no embedding (positions {shown}): {'; '.join(errors[:3])}")
+
+async def process_embeddings_batch(chunks: List[str], batch_size: int = 50, use_gemini_batch: bool = False,
+                                   content_hashes: Optional[List[str]] = None) -> List[Tuple[str, List[float]]]:
     """
     Process chunks in batches with concurrent embedding generation
     
     Args:
         chunks: List of text chunks to process
-        batch_size: Number of chunks to process concurrently
+        batch_size: Maximum number of chunks sent in one embedding request
         use_gemini_batch: Whether to use Gemini's batch API for large sets
+        content_hashes: sha256 of each chunk, if already computed (used as cache keys)
     
     Returns:
-        List of (chunk, embedding) pairs
+        List of (chunk, embedding) pairs, one for every non-blank chunk
+
+    Raises:
+        EmbeddingFailed: some chunks could not be embedded after retries. The
+        ones that were embedded are cached, so a retry only pays for the rest.
     """
     if len(chunks) > 100 and use_gemini_batch:
         return await _process_gemini_batch_mode(chunks)
     else:
-        return await _process_concurrent_batches(chunks, batch_size)
+        return await _process_concurrent_batches(chunks, batch_size, content_hashes)
 
-async def _process_concurrent_batches(chunks: List[str], batch_size: int) -> List[Tuple[str, List[float]]]:
-    """Process chunks using concurrent individual API calls"""
-    print(f"🚀 Processing {len(chunks)} chunks in batches of {batch_size}")
+async def _process_concurrent_batches(chunks: List[str], batch_size: int,
+                                      content_hashes: Optional[List[str]] = None) -> List[Tuple[str, List[float]]]:
+    """Embed chunks with batched API calls, several requests in flight at once"""
+    backend = get_embedding_backend()
+    cache = get_embedding_cache()
+    if content_hashes is None:
+        content_hashes = [content_hash(chunk) for chunk in chunks]
+    valid = [(index, chunk, digest) for index, (chunk, digest) in enumerate(zip(chunks, content_hashes)) if chunk.strip()]
+    if not valid:
+        return []
+    valid_chunks = [chunk for _, chunk, _ in valid]
+    valid_hashes = [digest for _, _, digest in valid]
     
-    all_results = []
+    # Only chunks missing from the persistent cache go to the API
+    embeddings = [None] * len(valid_chunks)
+    cached = await cache.aget_many(valid_hashes, backend.model, "retrieval_document")
+    misses = []
+    for position, digest in enumerate(valid_hashes):
+        if digest in cached:
+            embeddings[position] = cached[digest].tolist()
+        else:
+            misses.append(position)
     
-    for i in range(0, len(chunks), batch_size):
-        batch = chunks[i:i + batch_size]
-        print(f"📦 Processing batch {i//batch_size + 1}/{(len(chunks) + batch_size - 1)//batch_size} ({len(batch)} chunks)")
-        
-        # Process batch concurrently
-        batch_tasks = []
-        for chunk in batch:
-            if chunk.strip():
-                task = _generate_embedding_api_call(chunk, "retrieval_document")
-                batch_tasks.append((chunk, task))
-        
-        # Wait for all embeddings in this batch
-        batch_results = []
-        if batch_tasks:
-            try:
-                embeddings = await asyncio.wait_for(
-                    asyncio.gather(*[task for _, task in batch_tasks], return_exceptions=True),
-                    timeout=120.0  # 2 minute timeout per batch
-                )
-                
-                for (chunk, _), embedding in zip(batch_tasks, embeddings):
-                    if isinstance(embedding, Exception):
-                        print(f"❌ Error processing chunk: {embedding}")
-                        continue
-                    batch_results.append((chunk, embedding))
-                    
-            except asyncio.TimeoutError:
-                print(f"❌ Batch {i//batch_size + 1} timed out")
-                continue
-        
-        all_results.extend(batch_results)
-        print(f"✅ Batch completed: {len(batch_results)}/{len(batch)} successful")
+    request_batches = [
+        [misses[i] for i in batch]
+        for batch in split_into_batches(
+            [valid_chunks[p] for p in misses],
+            max_items=min(batch_size, backend.max_batch_items),
+            max_chars=backend.max_batch_chars
+        )
+    ]
+    print(f"🚀 Processing {len(valid_chunks)} chunks: {len(cached)} cached, {len(misses)} in {len(request_batches)} batched requests")
+    
+    errors = []
     
-    return all_results
+    async def embed_request(batch_num: int, positions: List[int]):
+        texts = [valid_chunks[p] for p in positions]
+        try:
+            # Throttled or timed-out requests are retried (only this batch's chunks)
+            # under the shared adaptive limiter
+            vectors = await call_with_retry(
+                embedding_limiter,
+                lambda: backend.embed_batch(texts, "retrieval_document"),
+                timeout=120.0  # 2 minute timeout per request
+            )
+        except Exception as e:
+            print(f"❌ Error processing batch {batch_num}: {e}")
+            errors.append(f"batch {batch_num}: {e}")
+            return
+        if len(vectors) != len(positions):
+            print(f"❌ Batch {batch_num} returned {len(vectors)} embeddings for {len(positions)} chunks")
+            errors.append(f"batch {batch_num}: {len(vectors)} embeddings for {len(positions)} chunks")
+            return
+        # Results come back in request order, so map them to chunk positions
+        for position, vector in zip(positions, vectors):
+            embeddings[position] = vector
+        await cache.aput_many([(valid_hashes[p], v) for p, v in zip(positions, vectors)], backend.model, "retrieval_document")
+    
+    await asyncio.gather(*[embed_request(n + 1, positions) for n, positions in enumerate(request_batches)])
+    
+    failed = [valid[p][0] for p, embedding in enumerate(embeddings) if embedding is None]
+    if failed:
+        raise EmbeddingFailed(failed, errors)
+    print(f"✅ Embedded {len(valid_chunks)} chunks (limiter: {embedding_limiter.stats()})")
+    return list(zip(valid_chunks, embeddings))
 
 async def _process_gemini_batch_mode(chunks: List[str]) -> List[Tuple[str, List[float]]]:
     """Process chunks using Gemini's batch API (for large datasets)"""
@@ -130,10 +172,14 @@ async def _process_gemini_batch_mode(chunks: List[str]) -> List[Tuple[str, List[
                             embedding = result['response']['body']['embedding']['values']
                             embeddings_map[chunk_index] = embedding
                 
+                missing = [i for i, chunk in enumerate(chunks) if chunk.strip() and i not in embeddings_map]
+                if missing:
+                    raise EmbeddingFailed(missing, ["batch job returned no embedding"])
+                
                 # Return embeddings in original order
                 results = []
                 for i, chunk in enumerate(chunks):
-                    if i in embeddings_map and chunk.strip():
+                    if chunk.strip():
                         results.append((chunk, embeddings_map[i]))
                 
                 print(f"🎉 Batch processing completed: {len(results)} embeddings generated")
@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+from config import BLOB_STORE, BLOB_STORE_PATH, BLOB_TTL, REDIS_URL
+from utils.logger import logger
+
+# Redis blobs are fetched in ranges of this many bytes, so no single reply holds the whole file
+REDIS_READ_CHUNK = 4 * 1024 * 1024
+# The disk store removes expired blobs at most this often (seconds)
+SWEEP_INTERVAL = 300
+
+# <sha256>-<request id>: the checksum names the content, the suffix keeps every request's blob separate
+_REF_RE = re.compile(r"[0-9a-f]{64}(-[0-9A-Za-z_-]{1,64})?")
+
+def checksum(data) -> str:
+    """sha256 hex digest of bytes, a memoryview or an mmap, hashed in place"""
+    return hashlib.sha256(data).hexdigest()
+
+def check_ref(ref: str) -> str:
+    # Anything else could point outside the disk store
+    if not isinstance(ref, str) or not _REF_RE.fullmatch(ref):
+        raise ValueError(f"Invalid payload_ref {ref!r}")
+    return ref
+
+def new_ref(digest: str, request_id: Optional[str] = None) -> str:
+    """A ref unique to one request, so two uploads of the same file never share (or delete) a blob"""
+    return check_ref(f"{digest}-{request_id or uuid.uuid4().hex}")
+
+class BlobPayload:
+    """
+    An opened blob. `view` is a read-only memoryview of its bytes (over an
+    mmap of the file for disk blobs); `path` is a local file holding the same
+    bytes, or None when they only exist in memory.
+    """
+
+    def __init__(self, view: memoryview, path: Optional[str] = None, mapping: Optional[mmap.mmap] = None):
+        self.view = view
+        self.path = path
+        self._mapping = mapping
+
+    @property
+    def size(self) -> int:
+        return self.view.nbytes
+
+    def close(self) -> None:
+        try:
+            self.view.release()
+            if self._mapping is not None:
+                self._mapping.close()
+        except BufferError:
+            # A slice is still referenced (e.g. by an abandoned generator); the mapping closes when it is collected
+            logger.debug("Blob still referenced on close, leaving it to the garbage collector")
+
+class BlobStore(ABC):
+    """
+    Holds ingest file bytes outside Redis messages. The producer calls `put`
+    once per request and sends the returned payload_ref / checksum / size with
+    it; the worker opens the ref, gets a zero-copy view of the bytes and, once
+    the ingest succeeded, shortens the blob's lifetime to BLOB_DONE_TTL so a
+    redelivery of the same request can still read it.
+    """
+
+    @abstractmethod
+    async def put(self, data, request_id: Optional[str] = None) -> Dict:
+        """Store bytes; returns the payload_ref, checksum and size fields for the message"""
+
+    @abstractmethod
+    async def size(self, ref: str) -> Optional[int]:
+        """Blob size in bytes, None when it does not exist (expired or never written)"""
+
+    @abstractmethod
+    async def delete(self, ref: str) -> None:
+        """Remove a blob; missing blobs are ignored"""
+
+    @abstractmethod
+    async def expire(self, ref: str, ttl: int) -> None:
+        """Let a blob expire ttl seconds from now; missing blobs are ignored"""
+
+    @abstractmethod
+    async def _load(self, ref: str) -> BlobPayload:
+        """Open a blob without verifying it"""
+
+    @asynccontextmanager
+    async def open(self, ref: str, expected_checksum: Optional[str] = None) -> AsyncIterator[BlobPayload]:
+        """Open a blob for reading, verifying its sha256 when a checksum is given"""
+        payload = await self._load(ref)
+        try:
+            if expected_checksum is not None:
+                actual = await asyncio.to_thread(checksum, payload.view)
+                if actual != expected_checksum.lower():
+                    raise ValueError(f"Payload {ref} checksum mismatch")
+            yield payload
+        finally:
+            payload.close()
+
+class DiskBlobStore(BlobStore):
+    """
+    One file per ref under `path`, which the producer and the worker must
+    share. Blobs are written through a temp file and renamed, so readers never
+    see a partial file, and mapped read-only when opened. Files whose mtime is
+    more than `ttl` seconds old are swept on put; `expire` backdates it.
+    """
+
+    def __init__(self, path: str = BLOB_STORE_PATH, ttl: int = BLOB_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._last_sweep = 0.0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, ref: str) -> str:
+        return os.path.join(self.path, check_ref(ref))
+
+    def _write(self, data, request_id: Optional[str]) -> Dict:
+        digest = checksum(data)
+        ref = new_ref(digest, request_id)
+        with tempfile.NamedTemporaryFile(dir=self.path, prefix=".tmp-", delete=False) as f:
+            f.write(data)
+        os.replace(f.name, self._file(ref))
+        return {"payload_ref": ref, "checksum": digest, "size": memoryview(data).nbytes}
+
+    def _sweep(self) -> int:
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for entry in os.scandir(self.path):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    async def put(self, data, request_id: Optional[str] = None) -> Dict:
+        ref = await asyncio.to_thread(self._write, data, request_id)
+        if time.monotonic() - self._last_sweep > SWEEP_INTERVAL:
+            self._last_sweep = time.monotonic()
+            removed = await asyncio.to_thread(self._sweep)
+            if removed:
+                logger.debug(f"Removed {removed} expired blobs")
+        return ref
+
+    async def size(self, ref: str) -> Optional[int]:
+        try:
+            return os.stat(self._file(ref)).st_size
+        except FileNotFoundError:
+            return None
+
+    async def delete(self, ref: str) -> None:
+        try:
+            os.unlink(self._file(ref))
+        except FileNotFoundError:
+            pass
+
+    async def expire(self, ref: str, ttl: int) -> None:
+        # The sweep removes files older than self.ttl, so date this one to reach that age in ttl seconds
+        mtime = time.time() - self.ttl + ttl
+        try:
+            os.utime(self._file(ref), (mtime, mtime))
+        except FileNotFoundError:
+            pass
+
+    async def _load(self, ref: str) -> BlobPayload:
+        path = self._file(ref)
+        try:
+            with open(path, "rb") as f:
+                # mmap cannot map an empty file
+                if os.fstat(f.fileno()).st_size == 0:
+                    return BlobPayload(memoryview(b""), path)
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            raise ValueError(f"Payload {ref} not found (expired or never written)")
+        return BlobPayload(memoryview(mapping), path, mapping)
+
+class RedisBlobStore(BlobStore):
+    """
+    Blobs as Redis strings under `<prefix><payload_ref>`, expiring after `ttl`
+    seconds. Reads fetch fixed-size ranges into one preallocated buffer.
+    Needs a connection without decode_responses.
+    """
+
+    def __init__(self, redis_conn, ttl: int = BLOB_TTL, prefix: str = "blob:"):
+        self.redis = redis_conn
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _key(self, ref: str) -> str:
+        return self.prefix + check_ref(ref)
+
+    async def put(self, data, request_id: Optional[str] = None) -> Dict:
+        digest = checksum(data)
+        ref = new_ref(digest, request_id)
+        await self.redis.set(self._key(ref), data if isinstance(data, bytes) else bytes(data), ex=self.ttl)
+        return {"payload_ref": ref, "checksum": digest, "size": memoryview(data).nbytes}
+
+    async def size(self, ref: str) -> Optional[int]:
+        key = self._key(ref)
+        size = await self.redis.strlen(key)
+        if size == 0 and not await self.redis.exists(key):
+            return None
+        return size
+
+    async def delete(self, ref: str) -> None:
+        await self.redis.delete(self._key(ref))
+
+    async def expire(self, ref: str, ttl: int) -> None:
+        await self.redis.expire(self._key(ref), ttl)
+
+    async def _load(self, ref: str) -> BlobPayload:
+        size = await self.size(ref)
+        if size is None:
+            raise ValueError(f"Payload {ref} not found (expired or never written)")
+        key = self._key(ref)
+        buffer = bytearray(size)
+        for start in range(0, size, REDIS_READ_CHUNK):
+            end = min(start + REDIS_READ_CHUNK, size)
+            piece = await self.redis.getrange(key, start, end - 1)
+            if len(piece) != end - start:
+                raise ValueError(f"Payload {ref} changed or expired while reading")
+            buffer[start:end] = piece
+        return BlobPayload(memoryview(buffer).toreadonly())
+
+_blob_store: Optional[BlobStore] = None
+
+def get_blob_store() -> BlobStore:
+    global _blob_store
+    if _blob_store is None:
+        if BLOB_STORE == "redis":
+            import redis.asyncio as redis
+            _blob_store = RedisBlobStore(redis.from_url(REDIS_URL, ssl_cert_reqs=None))
+        elif BLOB_STORE == "disk":
+            _blob_store = DiskBlobStore()
+        else:
+            raise ValueError(f"Unknown BLOB_STORE {BLOB_STORE!r} (expected 'disk' or 'redis')")
+    return _blob_store
+
+def set_blob_store(store: Optional[BlobStore]) -> None:
+    """Swap the store, e.g. for tests"""
+    global _blob_store
+    _blob_store = store
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from typing import List, Optional
+import numpy as np
+import google.generativeai as genai
+from config import EMBEDDING_BATCH_MAX_CHARS
+from .embedding_gemini import GEMINI_EMBEDDING_MODEL, update_activity
+
+# batchEmbedContents accepts at most 100 requests per call
+GEMINI_MAX_BATCH_ITEMS = 100
+
+class EmbeddingBackend(ABC):
+    """Provider that embeds a list of texts in a single call"""
+
+    model = GEMINI_EMBEDDING_MODEL
+    max_batch_items = GEMINI_MAX_BATCH_ITEMS
+    max_batch_chars = EMBEDDING_BATCH_MAX_CHARS
+
+    @abstractmethod
+    async def embed_batch(self, texts: List[str], task_type: str) -> List[List[float]]:
+        """Return one embedding per text, in the same order"""
+
+class GeminiEmbeddingBackend(EmbeddingBackend):
+    """Gemini batchEmbedContents: one HTTP request per batch, no thread hop"""
+
+    async def embed_batch(self, texts: List[str], task_type: str) -> List[List[float]]:
+        await update_activity()
+        result = await genai.embed_content_async(
+            model=GEMINI_EMBEDDING_MODEL,
+            content=list(texts),
+            task_type=task_type
+        )
+        return result['embedding']
+
+class FakeEmbeddingBackend(EmbeddingBackend):
+    """
+    Deterministic in-process stand-in for the embedding API, for tests and
+    offline benchmarks. Simulates a fixed per-request latency plus a small
+    per-item cost, and records how many calls were made.
+    """
+
+    def __init__(self, dim: int = 768, request_latency: float = 0.05, per_item_latency: float = 0.0005,
+                 max_batch_items: int = GEMINI_MAX_BATCH_ITEMS, max_batch_chars: int = EMBEDDING_BATCH_MAX_CHARS):
+        self.model = f"fake-{dim}"
+        self.dim = dim
+        self.request_latency = request_latency
+        self.per_item_latency = per_item_latency
+        self.max_batch_items = max_batch_items
+        self.max_batch_chars = max_batch_chars
+        self.calls = 0
+        self.items = 0
+
+    def vector_for(self, text: str) -> List[float]:
+        """Unit vector derived from the text hash"""
+        seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    async def embed_batch(self, texts: List[str], task_type: str) -> List[List[float]]:
+        if len(texts) > self.max_batch_items:
+            raise ValueError(f"Batch of {len(texts)} exceeds {self.max_batch_items} items")
+        self.calls += 1
+        self.items += len(texts)
+        await asyncio.sleep(self.request_latency + self.per_item_latency * len(texts))
+        return [self.vector_for(text) for text in texts]
+
+def split_into_batches(texts: List[str], max_items: int, max_chars: int) -> List[List[int]]:
+    """
+    Group text positions into request batches capped by item count and total
+    characters. A single text longer than max_chars gets a batch of its own.
+    """
+    batches = []
+    current = []
+    current_chars = 0
+    for index, text in enumerate(texts):
+        if current and (len(current) >= max_items or current_chars + len(text) > max_chars):
+            batches.append(current)
+            current, current_chars = [], 0
+        current.append(index)
+        current_chars += len(text)
+    if current:
+        batches.append(current)
+    return batches
+
+_backend: Optional[EmbeddingBackend] = None
+
+def get_embedding_backend() -> EmbeddingBackend:
+    """Backend used for document embeddings (Gemini unless overridden)"""
+    global _backend
+    if _backend is None:
+        _backend = GeminiEmbeddingBackend()
+    return _backend
+
+def set_embedding_backend(backend: Optional[EmbeddingBackend]) -> None:
+    """Swap the embedding backend, e.g. for FakeEmbeddingBackend in tests"""
+    global _backend
+    _backend = backend
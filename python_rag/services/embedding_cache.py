@@ -0,0 +1,197 @@
+import asyncio
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_MB, EMBEDDING_CACHE_MEMORY_ITEMS
+
+CacheKey = Tuple[str, str, str]
+
+def content_hash(text: str) -> str:
+    """sha256 of the text, the same hash stored in documents.content_hash"""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class EmbeddingCache:
+    """
+    Content-addressed embedding store keyed by (sha256(text), model, task_type).
+
+    Vectors are kept as float32 blobs in SQLite (WAL mode, so the API process and
+    the Redis worker can share one file) with an in-memory LRU in front. When the
+    stored vectors exceed max_bytes the least recently used rows are evicted.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_bytes: int = EMBEDDING_CACHE_MAX_MB * 1024 * 1024,
+                 memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory: "OrderedDict[CacheKey, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._stored_bytes: Optional[int] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if self.path != ":memory:":
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    content_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    task_type TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (content_hash, model, task_type)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+            self._conn = conn
+        return self._conn
+
+    def _remember(self, key: CacheKey, vector: np.ndarray) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get_many(self, hashes: Sequence[str], model: str, task_type: str) -> Dict[str, np.ndarray]:
+        """Cached vectors for the given content hashes (misses are left out)"""
+        found = {}
+        with self._lock:
+            missing = []
+            for digest in hashes:
+                key = (digest, model, task_type)
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[digest] = vector
+                else:
+                    missing.append(digest)
+            self.memory_hits += len(found)
+
+            if missing:
+                conn = self._connect()
+                unique = list(dict.fromkeys(missing))
+                for i in range(0, len(unique), 500):
+                    part = unique[i:i + 500]
+                    placeholders = ",".join("?" * len(part))
+                    rows = conn.execute(
+                        f"SELECT content_hash, vector FROM embeddings "
+                        f"WHERE model = ? AND task_type = ? AND content_hash IN ({placeholders})",
+                        [model, task_type, *part]
+                    ).fetchall()
+                    for digest, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        found[digest] = vector
+                        self._remember((digest, model, task_type), vector)
+                disk_found = [digest for digest in missing if digest in found]
+                self.disk_hits += len(disk_found)
+                self.misses += len(missing) - len(disk_found)
+                if disk_found:
+                    conn.executemany(
+                        "UPDATE embeddings SET last_used = ? WHERE content_hash = ? AND model = ? AND task_type = ?",
+                        [(time.time(), digest, model, task_type) for digest in set(disk_found)]
+                    )
+                    conn.commit()
+        return found
+
+    def put_many(self, items: Iterable[Tuple[str, Sequence[float]]], model: str, task_type: str) -> None:
+        """Store (content_hash, vector) pairs"""
+        now = time.time()
+        rows = []
+        with self._lock:
+            for digest, vector in items:
+                array = np.ascontiguousarray(vector, dtype=np.float32)
+                self._remember((digest, model, task_type), array)
+                rows.append((digest, model, task_type, array.tobytes(), now))
+            if not rows:
+                return
+            conn = self._connect()
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (content_hash, model, task_type, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            conn.commit()
+            if self._stored_bytes is None:
+                self._stored_bytes = conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+            else:
+                self._stored_bytes += sum(len(row[3]) for row in rows)
+            if self._stored_bytes > self.max_bytes:
+                self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        """Drop least recently used rows until the store is at 90% of max_bytes"""
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        deleted = 0
+        excess = self._stored_bytes - target
+        for rowid, size in conn.execute("SELECT rowid, LENGTH(vector) FROM embeddings ORDER BY last_used"):
+            if freed >= excess:
+                break
+            freed += size
+            deleted += 1
+            conn.execute("DELETE FROM embeddings WHERE rowid = ?", (rowid,))
+        conn.commit()
+        self._stored_bytes -= freed
+        self.evictions += deleted
+
+    def get(self, digest: str, model: str, task_type: str) -> Optional[np.ndarray]:
+        return self.get_many([digest], model, task_type).get(digest)
+
+    def put(self, digest: str, vector: Sequence[float], model: str, task_type: str) -> None:
+        self.put_many([(digest, vector)], model, task_type)
+
+    async def aget_many(self, hashes: Sequence[str], model: str, task_type: str) -> Dict[str, np.ndarray]:
+        return await asyncio.to_thread(self.get_many, hashes, model, task_type)
+
+    async def aput_many(self, items: List[Tuple[str, Sequence[float]]], model: str, task_type: str) -> None:
+        await asyncio.to_thread(self.put_many, items, model, task_type)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._connect().execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._stored_bytes = 0
+
+    def stats(self) -> Dict:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {
+            "hits": hits,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": entries,
+            "memory_entries": len(self._memory),
+            "stored_bytes": self._stored_bytes,
+            "evictions": self.evictions
+        }
+
+_cache: Optional[EmbeddingCache] = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    """Process-wide embedding cache backed by EMBEDDING_CACHE_PATH"""
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
+
+def set_embedding_cache(cache: Optional[EmbeddingCache]) -> None:
+    """Swap the embedding cache, e.g. for a temporary one in tests"""
+    global _cache
+    _cache = cache
@@ -1,15 +1,21 @@
 import asyncio
 import google.generativeai as genai
-from async_lru import alru_cache
+from collections import OrderedDict
 from config import GEMINI_API_KEY
 from dotenv import load_dotenv
 import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from .embedding_cache import content_hash, get_embedding_cache
+from .rate_limiter import call_with_retry, embedding_limiter
+from utils.single_flight import answer_flight, get_single_flight_stats, query_embedding_flight
 
 load_dotenv()
 
 # Configure Gemini once
 genai.configure(api_key=GEMINI_API_KEY)
 
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
+
 # Global variable to track activity
 _last_activity = time.time()
 
@@ -35,20 +41,28 @@ async def start_heartbeat():
     print("💓 Heartbeat started")
 
 # Core embedding functions
-@alru_cache(maxsize=1024)
-async def _generate_embedding_api_call(text: str, task_type: str):
-    """Internal cached API call function"""
+async def _generate_embedding_api_call(text: str, task_type: str, text_hash: Optional[str] = None):
+    """Embedding API call behind the persistent content-addressed cache"""
+    cache = get_embedding_cache()
+    digest = text_hash or content_hash(text)
+    cached = await cache.aget_many([digest], GEMINI_EMBEDDING_MODEL, task_type)
+    if digest in cached:
+        return cached[digest].tolist()
     try:
         await update_activity()
         print(f"🔥 API call for {task_type} embedding ({len(text)} chars)")
         
-        result = await asyncio.to_thread(
-            genai.embed_content,
-            model="models/text-embedding-004",
-            content=text,
-            task_type=task_type
+        result = await call_with_retry(
+            embedding_limiter,
+            lambda: asyncio.to_thread(
+                genai.embed_content,
+                model=GEMINI_EMBEDDING_MODEL,
+                content=text,
+                task_type=task_type
+            )
         )
         
+        await cache.aput_many([(digest, result['embedding'])], GEMINI_EMBEDDING_MODEL, task_type)
         return result['embedding']
     except Exception as e:
         print(f"❌ Embedding API error: {e}")
@@ -65,47 +79,166 @@ async def generate_query_embedding_gemini(text: str):
     """Generate query embedding - always executes for message flow"""
     await update_activity()
     print(f"🔍 Processing query embedding")
-    return await _generate_embedding_api_call(text, "retrieval_query")
-
-@alru_cache(maxsize=128)
-async def get_answer_gemini(question: str, context: str):
-    """Generate answer with caching"""
-    try:
-        await update_activity()
-        print(f"💬 Generating answer")
-        
-        genai_model = genai.GenerativeModel('gemini-1.5-flash')
-        prompt = f"""Context: {context}
+    # Users asking the same question at once share one embedding call
+    return await query_embedding_flight.do(
+        text,
+        lambda: _generate_embedding_api_call(text, "retrieval_query"),
+        label=text
+    )
+
+ANSWER_MODEL = 'gemini-1.5-flash'
+ANSWER_ERROR = "Error generating answer."
+
+class AnswerTextCache:
+    """Final answer text per (question, context), least recently used evicted first"""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[str]:
+        answer = self._items.get(key)
+        if answer is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return answer
+
+    def put(self, key: Tuple[str, str], answer: str) -> None:
+        self._items[key] = answer
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def info(self) -> Dict:
+        return {"hits": self.hits, "misses": self.misses, "maxsize": self.maxsize, "currsize": len(self._items)}
+
+_answer_cache = AnswerTextCache()
+
+class AnswerStream:
+    """
+    One streamed Gemini generation. Pieces are kept as they arrive, so any
+    number of readers (SSE clients, Redis publishers, callers awaiting the
+    whole answer) can follow it from the start. The full text is cached once
+    the stream completes; failed generations are not.
+    """
+
+    def __init__(self, key: Tuple[str, str]):
+        self.key = key
+        self.pieces: List[str] = []
+        self.failed = False
+        self._changed = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    @property
+    def text(self) -> str:
+        return "".join(self.pieces)
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _run(self) -> None:
+        question, context = self.key
+        try:
+            await update_activity()
+            print(f"💬 Generating answer")
+            genai_model = genai.GenerativeModel(ANSWER_MODEL)
+            response = await genai_model.generate_content_async(_answer_prompt(question, context), stream=True)
+            async for chunk in response:
+                if chunk.text:
+                    self.pieces.append(chunk.text)
+                    self._wake()
+            _answer_cache.put(self.key, self.text)
+        except Exception as e:
+            print(f"❌ Answer generation error: {e}")
+            self.failed = True
+        finally:
+            _answer_streams.pop(self.key, None)
+            self._wake()
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            changed = self._changed
+            finished = self._task.done()
+            while index < len(self.pieces):
+                yield self.pieces[index]
+                index += 1
+            if finished:
+                break
+            await changed.wait()
+        if self.failed:
+            raise RuntimeError(ANSWER_ERROR)
+
+    async def result(self) -> str:
+        # Shield so one cancelled reader does not cancel the generation for the others
+        await asyncio.shield(self._task)
+        return ANSWER_ERROR if self.failed else self.text
+
+_answer_streams: Dict[Tuple[str, str], AnswerStream] = {}
+
+def _answer_prompt(question: str, context: str) -> str:
+    return f"""Context: {context}
 
 Question: {question}
 
 Based only on the provided context, answer the question. If the answer cannot be found in the context, say "No answer found in the provided context."
 
 Answer:"""
-        
-        result = await genai_model.generate_content_async(prompt)
-        return result.text
-    except Exception as e:
-        print(f"❌ Answer generation error: {e}")
-        return "Error generating answer."
+
+def _answer_stream(question: str, context: str) -> AnswerStream:
+    """The generation in flight for this question and context, or a new one"""
+    key = (question, context)
+    stream = _answer_streams.get(key)
+    if stream is None:
+        stream = _answer_streams[key] = AnswerStream(key)
+    return stream
+
+async def get_answer_gemini(question: str, context: str):
+    """Generate answer, sharing in-flight generations for the same question and context"""
+    cached = _answer_cache.get((question, context))
+    if cached is not None:
+        return cached
+    return await answer_flight.do(
+        (question, context),
+        lambda: _answer_stream(question, context).result(),
+        label=question
+    )
+
+async def stream_answer_gemini(question: str, context: str) -> AsyncIterator[str]:
+    """Answer text pieces as Gemini produces them; a cached answer comes back as one piece"""
+    cached = _answer_cache.get((question, context))
+    if cached is not None:
+        yield cached
+        return
+    async for piece in _answer_stream(question, context):
+        yield piece
 
 # Cache management
 def clear_all_caches():
     """Clear all caches"""
-    _generate_embedding_api_call.cache_clear()
-    get_answer_gemini.cache_clear()
+    get_embedding_cache().clear()
+    _answer_cache.clear()
     print("🗑️ Caches cleared")
 
 def get_cache_stats():
     """Get cache statistics"""
-    api_info = _generate_embedding_api_call.cache_info()
-    answer_info = get_answer_gemini.cache_info()
+    embedding_info = get_embedding_cache().stats()
+    answer_info = _answer_cache.info()
     
-    print(f"📊 Cache stats - API: {api_info.hits}/{api_info.hits + api_info.misses}, Answer: {answer_info.hits}/{answer_info.hits + answer_info.misses}")
+    print(f"📊 Cache stats - Embeddings: {embedding_info['hit_rate']:.1%} hit rate, Answer: {answer_info['hits']}/{answer_info['hits'] + answer_info['misses']}")
     
     return {
-        "api_calls": api_info,
+        "embeddings": embedding_info,
         "answer": answer_info,
+        "single_flight": get_single_flight_stats(),
     }
 
 # Legacy compatibility
@@ -1,55 +1,251 @@
 from fastapi import UploadFile, HTTPException
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, List, Optional
+import asyncio
+import codecs
+import os
 import re
+import tempfile
+import threading
+from config import EXTRACTION_WORKERS, EXTRACTION_PAGE_TIMEOUT
+from utils.logger import logger
+
+# Plain-text files are yielded in blocks of roughly this many characters
+TEXT_SEGMENT_SIZE = 64 * 1024
+# How far back (characters) a segment looks for whitespace to cut at; a longer unbroken run is cut mid-word
+TEXT_CUT_WINDOW = 4096
+_LEADING_WORD_RE = re.compile(r'\S*')
+
+# PDF/DOCX parsing is CPU-bound, so it runs in worker processes to keep the event loop free
+_extraction_pool: Optional[ProcessPoolExecutor] = None
+# Parsed PDFs cached in each worker process (or shared by threads without one), most recent last.
+# Keyed by path, size and mtime, so a reused temp file name never hits another file's reader
+PDF_READER_CACHE_SIZE = 4
+_pdf_readers: "OrderedDict[tuple, tuple]" = OrderedDict()
+_pdf_readers_lock = threading.Lock()
+
+# Control characters PostgreSQL/UTF-8 text should not carry (tab, newline and CR are kept as whitespace)
+_CONTROL_CHARS = '\x00-\x08\x0b\x0c\x0e-\x1f'
+_CONTROL_CHARS_TABLE = dict.fromkeys(range(0x20))
+for _kept in '\t\n\r':
+    del _CONTROL_CHARS_TABLE[ord(_kept)]
+_CONTROL_CHARS_RE = re.compile(f'[{_CONTROL_CHARS}]+')
 
 def clean_text_for_db(text: str) -> str:
     """Optimized text cleaning for PostgreSQL UTF-8"""
     if not text:
         return ""
     
-    # Use translate for faster character removal (much faster than multiple replace calls)
-    # Create translation table to remove problematic characters
-    chars_to_remove = '\x00\x08\x0b\x0c\x0e\x0f'
-    translation_table = str.maketrans('', '', chars_to_remove)
-    text = text.translate(translation_table)
-    
-    # Remove control characters in one pass (faster than char-by-char)
-    text = ''.join(char for char in text if ord(char) >= 32 or char in '\t\n\r')
+    # Drop control characters: translate is fastest on ASCII strings, the
+    # precompiled regex avoids per-character table lookups on everything else
+    if text.isascii():
+        text = text.translate(_CONTROL_CHARS_TABLE)
+    else:
+        text = _CONTROL_CHARS_RE.sub('', text)
     
-    # Normalize whitespace once
-    text = re.sub(r'\s+', ' ', text)
-    
-    return text.strip()
+    # split() breaks on runs of whitespace and drops the ends, so joining
+    # normalizes and strips in one C-level pass
+    return ' '.join(text.split())
+
+def get_extraction_pool() -> Optional[ProcessPoolExecutor]:
+    """Lazily create the extraction process pool (None when EXTRACTION_WORKERS is 0)"""
+    global _extraction_pool
+    if _extraction_pool is None and EXTRACTION_WORKERS > 0:
+        _extraction_pool = ProcessPoolExecutor(max_workers=EXTRACTION_WORKERS)
+    return _extraction_pool
+
+def _retire_extraction_pool() -> None:
+    """
+    Send new work to a fresh pool. A worker stuck on a page cannot be killed
+    through the executor API; the old pool finishes what it already has and
+    its processes exit once the stuck call returns.
+    """
+    global _extraction_pool
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=False)
+        _extraction_pool = None
+
+def shutdown_extraction_pool() -> None:
+    """Stop extraction worker processes"""
+    global _extraction_pool
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+        _extraction_pool = None
 
-async def extract_text_from_file(file: UploadFile, content: bytes) -> str:
+# Worker-process functions: module level so they can be pickled
+def _open_pdf(path: str):
+    """(reader, lock) for path; PdfReader is not thread-safe, so hold the lock while using it"""
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    with _pdf_readers_lock:
+        entry = _pdf_readers.get(key)
+        if entry is not None:
+            _pdf_readers.move_to_end(key)
+            return entry
+    from PyPDF2 import PdfReader
+    entry = (PdfReader(path), threading.Lock())
+    with _pdf_readers_lock:
+        # Another thread may have parsed the same file meanwhile; keep the first reader
+        entry = _pdf_readers.setdefault(key, entry)
+        _pdf_readers.move_to_end(key)
+        while len(_pdf_readers) > PDF_READER_CACHE_SIZE:
+            _pdf_readers.popitem(last=False)
+    return entry
+
+def _count_pdf_pages(path: str) -> int:
+    reader, lock = _open_pdf(path)
+    with lock:
+        return len(reader.pages)
+
+def _extract_pdf_page(path: str, page_number: int) -> str:
+    reader, lock = _open_pdf(path)
+    with lock:
+        text = reader.pages[page_number].extract_text() or ""
+    return clean_text_for_db(text)
+
+def _extract_docx_blocks(path: str) -> List[str]:
+    from docx import Document
+    blocks = []
+    block = []
+    block_length = 0
+    for para in Document(path).paragraphs:
+        if not para.text.strip():
+            continue
+        block.append(para.text)
+        block_length += len(para.text)
+        if block_length >= TEXT_SEGMENT_SIZE:
+            blocks.append(clean_text_for_db("\n".join(block)))
+            block, block_length = [], 0
+    if block:
+        blocks.append(clean_text_for_db("\n".join(block)))
+    return blocks
+
+def _run_extraction(func, *args) -> asyncio.Future:
+    # Falls back to the default thread pool when process workers are disabled
+    return asyncio.get_running_loop().run_in_executor(get_extraction_pool(), func, *args)
+
+async def _iter_pdf_pages(path: str) -> AsyncIterator[str]:
+    """Extract PDF pages in the process pool, yielding them in order as they finish"""
+    page_count = await asyncio.wait_for(_run_extraction(_count_pdf_pages, path), timeout=EXTRACTION_PAGE_TIMEOUT)
+    # Keep a few pages in flight per worker; PdfReader is not thread-safe, so one at a time without workers
+    window_size = EXTRACTION_WORKERS * 2 if EXTRACTION_WORKERS > 0 else 1
+    window = deque()
+    next_page = 0
+    try:
+        while next_page < page_count or window:
+            while next_page < page_count and len(window) < window_size:
+                window.append((next_page, _run_extraction(_extract_pdf_page, path, next_page)))
+                next_page += 1
+            page_number, future = window.popleft()
+            try:
+                text = await asyncio.wait_for(future, timeout=EXTRACTION_PAGE_TIMEOUT)
+            except asyncio.TimeoutError:
+                logger.warn(f"PDF page {page_number + 1} timed out after {EXTRACTION_PAGE_TIMEOUT}s, skipping")
+                # The call keeps running in its worker; move on to a fresh pool so it does not hold a slot.
+                # Without worker processes the thread cannot be reclaimed and finishes in the background
+                _retire_extraction_pool()
+                continue
+            if text:
+                yield text
+    finally:
+        for _, future in window:
+            future.cancel()
+
+async def _iter_office_file(content, suffix: str, path: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Workers receive a path, not a copy of the file: an existing one (e.g. a
+    blob store file) is used as is, otherwise the bytes are spilled to a temp
+    file once.
+    """
+    spilled = path is None
+    if spilled:
+        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+            f.write(content)
+            path = f.name
+    try:
+        if suffix == '.pdf':
+            async for page in _iter_pdf_pages(path):
+                yield page
+        else:
+            blocks = await asyncio.wait_for(_run_extraction(_extract_docx_blocks, path), timeout=EXTRACTION_PAGE_TIMEOUT)
+            for block in blocks:
+                yield block
+    finally:
+        if spilled:
+            os.unlink(path)
+
+async def _iter_text_segments(content) -> AsyncIterator[str]:
+    """
+    Decode UTF-8 TEXT_SEGMENT_SIZE bytes at a time straight from the buffer
+    (bytes, memoryview or mmap), so the whole file is never held as one string
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='ignore')
+    view = memoryview(content)
+    carry = ""
+    try:
+        for start in range(0, view.nbytes, TEXT_SEGMENT_SIZE):
+            text = carry + decoder.decode(view[start:start + TEXT_SEGMENT_SIZE])
+            # Hold back the trailing partial word so words are not split across segments.
+            # Only the last TEXT_CUT_WINDOW characters are scanned, which also bounds the carry
+            tail = text[-TEXT_CUT_WINDOW:]
+            word = _LEADING_WORD_RE.match(tail[::-1]).end()
+            end = len(text) if word == len(tail) and len(text) > TEXT_CUT_WINDOW else len(text) - word
+            carry = text[end:]
+            segment = clean_text_for_db(text[:end])
+            if segment:
+                yield segment
+            await asyncio.sleep(0)
+        segment = clean_text_for_db(carry + decoder.decode(b"", final=True))
+        if segment:
+            yield segment
+    finally:
+        view.release()
+
+async def extract_text_from_file(file: UploadFile, content) -> str:
     filename = file.filename.lower()
     print(f"DEBUG: Processing {filename}, size: {len(content)} bytes")
     
     try:
         if filename.endswith('.txt'):
-            text = content.decode('utf-8', errors='ignore')
-            return clean_text_for_db(text)
-        elif filename.endswith('.pdf'):
-            import io
-            from PyPDF2 import PdfReader
-            reader = PdfReader(io.BytesIO(content))
-            # Use list comprehension for faster text extraction
-            pages_text = [page.extract_text() or "" for page in reader.pages]
-            text = " ".join(pages_text)
-            return clean_text_for_db(text)
-        elif filename.endswith('.docx'):
-            import io
-            from docx import Document
-            doc = Document(io.BytesIO(content))
-            # Use list comprehension for faster paragraph extraction
-            paragraphs_text = [para.text for para in doc.paragraphs if para.text.strip()]
-            text = "\n".join(paragraphs_text)
+            text = str(content, 'utf-8', errors='ignore')
             return clean_text_for_db(text)
+        elif filename.endswith(('.pdf', '.docx')):
+            segments = [segment async for segment in iter_text_from_file(file, content)]
+            return " ".join(segments)
         else:
             raise HTTPException(status_code=400, detail="Unsupported file type.")
     except Exception as e:
         print(f"Error extracting text: {e}")
         raise HTTPException(status_code=400, detail="Failed to extract text from file.")
 
+async def iter_text_from_file(file: UploadFile, content, path: Optional[str] = None) -> AsyncIterator[str]:
+    """
+    Yield cleaned text segments as they are extracted: one per PDF page,
+    blocks of paragraphs for DOCX and fixed-size blocks for plain text.
+    PDF and DOCX parsing runs in the extraction process pool, so chunking
+    can start before the last page is parsed. `content` may be any buffer;
+    `path`, when given, is a file holding the same bytes that the pool reads
+    directly.
+    """
+    filename = file.filename.lower()
+    if not filename.endswith(('.txt', '.pdf', '.docx')):
+        raise HTTPException(status_code=400, detail="Unsupported file type.")
+    
+    try:
+        if filename.endswith('.txt'):
+            async for segment in _iter_text_segments(content):
+                yield segment
+        else:
+            suffix = '.pdf' if filename.endswith('.pdf') else '.docx'
+            async for segment in _iter_office_file(content, suffix, path):
+                yield segment
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error extracting text: {e}")
+        raise HTTPException(status_code=400, detail="Failed to extract text from file.")
+
 def fast_sentence_split(text: str) -> list[str]:
     """Ultra-fast sentence splitting using simple regex"""
     if not text:
@@ -60,13 +256,14 @@ def fast_sentence_split(text: str) -> list[str]:
     # Filter empty sentences in one pass
     return [s.strip() for s in sentences if len(s.strip()) > 10]  # Min length filter
 
-def chunk_text(text: str, max_chunk_size: int = 500) -> list[str]:
+def chunk_text(text: str, max_chunk_size: int = 500, pre_cleaned: bool = False) -> list[str]:
     """Optimized chunking - prioritizes speed over perfect sentence boundaries"""
     if not text:
         return []
     
-    # Clean text once
-    text = clean_text_for_db(text)
+    # Clean text once (skipped when the caller already passed it through clean_text_for_db)
+    if not pre_cleaned:
+        text = clean_text_for_db(text)
     
     # For short texts, return as single chunk
     if len(text) <= max_chunk_size:
@@ -97,12 +294,13 @@ def chunk_text(text: str, max_chunk_size: int = 500) -> list[str]:
     
     return chunks
 
-def chunk_text_sliding_window(text: str, chunk_size: int = 500, overlap: int = 50) -> list[str]:
+def chunk_text_sliding_window(text: str, chunk_size: int = 500, overlap: int = 50, pre_cleaned: bool = False) -> list[str]:
     """Alternative: Sliding window chunking for better context preservation"""
     if not text:
         return []
     
-    text = clean_text_for_db(text)
+    if not pre_cleaned:
+        text = clean_text_for_db(text)
     
     if len(text) <= chunk_size:
         return [text] if text.strip() else []
@@ -130,7 +328,7 @@ def chunk_text_sliding_window(text: str, chunk_size: int = 500, overlap: int = 5
     return chunks
 
 # Fast utility function for very large texts
-def quick_chunk_by_lines(text: str, max_lines: int = 10) -> list[str]:
+def quick_chunk_by_lines(text: str, max_lines: int = 10, pre_cleaned: bool = False) -> list[str]:
     """Emergency fast chunking for very large documents"""
     if not text:
         return []
@@ -142,6 +340,6 @@ def quick_chunk_by_lines(text: str, max_lines: int = 10) -> list[str]:
         chunk_lines = lines[i:i + max_lines]
         chunk = '\n'.join(line.strip() for line in chunk_lines if line.strip())
         if chunk:
-            chunks.append(clean_text_for_db(chunk))
+            chunks.append(chunk if pre_cleaned else clean_text_for_db(chunk))
     
     return chunks
\ No newline at end of file
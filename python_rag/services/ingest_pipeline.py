@@ -0,0 +1,201 @@
+import asyncio
+import hashlib
+import time
+from typing import Dict, List, Optional, Tuple
+from config import EMBEDDING_MAX_CONCURRENT_REQUESTS
+from utils.logger import logger
+from services.batch_processor import EmbeddingFailed, process_embeddings_batch
+from services.embedding_backend import GEMINI_MAX_BATCH_ITEMS
+
+# Marks the end of a stage's output
+_DONE = object()
+
+class _StageQueue(asyncio.Queue):
+    """Bounded queue that remembers its peak depth"""
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize=maxsize)
+        self.max_depth = 0
+
+    async def put(self, item):
+        await super().put(item)
+        self.max_depth = max(self.max_depth, self.qsize())
+
+class IngestPipeline:
+    """
+    Streaming ingest: extractor -> chunker -> dedup check -> embedder -> writer.
+
+    Stages are connected by bounded queues, so a slow stage applies
+    back-pressure upstream and only a few batches are held in memory at once.
+    Rows are committed while later pages are still being extracted.
+    """
+
+    def __init__(self, text_processor, document_manager, queue_size: int = 4,
+                 dedup_batch_size: int = 100, embed_batch_size: int = GEMINI_MAX_BATCH_ITEMS, write_batch_size: int = 100,
+                 embed_concurrency: int = EMBEDDING_MAX_CONCURRENT_REQUESTS):
+        self.text_processor = text_processor
+        self.document_manager = document_manager
+        self.queue_size = queue_size
+        self.dedup_batch_size = dedup_batch_size
+        self.embed_batch_size = embed_batch_size
+        self.write_batch_size = write_batch_size
+        self.embed_concurrency = embed_concurrency
+
+    async def run(self, filename: str, file_content, ingest_id: str, path: Optional[str] = None) -> Dict:
+        """
+        Run the pipeline for one file. `file_content` may be any buffer (e.g. a
+        memoryview of a blob); `path` is a file with the same bytes, if there is one.
+        Returns ingest statistics.
+        """
+        start_time = time.time()
+        queues = {
+            "segments": _StageQueue(self.queue_size),
+            "chunks": _StageQueue(self.queue_size),
+            "new_chunks": _StageQueue(self.queue_size),
+            "embeddings": _StageQueue(self.queue_size),
+        }
+        stats = {
+            "total_chunks": 0,
+            "skipped_chunks": 0,
+            "processed_chunks": 0,
+            "time_to_first_row": None,
+            "stage_time": {}
+        }
+
+        stages = [
+            self._timed("extract", stats, self._extract(filename, file_content, path, queues["segments"])),
+            self._timed("chunk", stats, self._chunk(queues["segments"], queues["chunks"], stats)),
+            self._timed("dedup", stats, self._dedup(queues["chunks"], queues["new_chunks"], stats)),
+            self._timed("embed", stats, self._embed(queues["new_chunks"], queues["embeddings"])),
+            self._timed("write", stats, self._write(queues["embeddings"], ingest_id, stats, start_time)),
+        ]
+        tasks = [asyncio.create_task(stage) for stage in stages]
+
+        try:
+            # Fail fast: the first stage error cancels the rest of the pipeline
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                task.result()
+        except (Exception, asyncio.CancelledError):
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Rows may already be committed by the writer, so remove the whole ingest
+            logger.warn(f"Ingest {ingest_id} failed, removing rows written so far")
+            try:
+                await asyncio.shield(self.document_manager.delete_ingest(ingest_id))
+            except Exception as cleanup_error:
+                logger.error(f"Cleanup of ingest {ingest_id} failed: {cleanup_error}")
+            raise
+
+        stats["total_time"] = time.time() - start_time
+        stats["max_queue_depth"] = {name: queue.max_depth for name, queue in queues.items()}
+        return stats
+
+    async def _timed(self, name: str, stats: Dict, stage):
+        stage_start = time.time()
+        try:
+            return await stage
+        finally:
+            stats["stage_time"][name] = time.time() - stage_start
+
+    async def _extract(self, filename: str, file_content, path: Optional[str], out: _StageQueue):
+        async for segment in self.text_processor.iter_file_segments(filename, file_content, path):
+            await out.put(segment)
+        await out.put(_DONE)
+
+    async def _chunk(self, inp: _StageQueue, out: _StageQueue, stats: Dict):
+        # The last chunk of each segment may continue on the next page, so carry it over
+        carry = ""
+        batch: List[str] = []
+        while (segment := await inp.get()) is not _DONE:
+            chunks = self.text_processor.chunk(f"{carry} {segment}" if carry else segment)
+            if not chunks:
+                continue
+            carry = chunks.pop()
+            batch.extend(chunks)
+            if len(batch) >= self.dedup_batch_size:
+                stats["total_chunks"] += len(batch)
+                await out.put(batch)
+                batch = []
+        if carry:
+            batch.append(carry)
+        if batch:
+            stats["total_chunks"] += len(batch)
+            await out.put(batch)
+        await out.put(_DONE)
+
+    async def _dedup(self, inp: _StageQueue, out: _StageQueue, stats: Dict):
+        seen = set()
+        while (chunks := await inp.get()) is not _DONE:
+            hashed = {}
+            for chunk in chunks:
+                content_hash = hashlib.sha256(chunk.encode()).hexdigest()
+                if content_hash in seen or content_hash in hashed:
+                    stats["skipped_chunks"] += 1
+                    continue
+                hashed[content_hash] = chunk
+            seen.update(hashed)
+
+            existing = await self.document_manager.find_existing_chunk_hashes(list(hashed))
+            stats["skipped_chunks"] += len(existing)
+            # Keep the hashes: the embedder reuses them as embedding cache keys
+            new_chunks = [(content_hash, chunk) for content_hash, chunk in hashed.items() if content_hash not in existing]
+            if new_chunks:
+                await out.put(new_chunks)
+        await out.put(_DONE)
+
+    async def _embed(self, inp: _StageQueue, out: _StageQueue):
+        # Several batches are embedded at once; the shared rate limiter decides how
+        # many requests actually run, so this stage goes as fast as the quota allows
+        async def embed(hashed_chunks: List[Tuple[str, str]]):
+            pairs = await process_embeddings_batch(
+                [chunk for _, chunk in hashed_chunks],
+                batch_size=self.embed_batch_size,
+                content_hashes=[content_hash for content_hash, _ in hashed_chunks]
+            )
+            # Every chunk must come back embedded; a gap fails the ingest (and
+            # deletes what was already written) instead of losing rows quietly
+            embedded = {chunk for chunk, embedding in pairs if embedding}
+            missing = [i for i, (_, chunk) in enumerate(hashed_chunks) if chunk not in embedded]
+            if missing:
+                raise EmbeddingFailed(missing, [f"{len(missing)} of {len(hashed_chunks)} chunks came back without an embedding"])
+            await out.put(pairs)
+
+        running = set()
+        try:
+            while (hashed_chunks := await inp.get()) is not _DONE:
+                if len(running) >= self.embed_concurrency:
+                    done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                running.add(asyncio.create_task(embed(hashed_chunks)))
+            if running:
+                await asyncio.gather(*running)
+        finally:
+            for task in running:
+                task.cancel()
+        await out.put(_DONE)
+
+    async def _write(self, inp: _StageQueue, ingest_id: str, stats: Dict, start_time: float):
+        pending = []
+        finished = False
+        while not finished:
+            pairs = await inp.get()
+            # Drain whatever else is ready: if the DB falls behind, batches grow
+            # and insert_documents switches to COPY / parallel shards on its own
+            while True:
+                if pairs is _DONE:
+                    finished = True
+                    break
+                pending.extend(pairs)
+                if inp.empty():
+                    break
+                pairs = inp.get_nowait()
+
+            if pending and (finished or len(pending) >= self.write_batch_size):
+                await self.document_manager.insert_documents(pending, batch_size=self.write_batch_size, ingest_id=ingest_id)
+                stats["processed_chunks"] += len(pending)
+                if stats["time_to_first_row"] is None:
+                    stats["time_to_first_row"] = time.time() - start_time
+                pending = []
@@ -0,0 +1,196 @@
+import asyncio
+import math
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from config import RERANKER, RERANK_MODEL_DIR, RERANK_BATCH_SIZE, RERANK_BUDGET_MS, RERANK_WORKERS
+from utils.logger import logger
+
+try:
+    import onnxruntime
+    from tokenizers import Tokenizer
+except ImportError:  # optional, the heuristic scorer is used instead
+    onnxruntime = None
+    Tokenizer = None
+
+Chunks = List[Tuple[int, str]]
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "how", "i", "in", "is",
+    "it", "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "where", "which", "who", "why",
+    "with", "you", "your"
+}
+
+def _terms(text: str) -> List[str]:
+    return [term for term in re.findall(r"\w+", text.lower()) if term not in STOPWORDS]
+
+class HeuristicScorer:
+    """
+    Cross-encoder stand-in: BM25 of the question terms over the candidate set,
+    plus a bonus for question bigrams that appear verbatim and a small prior
+    from the vector rank, so passages with no lexical signal keep their order.
+    """
+
+    name = "heuristic"
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75, rank_prior: float = 0.3):
+        self.k1 = k1
+        self.b = b
+        self.rank_prior = rank_prior
+
+    def prepare(self, question: str, passages: Sequence[str]) -> Dict:
+        """Collection statistics over every candidate, so scores from different batches compare"""
+        query = _terms(question)
+        docs = [_terms(passage) for passage in passages]
+        return {
+            "terms": set(query),
+            "bigrams": set(zip(query, query[1:])),
+            "docs": docs,
+            "avg_len": sum(len(doc) for doc in docs) / max(1, len(docs)) or 1.0,
+            "doc_freq": Counter(term for doc in docs for term in set(doc) & set(query))
+        }
+
+    def score_batch(self, question: str, passages: Sequence[str], offset: int, context: Dict) -> List[float]:
+        docs, doc_freq, total = context["docs"], context["doc_freq"], len(context["docs"])
+        scores = []
+        for index in range(offset, offset + len(passages)):
+            doc = docs[index]
+            counts = Counter(doc)
+            score = 0.0
+            for term in context["terms"]:
+                tf = counts.get(term, 0)
+                if tf:
+                    idf = math.log(1 + (total - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                    score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * len(doc) / context["avg_len"]))
+            score += 0.5 * len(context["bigrams"] & set(zip(doc, doc[1:])))
+            score += self.rank_prior * (1 - index / total)
+            scores.append(score)
+        return scores
+
+class OnnxCrossEncoder:
+    """
+    Small cross-encoder (e.g. ms-marco-MiniLM-L-6-v2 exported to ONNX) run on
+    CPU with onnxruntime. `model_dir` holds model.onnx and tokenizer.json.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_dir: str, max_length: int = 256):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.enable_padding()
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+    def prepare(self, question: str, passages: Sequence[str]) -> None:
+        return None
+
+    def score_batch(self, question: str, passages: Sequence[str], offset: int, context: None) -> List[float]:
+        encodings = self.tokenizer.encode_batch([(question, passage) for passage in passages])
+        feeds = {
+            "input_ids": np.array([encoding.ids for encoding in encodings], dtype=np.int64),
+            "attention_mask": np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64),
+            "token_type_ids": np.array([encoding.type_ids for encoding in encodings], dtype=np.int64)
+        }
+        logits = self.session.run(None, {name: value for name, value in feeds.items() if name in self.input_names})[0]
+        return np.asarray(logits, dtype=np.float32).reshape(len(passages), -1)[:, 0].tolist()
+
+def make_scorer(kind: str = RERANKER, model_dir: str = RERANK_MODEL_DIR):
+    """Scorer for RERANKER: "onnx", "heuristic", "auto" (onnx when available) or "none" (None)"""
+    if kind == "none":
+        return None
+    if kind in ("onnx", "auto"):
+        if onnxruntime is not None and model_dir and os.path.exists(os.path.join(model_dir, "model.onnx")):
+            return OnnxCrossEncoder(model_dir)
+        if kind == "onnx":
+            logger.warn("ONNX reranker unavailable (needs onnxruntime, tokenizers and RERANK_MODEL_DIR), using heuristic")
+        return HeuristicScorer()
+    if kind == "heuristic":
+        return HeuristicScorer()
+    raise ValueError(f"Unknown reranker: {kind}")
+
+class Reranker:
+    """
+    Reorders over-fetched candidates with a local scorer. Batches are scored in
+    a thread pool so the event loop stays free; if they are not all back within
+    the time budget the candidates keep their retrieval order.
+    """
+
+    def __init__(self, scorer, batch_size: int = RERANK_BATCH_SIZE, budget_ms: float = RERANK_BUDGET_MS,
+                 workers: int = RERANK_WORKERS):
+        self.scorer = scorer
+        self.batch_size = batch_size
+        self.budget = budget_ms / 1000
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rerank")
+        self.calls = 0
+        self.timeouts = 0
+        self.total_time = 0.0
+
+    def _score_all(self, question: str, passages: List[str]):
+        """Collection statistics first, then the batches in parallel on the same pool"""
+        context = self.scorer.prepare(question, passages)
+        return context, [
+            self._executor.submit(self.scorer.score_batch, question, passages[start:start + self.batch_size], start, context)
+            for start in range(0, len(passages), self.batch_size)
+        ]
+
+    async def rerank(self, question: str, candidates: Chunks, limit: int) -> Tuple[Chunks, bool]:
+        """Best `limit` candidates and whether they were actually reranked"""
+        if len(candidates) <= 1:
+            return candidates[:limit], False
+        start_time = time.time()
+        self.calls += 1
+        passages = [content for _, content in candidates]
+        scores, reason = None, None
+        try:
+            async with asyncio.timeout(self.budget):
+                _, batches = await asyncio.get_running_loop().run_in_executor(self._executor, self._score_all, question, passages)
+                scores = [score for batch in await asyncio.gather(*[asyncio.wrap_future(batch) for batch in batches])
+                          for score in batch]
+        except TimeoutError:
+            reason = f"missed its {self.budget * 1000:.0f}ms budget"
+        except Exception as e:
+            reason = f"failed: {e}"
+        self.total_time += time.time() - start_time
+        if scores is None:
+            self.timeouts += 1
+            logger.warn(f"Reranking {len(candidates)} candidates {reason}, keeping retrieval order")
+            return candidates[:limit], False
+        # Stable sort: equal scores keep retrieval order
+        order = sorted(range(len(candidates)), key=lambda index: -scores[index])
+        return [candidates[index] for index in order[:limit]], True
+
+    def stats(self) -> Dict:
+        return {
+            "scorer": self.scorer.name,
+            "batch_size": self.batch_size,
+            "budget_ms": self.budget * 1000,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "avg_time_ms": round(self.total_time / self.calls * 1000, 2) if self.calls else 0.0
+        }
+
+_reranker: Optional[Reranker] = None
+
+def get_reranker() -> Optional[Reranker]:
+    """Reranker configured by RERANKER, or None when reranking is off"""
+    global _reranker
+    if _reranker is None:
+        scorer = make_scorer()
+        if scorer is None:
+            return None
+        _reranker = Reranker(scorer)
+    return _reranker
+
+def set_reranker(reranker: Optional[Reranker]) -> None:
+    """Swap the reranker, e.g. for tests"""
+    global _reranker
+    _reranker = reranker
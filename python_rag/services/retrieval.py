@@ -0,0 +1,120 @@
+import asyncio
+import re
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+from config import RETRIEVAL_MODE, HYBRID_CANDIDATES, RRF_K, LEXICAL_FAST_PATH, RERANK_CANDIDATES, RERANK_TOP_K
+from db.document_manager import DocumentManager
+from utils.logger import logger
+from .embedding_gemini import generate_query_embedding_gemini
+from .reranker import get_reranker
+
+Chunks = List[Tuple[int, str]]
+
+QUESTION_WORDS = {"what", "why", "how", "who", "when", "where", "which", "explain", "describe", "compare", "summarize"}
+# Identifier-like tokens: contain a digit, are ALL CAPS, or join word parts with _ . / : -
+KEYWORD_TOKEN = re.compile(r"^(?:\w*\d[\w\-./:]*|[A-Z]{2,}[\w\-]*|\w+[_./:\-][\w./:\-]+)$")
+
+def is_keyword_query(question: str) -> bool:
+    """
+    True for short lookups a full-text search answers on its own: a quoted
+    phrase, or a few tokens that are mostly codes and identifiers
+    (e.g. `ERR_CONN_RESET`, `SKU-4411`, `pg_stat_activity`).
+    """
+    text = question.strip().rstrip("?")
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        return True
+    tokens = text.split()
+    if not tokens or len(tokens) > 6 or tokens[0].lower() in QUESTION_WORDS:
+        return False
+    keywords = sum(1 for token in tokens if KEYWORD_TOKEN.match(token.strip(",;()'\"")))
+    return keywords * 2 >= len(tokens)
+
+def rrf_fuse(rankings: Sequence[Chunks], limit: int, k: int = RRF_K) -> Chunks:
+    """Reciprocal rank fusion: score(d) = sum over rankings of 1 / (k + rank)"""
+    scores: Dict[int, float] = {}
+    contents: Dict[int, str] = {}
+    for ranking in rankings:
+        for rank, (chunk_id, content) in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+            contents.setdefault(chunk_id, content)
+    # Ties keep first-seen order, i.e. the earlier ranking wins
+    best = sorted(scores, key=lambda chunk_id: -scores[chunk_id])[:limit]
+    return [(chunk_id, contents[chunk_id]) for chunk_id in best]
+
+class RetrievalResult:
+    """Chunks for a question, the query embedding if one was computed, and per-leg timings"""
+
+    def __init__(self, chunks: Chunks, query_embedding=None, mode: str = "vector", timings: Optional[Dict[str, float]] = None):
+        self.chunks = chunks
+        self.query_embedding = query_embedding
+        self.mode = mode
+        self.timings = timings or {}
+
+async def _timed(timings: Dict[str, float], leg: str, awaitable):
+    start_time = time.time()
+    try:
+        return await awaitable
+    finally:
+        timings[leg] = time.time() - start_time
+
+async def retrieve(db_pool, question: str, limit: int = 5, mode: str = RETRIEVAL_MODE) -> RetrievalResult:
+    """
+    Retrieve chunks for a question.
+
+    "vector": embed the question and run a nearest-neighbour search.
+    "hybrid": run the full-text leg and the embedding + vector leg at the same
+    time on separate pooled connections and fuse them with RRF. Keyword-like
+    questions try full-text alone first and skip the embedding call on a hit.
+
+    With a reranker configured, RERANK_CANDIDATES chunks are fetched and the
+    best min(limit, RERANK_TOP_K) of them are kept.
+    """
+    manager = DocumentManager(db_pool)
+    timings: Dict[str, float] = {}
+    start_time = time.time()
+    reranker = get_reranker()
+    fetch = max(limit, RERANK_CANDIDATES) if reranker is not None else limit
+
+    async def vector_leg(depth: int):
+        embedding = await _timed(timings, "embedding", generate_query_embedding_gemini(question))
+        chunks = await _timed(timings, "vector", manager.search_similar_chunks(embedding, limit=depth))
+        return embedding, chunks
+
+    if mode == "vector":
+        embedding, chunks = await vector_leg(fetch)
+        result = RetrievalResult(chunks, embedding, "vector", timings)
+    elif mode == "hybrid":
+        if LEXICAL_FAST_PATH and is_keyword_query(question):
+            chunks = await _timed(timings, "lexical", manager.search_lexical_chunks(question, limit))
+            if chunks:
+                timings["total"] = time.time() - start_time
+                _log_timings("lexical", timings, len(chunks))
+                return RetrievalResult(chunks, None, "lexical", timings)
+        depth = max(fetch, HYBRID_CANDIDATES)
+        lexical, (embedding, vector) = await asyncio.gather(
+            _timed(timings, "lexical", manager.search_lexical_chunks(question, depth)),
+            vector_leg(depth)
+        )
+        fusion_start = time.time()
+        chunks = rrf_fuse([vector, lexical], fetch)
+        timings["fusion"] = time.time() - fusion_start
+        result = RetrievalResult(chunks, embedding, "hybrid", timings)
+    else:
+        raise ValueError(f"Unknown retrieval mode: {mode}")
+
+    if reranker is not None:
+        chunks, reranked = await _timed(timings, "rerank", reranker.rerank(question, result.chunks, min(limit, RERANK_TOP_K)))
+        result.chunks = chunks
+        if reranked:
+            result.mode += "+rerank"
+
+    timings["total"] = time.time() - start_time
+    _log_timings(result.mode, timings, len(result.chunks))
+    return result
+
+def _log_timings(mode: str, timings: Dict[str, float], found: int) -> None:
+    logger.performance({
+        "retrieval_mode": mode,
+        "chunks": found,
+        **{f"{leg}_time": f"{seconds * 1000:.1f}ms" for leg, seconds in timings.items()}
+    })
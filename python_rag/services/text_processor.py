@@ -1,12 +1,28 @@
-from typing import List, Tuple
-from .file_utils_light import extract_text_from_file, chunk_text
+from typing import AsyncIterator, List, Optional, Tuple
+from .file_utils_light import extract_text_from_file, iter_text_from_file, chunk_text
+from .token_chunker import TokenChunker
+from config import EMBEDDING_MAX_TOKENS, MAX_INGEST_BYTES
+
+class _UploadFileName:
+    """Minimal stand-in for UploadFile when only raw bytes are available"""
+    def __init__(self, filename):
+        self.filename = filename
 
 class TextProcessor:
     """Handle text extraction and chunking operations"""
     
-    def __init__(self, max_chunk_size: int = 500, overlap: int = 50):
+    def __init__(self, max_chunk_size: int = 500, overlap: int = 50, max_tokens: Optional[int] = None):
+        """
+        Args:
+            max_chunk_size: Character budget per chunk (word-based chunking)
+            overlap: Overlap between chunks
+            max_tokens: When set, chunk by token budget instead of characters
+        """
         self.max_chunk_size = max_chunk_size
         self.overlap = overlap
+        self.token_chunker = TokenChunker(max_tokens) if max_tokens else None
+        # Character chunks can still exceed the model window (e.g. long unspaced CJK runs)
+        self.window_chunker = TokenChunker(EMBEDDING_MAX_TOKENS)
     
     async def process_file_content(self, filename: str, file_content: bytes) -> Tuple[str, List[str]]:
         """
@@ -32,15 +48,30 @@ class TextProcessor:
             raise ValueError("No text extracted from file")
         
         # Chunk text
-        chunks = chunk_text(text, max_chunk_size=self.max_chunk_size)
+        chunks = self.chunk(text)
         
         return text, chunks
     
-    def validate_file_size(self, file_content: bytes, max_size_mb: int = 5) -> None:
-        """Validate file size is within limits"""
-        max_size_bytes = max_size_mb * 1024 * 1024
-        if len(file_content) > max_size_bytes:
-            raise ValueError(f"File too large (max {max_size_mb}MB)")
+    def iter_file_segments(self, filename: str, file_content, path: Optional[str] = None) -> AsyncIterator[str]:
+        """Stream cleaned text segments (pages/blocks) from file content (any buffer), read from path when given"""
+        return iter_text_from_file(_UploadFileName(filename), file_content, path)
+    
+    def chunk(self, text: str) -> List[str]:
+        """Chunk extracted (already cleaned) text with this processor's settings"""
+        if self.token_chunker:
+            return self.token_chunker.chunks(text)
+        chunks = chunk_text(text, max_chunk_size=self.max_chunk_size, pre_cleaned=True)
+        # A chunk has at most one token per character, so only longer ones need counting
+        limit = self.window_chunker.max_tokens
+        if all(len(chunk) <= limit for chunk in chunks):
+            return chunks
+        return [piece for chunk in chunks
+                for piece in (self.window_chunker.chunks(chunk) if len(chunk) > limit else [chunk])]
+    
+    def validate_file_size(self, size: int, max_bytes: int = MAX_INGEST_BYTES) -> None:
+        """Validate file size (in bytes) is within limits"""
+        if size > max_bytes:
+            raise ValueError(f"File too large (max {max_bytes / (1024 * 1024):.0f}MB)")
     
     def get_processing_stats(self, text: str, chunks: List[str]) -> dict:
         """Get statistics about the processed text"""
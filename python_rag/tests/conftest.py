@@ -0,0 +1,52 @@
+import pytest
+
+from db.corpus_state import CorpusVersion, set_corpus_version
+from db.index_manager import IndexManager, set_index_manager
+from db.retrieval_cache import RetrievalCache, set_retrieval_cache
+from services.embedding_cache import EmbeddingCache, set_embedding_cache
+
+@pytest.fixture(autouse=True)
+def embedding_cache(tmp_path):
+    """Keep tests off the persistent embedding cache"""
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    set_embedding_cache(cache)
+    yield cache
+    set_embedding_cache(None)
+
+class FakeCorpusVersion(CorpusVersion):
+    """The Postgres counter row, kept in memory; bump() stands in for the documents trigger"""
+
+    def __init__(self, max_age: float = 0.0):
+        super().__init__(max_age=max_age)
+        self.version = 0
+        self.reads = 0
+
+    async def _read(self, db_pool) -> int:
+        self.reads += 1
+        return self.version
+
+    def bump(self) -> int:
+        self.version += 1
+        return self.version
+
+@pytest.fixture(autouse=True)
+def corpus_version():
+    version = FakeCorpusVersion()
+    set_corpus_version(version)
+    yield version
+    set_corpus_version(None)
+
+@pytest.fixture(autouse=True)
+def retrieval_cache(tmp_path, corpus_version):
+    cache = RetrievalCache(str(tmp_path / "retrieval.sqlite3"))
+    set_retrieval_cache(cache)
+    yield cache
+    set_retrieval_cache(None)
+
+@pytest.fixture(autouse=True)
+def index_manager():
+    """Fresh pgvector index state, so no test inherits probes or a pending rebuild"""
+    manager = IndexManager(index_type="ivfflat", distance="cosine", recall_target=0.95)
+    set_index_manager(manager)
+    yield manager
+    set_index_manager(None)
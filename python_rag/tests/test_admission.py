@@ -0,0 +1,142 @@
+import asyncio
+import pytest
+
+from services.admission import INGEST, QUERY, AdmissionController, Overloaded
+
+def controller(**kwargs):
+    options = dict(capacity=3, query_reserve=2, query_slo=1.0, ingest_slo=1.0, tenant_limit=10)
+    options.update(kwargs)
+    return AdmissionController(**options)
+
+@pytest.mark.asyncio
+async def test_ingest_only_gets_capacity_left_over_from_the_query_reserve():
+    admission = controller()
+    ingest = await admission.acquire(INGEST)
+    # A second ingest must wait even though two slots are free: they are reserved for queries
+    waiting = asyncio.create_task(admission.acquire(INGEST))
+    await asyncio.sleep(0)
+    assert not waiting.done()
+
+    queries = [await admission.acquire(QUERY) for _ in range(2)]
+    assert admission.stats()[QUERY]["running"] == 2
+
+    ingest.release()
+    second = await asyncio.wait_for(waiting, timeout=1)
+    for ticket in queries + [second]:
+        ticket.release()
+    assert admission.stats()[INGEST]["admitted"] == 2
+
+@pytest.mark.asyncio
+async def test_freed_slot_goes_to_a_waiting_query_before_an_ingest():
+    admission = controller(capacity=2, query_reserve=0)
+    held = [await admission.acquire(INGEST), await admission.acquire(QUERY)]
+    order = []
+
+    async def wait_for_slot(request_class):
+        ticket = await admission.acquire(request_class)
+        order.append(request_class)
+        return ticket
+
+    ingest_waiter = asyncio.create_task(wait_for_slot(INGEST))
+    await asyncio.sleep(0)
+    query_waiter = asyncio.create_task(wait_for_slot(QUERY))
+    await asyncio.sleep(0)
+
+    held[0].release()
+    (await query_waiter).release()
+    held[1].release()
+    (await ingest_waiter).release()
+    assert order == [QUERY, INGEST]
+
+@pytest.mark.asyncio
+async def test_rejects_with_503_when_the_predicted_wait_exceeds_the_slo():
+    admission = controller(capacity=1, query_reserve=0, query_slo=0.25)
+    ticket = await admission.acquire(QUERY)
+    await asyncio.sleep(0.1)
+    ticket.release()
+    # A query holds the only slot for ~0.1s: two waiters predict 0.1s and 0.2s, a third 0.3s
+    held = await admission.acquire(QUERY)
+    waiters = [asyncio.create_task(admission.acquire(QUERY)) for _ in range(2)]
+    await asyncio.sleep(0)
+
+    with pytest.raises(Overloaded) as rejected:
+        await admission.acquire(QUERY)
+    assert rejected.value.status_code == 503
+    assert rejected.value.retry_after >= 1
+
+    held.release()
+    for waiter in waiters:
+        (await waiter).release()
+    assert admission.stats()[QUERY]["rejected_503"] == 1
+
+@pytest.mark.asyncio
+async def test_waiting_past_the_slo_is_rejected_instead_of_hanging():
+    admission = controller(capacity=1, query_reserve=0, query_slo=0.05)
+    held = await admission.acquire(QUERY)
+
+    with pytest.raises(Overloaded) as rejected:
+        await admission.acquire(QUERY)
+    assert rejected.value.status_code == 503
+    assert admission.stats()[QUERY]["waiting"] == 0
+
+    held.release()
+    (await admission.acquire(QUERY)).release()
+
+@pytest.mark.asyncio
+async def test_tenant_over_its_limit_gets_429_and_others_are_unaffected():
+    admission = controller(capacity=10, query_reserve=0, tenant_limit=2)
+    tickets = [await admission.acquire(QUERY, tenant="a") for _ in range(2)]
+
+    with pytest.raises(Overloaded) as rejected:
+        await admission.acquire(QUERY, tenant="a")
+    assert rejected.value.status_code == 429
+    other = await admission.acquire(QUERY, tenant="b")
+
+    for ticket in tickets + [other]:
+        ticket.release()
+    (await admission.acquire(QUERY, tenant="a")).release()
+    assert admission.stats()["tenants"] == 0
+
+@pytest.mark.asyncio
+async def test_without_max_wait_requests_queue_until_served():
+    admission = controller(capacity=1, query_reserve=0, ingest_slo=0.01)
+    held = await admission.acquire(INGEST)
+    waiting = asyncio.create_task(admission.acquire(INGEST, max_wait=None))
+    await asyncio.sleep(0.05)
+    assert not waiting.done()
+
+    held.release()
+    (await asyncio.wait_for(waiting, timeout=1)).release()
+
+def make_request(headers=None, client=("10.0.0.1", 5000)):
+    from starlette.requests import Request
+    return Request({"type": "http", "method": "POST", "path": "/", "client": client,
+                    "headers": [(name.lower().encode(), value.encode()) for name, value in (headers or {}).items()]})
+
+def test_tenant_header_is_only_trusted_when_configured(monkeypatch):
+    import api.endpoints_gemini as endpoints
+    spoofed = make_request({"X-Tenant-ID": "someone-else"})
+    assert endpoints._tenant(spoofed) == "10.0.0.1"
+    monkeypatch.setattr(endpoints, "ADMISSION_TENANT_HEADER", "X-Tenant-ID")
+    assert endpoints._tenant(spoofed) == "someone-else"
+    assert endpoints._tenant(make_request(client=None)) == "anonymous"
+
+@pytest.mark.asyncio
+async def test_stream_releases_its_slot_when_the_body_is_never_iterated(monkeypatch):
+    import api.endpoints_gemini as endpoints
+    from models.schemas import QueryRequest
+    from services.retrieval import RetrievalResult
+    admission = controller()
+    monkeypatch.setattr(endpoints, "get_admission_controller", lambda: admission)
+
+    async def retrieve(db_pool, question, limit):
+        return RetrievalResult([])
+    monkeypatch.setattr(endpoints, "retrieve", retrieve)
+
+    request = make_request()
+    request.scope["app"] = type("App", (), {"state": type("State", (), {"db_pool": None})()})()
+    response = await endpoints.query_stream(request, QueryRequest(question="q"))
+    assert admission.stats()[QUERY]["running"] == 1
+    # The response's background task frees the slot even if the generator never started
+    await response.background()
+    assert admission.stats()[QUERY]["running"] == 0
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import services.answer_cache as answer_cache_module
+from db.corpus_state import notify_corpus_change
+from services.answer_cache import SemanticAnswerCache, answer_from_chunks
+
+def unit(seed, dim=8):
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+def paraphrase(vector, noise=0.01, seed=99):
+    return vector + noise * np.random.default_rng(seed).standard_normal(vector.shape).astype(np.float32)
+
+def test_similar_query_over_same_chunks_hits():
+    cache = SemanticAnswerCache(capacity=4, threshold=0.95, dim=8)
+    query = unit(1)
+    cache.put(query, [3, 1, 2], "answer")
+    assert cache.get(paraphrase(query), [1, 2, 3]) == "answer"
+    assert cache.stats()["hits"] == 1
+
+def test_different_chunks_or_dissimilar_query_miss():
+    cache = SemanticAnswerCache(capacity=4, threshold=0.95, dim=8)
+    cache.put(unit(1), [1, 2, 3], "answer")
+    assert cache.get(unit(1), [1, 2, 4]) is None
+    assert cache.get(unit(2), [1, 2, 3]) is None
+
+def test_expired_entries_miss(monkeypatch):
+    cache = SemanticAnswerCache(capacity=4, ttl=10, dim=8)
+    cache.put(unit(1), [1], "answer")
+    now = answer_cache_module.time.time()
+    monkeypatch.setattr(answer_cache_module.time, "time", lambda: now + 11)
+    assert cache.get(unit(1), [1]) is None
+
+def test_least_recently_used_entry_is_replaced_when_full():
+    cache = SemanticAnswerCache(capacity=2, dim=8)
+    cache.put(unit(1), [1], "first")
+    cache.put(unit(2), [2], "second")
+    assert cache.get(unit(1), [1]) == "first"
+    cache.put(unit(3), [3], "third")
+    assert cache.get(unit(2), [2]) is None
+    assert cache.get(unit(1), [1]) == "first"
+    assert cache.stats()["entries"] == 2
+
+@pytest.mark.asyncio
+async def test_corpus_change_invalidates_shared_cache():
+    cache = answer_cache_module.semantic_answer_cache
+    query = np.ones(cache.dim, dtype=np.float32)
+    cache.put(query, [1], "answer")
+    await notify_corpus_change("insert")
+    assert cache.get(query, [1]) is None
+
+@pytest.mark.asyncio
+async def test_answer_from_chunks_skips_generation_on_hit(monkeypatch):
+    cache = SemanticAnswerCache(capacity=4, dim=8)
+    monkeypatch.setattr(answer_cache_module, "semantic_answer_cache", cache)
+    generated = []
+
+    async def fake_answer(question, context):
+        generated.append(question)
+        return f"answer to {question}"
+
+    monkeypatch.setattr(answer_cache_module, "get_answer_gemini", fake_answer)
+    chunks = [(1, "alpha"), (2, "beta")]
+    first = await answer_from_chunks("what is alpha?", unit(1), chunks)
+    second = await answer_from_chunks("tell me about alpha", paraphrase(unit(1)), chunks)
+    assert first == second == "answer to what is alpha?"
+    assert generated == ["what is alpha?"]
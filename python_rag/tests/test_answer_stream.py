@@ -0,0 +1,126 @@
+import asyncio
+import numpy as np
+import pytest
+
+import services.answer_cache as answer_cache_module
+import services.embedding_gemini as gemini
+from api.redis_worker_upstash import QueryProcessor
+from services.answer_cache import SemanticAnswerCache, stream_answer_from_chunks
+from services.retrieval import RetrievalResult
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Stands in for genai.GenerativeModel, streaming a fixed answer word by word"""
+
+    calls = 0
+
+    def __init__(self, name, pieces=("Paris ", "is ", "the ", "capital."), fail_after=None):
+        self.pieces = pieces
+        self.fail_after = fail_after
+
+    async def generate_content_async(self, prompt, stream=False):
+        assert stream
+        FakeModel.calls += 1
+        pieces, fail_after = self.pieces, self.fail_after
+
+        async def response():
+            for index, piece in enumerate(pieces):
+                if index == fail_after:
+                    raise RuntimeError("quota exceeded")
+                await asyncio.sleep(0.01)
+                yield FakeChunk(piece)
+        return response()
+
+@pytest.fixture
+def fake_gemini(monkeypatch):
+    FakeModel.calls = 0
+    monkeypatch.setattr(gemini.genai, "GenerativeModel", FakeModel)
+    monkeypatch.setattr(gemini, "_answer_cache", gemini.AnswerTextCache())
+    return FakeModel
+
+async def collect(iterator):
+    return [piece async for piece in iterator]
+
+@pytest.mark.asyncio
+async def test_readers_share_one_generation_and_the_final_text_is_cached(fake_gemini):
+    first, second, whole = await asyncio.gather(
+        collect(gemini.stream_answer_gemini("capital?", "ctx")),
+        collect(gemini.stream_answer_gemini("capital?", "ctx")),
+        gemini.get_answer_gemini("capital?", "ctx")
+    )
+
+    assert first == second == ["Paris ", "is ", "the ", "capital."]
+    assert whole == "Paris is the capital."
+    assert fake_gemini.calls == 1
+    # Completed: later callers are served from the cache in one piece
+    assert await collect(gemini.stream_answer_gemini("capital?", "ctx")) == ["Paris is the capital."]
+    assert await gemini.get_answer_gemini("capital?", "ctx") == "Paris is the capital."
+    assert fake_gemini.calls == 1
+
+@pytest.mark.asyncio
+async def test_late_reader_replays_pieces_already_generated(fake_gemini):
+    stream = gemini._answer_stream("capital?", "ctx")
+    await asyncio.sleep(0.025)
+
+    assert 0 < len(stream.pieces) < 4
+    assert "".join(await collect(stream)) == "Paris is the capital."
+
+@pytest.mark.asyncio
+async def test_failed_stream_raises_after_partial_text_and_is_not_cached(fake_gemini, monkeypatch):
+    monkeypatch.setattr(gemini.genai, "GenerativeModel", lambda name: FakeModel(name, fail_after=2))
+    pieces = []
+    with pytest.raises(RuntimeError):
+        async for piece in gemini.stream_answer_gemini("capital?", "ctx"):
+            pieces.append(piece)
+
+    assert pieces == ["Paris ", "is "]
+    assert await gemini.get_answer_gemini("capital?", "ctx") == gemini.ANSWER_ERROR
+    assert gemini._answer_cache.info()["currsize"] == 0
+
+@pytest.mark.asyncio
+async def test_streamed_answer_fills_the_semantic_cache(monkeypatch):
+    cache = SemanticAnswerCache(capacity=4, dim=8)
+    monkeypatch.setattr(answer_cache_module, "semantic_answer_cache", cache)
+
+    async def fake_stream(question, context):
+        for piece in ("an ", "answer"):
+            yield piece
+
+    monkeypatch.setattr(answer_cache_module, "stream_answer_gemini", fake_stream)
+    query = np.ones(8, dtype=np.float32)
+    chunks = [(1, "alpha"), (2, "beta")]
+
+    assert await collect(stream_answer_from_chunks("q", query, chunks)) == ["an ", "answer"]
+    assert await collect(stream_answer_from_chunks("q", query, chunks)) == ["an answer"]
+
+@pytest.mark.asyncio
+async def test_worker_publishes_pieces_then_done(monkeypatch):
+    import api.redis_worker_upstash as worker
+
+    async def fake_retrieve(db_pool, question, limit):
+        return RetrievalResult([(1, "alpha")], None, "lexical")
+
+    async def fake_stream(question, query_embedding, chunks):
+        for piece in ("one ", "two"):
+            yield piece
+
+    monkeypatch.setattr(worker, "retrieve", fake_retrieve)
+    monkeypatch.setattr(worker, "stream_answer_from_chunks", fake_stream)
+    published = []
+
+    async def publish(message):
+        published.append(message)
+
+    result = await QueryProcessor(db_pool=None).process_query_request(
+        {"question": "q", "request_id": "r1", "stream": True}, publish=publish
+    )
+
+    assert result["answer"] == "one two"
+    assert published == [
+        {"request_id": "r1", "seq": 0, "text": "one "},
+        {"request_id": "r1", "seq": 1, "text": "two"},
+        {"request_id": "r1", "seq": 2, "done": True}
+    ]
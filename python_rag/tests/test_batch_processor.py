@@ -0,0 +1,84 @@
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import services.rate_limiter as rate_limiter_module
+
+from services.batch_processor import EmbeddingFailed, process_embeddings_batch
+from services.embedding_backend import FakeEmbeddingBackend, set_embedding_backend, split_into_batches
+
+@pytest.fixture
+def fake_backend():
+    backend = FakeEmbeddingBackend(dim=8, request_latency=0, per_item_latency=0, max_batch_items=4)
+    set_embedding_backend(backend)
+    yield backend
+    set_embedding_backend(None)
+
+def test_split_into_batches_respects_item_and_char_limits():
+    texts = ["a" * 10] * 5 + ["b" * 50] + ["c"]
+    batches = split_into_batches(texts, max_items=3, max_chars=30)
+    assert batches == [[0, 1, 2], [3, 4], [5], [6]]
+
+@pytest.mark.asyncio
+async def test_embeddings_map_back_to_their_chunks(fake_backend):
+    chunks = [f"chunk {i}" for i in range(10)] + ["   "]
+    pairs = await process_embeddings_batch(chunks, batch_size=50)
+    assert [chunk for chunk, _ in pairs] == chunks[:10]
+    assert all(embedding == fake_backend.vector_for(chunk) for chunk, embedding in pairs)
+    assert fake_backend.calls == 3
+
+@pytest.mark.asyncio
+async def test_failed_request_raises_with_its_chunk_positions(fake_backend, embedding_cache):
+    original = fake_backend.embed_batch
+
+    async def flaky(texts, task_type):
+        if "chunk 5" in texts:
+            raise ValueError("400 invalid argument")
+        return await original(texts, task_type)
+
+    fake_backend.embed_batch = flaky
+    chunks = ["  "] + [f"chunk {i}" for i in range(8)]
+    with pytest.raises(EmbeddingFailed, match="400 invalid argument") as failure:
+        await process_embeddings_batch(chunks, batch_size=4)
+    assert failure.value.positions == [5, 6, 7, 8]
+    # The batch that succeeded is cached, so a retry only sends the failed one
+    assert embedding_cache.stats()["entries"] == 4
+
+@pytest.mark.asyncio
+async def test_short_response_is_a_failure_not_a_partial_result(fake_backend):
+    original = fake_backend.embed_batch
+
+    async def truncated(texts, task_type):
+        return (await original(texts, task_type))[:-1]
+
+    fake_backend.embed_batch = truncated
+    with pytest.raises(EmbeddingFailed, match="3 embeddings for 4 chunks"):
+        await process_embeddings_batch([f"chunk {i}" for i in range(4)], batch_size=4)
+
+@pytest.mark.asyncio
+async def test_throttled_request_is_retried(fake_backend, monkeypatch):
+    monkeypatch.setattr(rate_limiter_module.random, "uniform", lambda low, high: 0)
+    original = fake_backend.embed_batch
+    failures = []
+
+    async def throttled_once(texts, task_type):
+        if "chunk 5" in texts and not failures:
+            failures.append(texts)
+            raise google_exceptions.ResourceExhausted("Resource has been exhausted (e.g. check quota).")
+        return await original(texts, task_type)
+
+    fake_backend.embed_batch = throttled_once
+    pairs = await process_embeddings_batch([f"chunk {i}" for i in range(8)], batch_size=4)
+    assert [chunk for chunk, _ in pairs] == [f"chunk {i}" for i in range(8)]
+    assert failures == [[f"chunk {i}" for i in range(4, 8)]]
+
+@pytest.mark.asyncio
+async def test_cached_chunks_skip_the_api(fake_backend, embedding_cache):
+    chunks = [f"chunk {i}" for i in range(6)]
+    await process_embeddings_batch(chunks[:4], batch_size=50)
+    calls = fake_backend.calls
+
+    pairs = await process_embeddings_batch(chunks, batch_size=50)
+    assert [chunk for chunk, _ in pairs] == chunks
+    assert fake_backend.calls == calls + 1
+    assert fake_backend.items == 6
+    assert embedding_cache.stats()["hits"] == 4
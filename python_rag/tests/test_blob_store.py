@@ -0,0 +1,161 @@
+import base64
+import os
+import pytest
+
+from services.blob_store import DiskBlobStore, RedisBlobStore, checksum, set_blob_store
+from services.file_utils_light import iter_text_from_file
+
+class DummyUploadFile:
+    def __init__(self, filename):
+        self.filename = filename
+
+@pytest.mark.asyncio
+async def test_disk_blob_is_mapped_without_copying(tmp_path):
+    store = DiskBlobStore(str(tmp_path))
+    data = b"hello blob " * 1000
+    ref = await store.put(data, "r1")
+    assert ref == {"payload_ref": f"{checksum(data)}-r1", "checksum": checksum(data), "size": len(data)}
+    assert os.listdir(tmp_path) == [ref["payload_ref"]]
+
+    async with store.open(ref["payload_ref"], ref["checksum"]) as payload:
+        assert payload.view.readonly
+        assert payload.view == data
+        assert payload.path == os.path.join(str(tmp_path), ref["payload_ref"])
+
+    await store.delete(ref["payload_ref"])
+    assert await store.size(ref["payload_ref"]) is None
+
+@pytest.mark.asyncio
+async def test_each_upload_of_the_same_file_gets_its_own_blob(tmp_path):
+    store = DiskBlobStore(str(tmp_path))
+    first, second = await store.put(b"same file"), await store.put(b"same file")
+    assert first["checksum"] == second["checksum"]
+    assert first["payload_ref"] != second["payload_ref"]
+    # Finishing one ingest leaves the other's payload alone
+    await store.delete(first["payload_ref"])
+    async with store.open(second["payload_ref"], second["checksum"]) as payload:
+        assert payload.view == b"same file"
+
+@pytest.mark.asyncio
+async def test_checksum_mismatch_and_bad_refs_are_rejected(tmp_path):
+    store = DiskBlobStore(str(tmp_path))
+    ref = await store.put(b"payload")
+
+    with pytest.raises(ValueError, match="checksum mismatch"):
+        async with store.open(ref["payload_ref"], checksum(b"other")):
+            pass
+    with pytest.raises(ValueError, match="not found"):
+        async with store.open(checksum(b"missing")):
+            pass
+    with pytest.raises(ValueError, match="Invalid payload_ref"):
+        await store.size("../etc/passwd")
+    with pytest.raises(ValueError, match="Invalid payload_ref"):
+        await store.put(b"payload", request_id="../../etc")
+
+@pytest.mark.asyncio
+async def test_empty_blob_opens(tmp_path):
+    store = DiskBlobStore(str(tmp_path))
+    ref = await store.put(b"")
+    async with store.open(ref["payload_ref"], ref["checksum"]) as payload:
+        assert payload.size == 0
+
+@pytest.mark.asyncio
+async def test_expired_disk_blobs_are_swept(tmp_path):
+    store = DiskBlobStore(str(tmp_path), ttl=60)
+    old = await store.put(b"old")
+    os.utime(tmp_path / old["payload_ref"], (0, 0))
+    store._last_sweep = 0.0
+    new = await store.put(b"new")
+    assert await store.size(old["payload_ref"]) is None
+    assert await store.size(new["payload_ref"]) == 3
+
+@pytest.mark.asyncio
+async def test_text_segments_stream_from_a_mapped_blob(tmp_path, monkeypatch):
+    import services.file_utils_light as file_utils_light
+    monkeypatch.setattr(file_utils_light, "TEXT_SEGMENT_SIZE", 7)
+    # Multi-byte characters straddle the segment boundaries
+    text = " ".join(f"naïve{i} café" for i in range(30))
+    store = DiskBlobStore(str(tmp_path))
+    ref = await store.put(text.encode())
+    async with store.open(ref["payload_ref"]) as payload:
+        segments = [s async for s in iter_text_from_file(DummyUploadFile("a.txt"), payload.view, payload.path)]
+    assert " ".join(segments) == text
+
+@pytest.mark.asyncio
+async def test_redis_blob_is_read_in_ranges(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    import services.blob_store as blob_store
+    monkeypatch.setattr(blob_store, "REDIS_READ_CHUNK", 10)
+    redis_conn = fakeredis.aioredis.FakeRedis()
+    store = RedisBlobStore(redis_conn, ttl=60)
+    data = bytes(range(256)) * 3
+    ref = await store.put(data, "r1")
+
+    assert ref["payload_ref"] == f"{checksum(data)}-r1"
+    assert 0 < await redis_conn.ttl(f"blob:{ref['payload_ref']}") <= 60
+    async with store.open(ref["payload_ref"], ref["checksum"]) as payload:
+        assert payload.path is None
+        assert payload.view == data
+    await store.expire(ref["payload_ref"], 5)
+    assert 0 < await redis_conn.ttl(f"blob:{ref['payload_ref']}") <= 5
+    await store.delete(ref["payload_ref"])
+    assert await store.size(ref["payload_ref"]) is None
+
+class RecordingPipeline:
+    def __init__(self):
+        self.calls = []
+
+    async def run(self, filename, file_content, ingest_id, path=None):
+        self.calls.append((filename, bytes(file_content), path))
+        return {"total_chunks": 1, "processed_chunks": 0, "skipped_chunks": 1, "stage_time": {}}
+
+@pytest.fixture
+def ingest_processor():
+    from api.redis_worker_upstash import IngestProcessor
+    processor = IngestProcessor(None)
+    processor.pipeline = RecordingPipeline()
+    return processor
+
+@pytest.mark.asyncio
+async def test_worker_ingests_referenced_payload_and_lets_it_expire(tmp_path, ingest_processor, monkeypatch):
+    import api.redis_worker_upstash as worker
+    store = DiskBlobStore(str(tmp_path), ttl=3600)
+    set_blob_store(store)
+    try:
+        # Larger than the inline limit: referenced payloads are only bounded by MAX_INGEST_BYTES
+        data = b"word " * (2 * 1024 * 1024)
+        ref = await store.put(data, "r1")
+        message = {"filename": "big.txt", "request_id": "r1", **ref}
+        result = await ingest_processor.process_ingest_request(message)
+
+        assert result["status"] == "success"
+        assert ingest_processor.pipeline.calls == [("big.txt", data, os.path.join(str(tmp_path), ref["payload_ref"]))]
+        # A redelivery of the same entry (worker died before the ack) still finds the payload
+        assert (await ingest_processor.process_ingest_request(message))["status"] == "success"
+
+        monkeypatch.setattr(worker, "BLOB_DONE_TTL", 0)
+        await ingest_processor.process_ingest_request(message)
+        store._last_sweep = 0.0
+        await store.put(b"next upload")
+        assert await store.size(ref["payload_ref"]) is None
+
+        ref = await store.put(b"tampered")
+        with pytest.raises(ValueError, match="checksum mismatch"):
+            await ingest_processor.process_ingest_request(
+                {"filename": "a.txt", "request_id": "r2", **ref, "checksum": checksum(b"original")})
+        # Kept for a retry until it expires
+        assert await store.size(ref["payload_ref"]) == 8
+    finally:
+        set_blob_store(None)
+
+@pytest.mark.asyncio
+async def test_worker_still_accepts_inline_base64_within_the_inline_limit(ingest_processor, monkeypatch):
+    import api.redis_worker_upstash as worker
+    monkeypatch.setattr(worker, "INLINE_PAYLOAD_MAX_BYTES", 10)
+    await ingest_processor.process_ingest_request(
+        {"filename": "a.txt", "request_id": "r1", "file_content": base64.b64encode(b"small").decode()})
+    assert ingest_processor.pipeline.calls == [("a.txt", b"small", None)]
+
+    with pytest.raises(ValueError, match="File too large"):
+        await ingest_processor.process_ingest_request(
+            {"filename": "a.txt", "request_id": "r2", "file_content": base64.b64encode(b"x" * 11).decode()})
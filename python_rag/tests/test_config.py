@@ -0,0 +1,12 @@
+import ast
+import os
+from collections import Counter
+
+import config
+
+def test_each_setting_is_defined_once():
+    with open(os.path.join(os.path.dirname(config.__file__), "config.py")) as f:
+        tree = ast.parse(f.read())
+    names = Counter(target.id for node in tree.body if isinstance(node, ast.Assign)
+                    for target in node.targets if isinstance(target, ast.Name))
+    assert [name for name, count in names.items() if count > 1] == []
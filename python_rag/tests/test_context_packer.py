@@ -0,0 +1,69 @@
+from services.context_packer import ContextPacker
+from services.file_utils_light import chunk_text_sliding_window
+from services.token_chunker import count_tokens
+
+TEXT = " ".join(f"Sentence number {i} talks about topic {i % 7} in some detail." for i in range(60))
+
+def test_sliding_window_chunks_are_stitched_back_together():
+    chunks = chunk_text_sliding_window(TEXT, chunk_size=300, overlap=80, pre_cleaned=True)
+    packer = ContextPacker(token_budget=10000)
+
+    packed = packer.pack(list(enumerate(chunks, start=1)))
+
+    assert packed.text == TEXT
+    assert packed.stats["passages"] == 1
+    assert packed.stats["overlaps_merged"] == len(chunks) - 1
+    assert packed.stats["tokens_saved"] > 0
+    assert sorted(packed.chunk_ids) == list(range(1, len(chunks) + 1))
+
+def test_overlap_is_found_whatever_the_retrieval_order():
+    chunks = chunk_text_sliding_window(TEXT, chunk_size=300, overlap=80, pre_cleaned=True)[:3]
+    packed = ContextPacker(token_budget=10000).pack([(3, chunks[2]), (1, chunks[0]), (2, chunks[1])])
+
+    assert packed.stats["passages"] == 1
+    assert packed.text.startswith(chunks[0]) and packed.text.endswith(chunks[2])
+
+def test_near_duplicates_collapse_into_the_longer_text():
+    base = "The quarterly report shows revenue growth across all regions, driven by strong retail demand"
+    packer = ContextPacker(token_budget=10000)
+
+    packed = packer.pack([(1, base), (2, "Unrelated note about the office move next month."), (3, base + " and exports.")])
+
+    assert packed.stats["duplicates_removed"] == 1
+    assert packed.text.split("\n\n") == [base + " and exports.", "Unrelated note about the office move next month."]
+    assert set(packed.chunk_ids) == {1, 2, 3}
+
+def test_budget_packs_in_rank_order_and_skips_what_does_not_fit():
+    short = "Alpha beta gamma delta."
+    long = " ".join(["epsilon"] * 200)
+    packer = ContextPacker(token_budget=60)
+
+    packed = packer.pack([(10, short), (20, long), (30, "Zeta eta theta.")])
+
+    assert packed.text == "Alpha beta gamma delta.\n\nZeta eta theta."
+    assert packed.stats["over_budget"] == 1
+    assert packed.stats["tokens_out"] <= 60
+
+def test_oversized_best_chunk_is_truncated_to_the_budget():
+    packed = ContextPacker(token_budget=50).pack([(1, TEXT)])
+
+    assert packed.stats["truncated"]
+    assert 0 < count_tokens(packed.text) <= 50
+    assert TEXT.startswith(packed.text)
+
+def test_consecutive_ids_are_kept_together_in_source_order():
+    packer = ContextPacker(token_budget=10000)
+
+    packed = packer.pack([(8, "Second part of the guide."), (40, "Something else entirely."), (7, "First part of the guide.")])
+
+    assert packed.text.split("\n\n") == ["First part of the guide.", "Second part of the guide.", "Something else entirely."]
+
+def test_stats_accumulate_tokens_saved():
+    chunks = chunk_text_sliding_window(TEXT, chunk_size=300, overlap=80, pre_cleaned=True)
+    packer = ContextPacker(token_budget=10000)
+    packer.pack(list(enumerate(chunks)))
+    packer.pack([])
+
+    stats = packer.stats()
+    assert stats["calls"] == 2
+    assert stats["tokens_saved"] == stats["tokens_in"] - stats["tokens_out"] > 0
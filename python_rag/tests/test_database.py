@@ -1,6 +1,7 @@
 import pytest
 import asyncio
-from db.database import get_db_pool, create_documents_table
+import db.database as database
+from db.database import get_db_pool, create_documents_table, checked_fulltext_config
 
 @pytest.mark.asyncio
 async def test_get_db_pool(monkeypatch):
@@ -10,4 +11,20 @@ async def test_get_db_pool(monkeypatch):
 @pytest.mark.asyncio
 async def test_create_documents_table(monkeypatch):
     # You can mock the pool and connection here
-    pass
\ No newline at end of file
+    pass
+
+class TsConfigConn:
+    async def fetchval(self, query, *args):
+        return 1 if args[0] in ("english", "simple") else None
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", ["english')) STORED; DROP TABLE documents; --", "english\n", "English", "klingon"])
+async def test_fulltext_config_must_be_an_installed_configuration(monkeypatch, name):
+    monkeypatch.setattr(database, "FULLTEXT_CONFIG", name)
+    with pytest.raises(ValueError, match="FULLTEXT_CONFIG"):
+        await checked_fulltext_config(TsConfigConn())
+
+@pytest.mark.asyncio
+async def test_installed_fulltext_config_is_accepted(monkeypatch):
+    monkeypatch.setattr(database, "FULLTEXT_CONFIG", "simple")
+    assert await checked_fulltext_config(TsConfigConn()) == "simple"
@@ -0,0 +1,126 @@
+import asyncio
+import numpy as np
+import pytest
+
+import db.document_manager as document_manager_module
+from db.document_manager import DocumentManager
+
+class FakeTransaction:
+    async def __aenter__(self): return self
+    async def __aexit__(self, exc_type, exc, tb): return False
+
+class FakeConn:
+    def __init__(self):
+        self.executed = []
+        self.copied = []
+    def transaction(self):
+        return FakeTransaction()
+    async def execute(self, query, *args):
+        self.executed.append((query, args))
+        if query.strip().startswith("INSERT"):
+            rows = len(self.copied[-1][1]) if self.copied else len(args) // 4
+            return f"INSERT 0 {rows}"
+        if query.startswith("DELETE"):
+            return "DELETE 0"
+        return "CREATE TABLE"
+    async def fetch(self, query, *args):
+        self.executed.append((query, args))
+        return []
+    async def copy_records_to_table(self, table, records, columns):
+        self.copied.append((table, list(records), columns))
+
+class FakePool:
+    def __init__(self):
+        self.conn = FakeConn()
+        self.released = 0
+    async def acquire(self):
+        return self.conn
+    async def release(self, conn):
+        self.released += 1
+
+def _pairs(count):
+    return [(f"chunk {i}", np.full(768, i, dtype=np.float32)) for i in range(count)]
+
+@pytest.mark.asyncio
+async def test_insert_documents_uses_multi_row_insert_for_small_batches():
+    pool = FakePool()
+    inserted = await DocumentManager(pool).insert_documents(_pairs(3))
+    assert inserted == 3
+    assert pool.conn.copied == []
+    assert pool.released == 1
+
+@pytest.mark.asyncio
+async def test_insert_documents_uses_copy_above_threshold(monkeypatch):
+    monkeypatch.setattr(document_manager_module, "COPY_THRESHOLD_ROWS", 2)
+    pool = FakePool()
+    inserted = await DocumentManager(pool).insert_documents(_pairs(3))
+    assert inserted == 3
+    table, records, columns = pool.conn.copied[0]
+    assert table == "documents_staging"
+    assert columns == ["content", "content_hash", "embedding", "ingest_id"]
+    assert records[0][2].dtype == np.float32
+    merge_query = pool.conn.executed[-1][0]
+    assert "ON CONFLICT (content_hash) DO NOTHING" in merge_query
+
+@pytest.mark.asyncio
+async def test_parallel_insert_writes_every_shard_with_shared_ingest_id():
+    pool = FakePool()
+    inserted = await DocumentManager(pool).parallel_insert_documents_with_hash(
+        _pairs(10), "ingest-1", shards=5, max_concurrency=2
+    )
+    assert inserted == 10
+    assert pool.released == 5
+    inserts = [args for query, args in pool.conn.executed if query.strip().startswith("INSERT")]
+    assert len(inserts) == 5
+    assert all(args[3::4] == ("ingest-1",) * 2 for args in inserts)
+
+@pytest.mark.asyncio
+async def test_insert_documents_cleans_up_ingest_when_a_shard_fails(monkeypatch):
+    monkeypatch.setattr(document_manager_module, "PARALLEL_THRESHOLD_ROWS", 4)
+    pool = FakePool()
+    calls = 0
+    original_execute = pool.conn.execute
+
+    async def flaky_execute(query, *args):
+        nonlocal calls
+        if query.strip().startswith("INSERT"):
+            calls += 1
+            if calls == 2:
+                raise RuntimeError("connection lost")
+        return await original_execute(query, *args)
+
+    pool.conn.execute = flaky_execute
+    with pytest.raises(RuntimeError):
+        await DocumentManager(pool).insert_documents(_pairs(8), ingest_id="ingest-2")
+    cleanup = pool.conn.executed[-1]
+    assert cleanup == ("DELETE FROM documents WHERE ingest_id = $1 RETURNING id", ("ingest-2",))
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_searches_share_one_query():
+    class SlowSearchConn(FakeConn):
+        fetches = 0
+        async def fetch(self, query, *args):
+            SlowSearchConn.fetches += 1
+            await asyncio.sleep(0.01)
+            return [{"id": 1, "content": "chunk"}]
+
+    pool = FakePool()
+    pool.conn = SlowSearchConn()
+    manager = DocumentManager(pool)
+    query = np.ones(768, dtype=np.float32)
+    results = await asyncio.gather(*[manager.search_similar_documents(query) for _ in range(4)])
+    assert results == [["chunk"]] * 4
+    assert SlowSearchConn.fetches == 1
+
+@pytest.mark.asyncio
+async def test_clear_and_insert_notify_corpus_listeners(monkeypatch):
+    reasons = []
+
+    async def record(reason):
+        reasons.append(reason)
+
+    monkeypatch.setattr(document_manager_module, "notify_corpus_change", record)
+    manager = DocumentManager(FakePool())
+    await manager.insert_documents(_pairs(2))
+    await manager.clear_all_documents()
+    assert reasons == ["insert", "clear"]
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from services.embedding_cache import EmbeddingCache, content_hash
+
+def vector(seed, dim=16):
+    return np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+
+def test_vectors_persist_across_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = EmbeddingCache(path)
+    first.put(content_hash("hello"), vector(1), "model-a", "retrieval_document")
+
+    second = EmbeddingCache(path)
+    cached = second.get(content_hash("hello"), "model-a", "retrieval_document")
+    np.testing.assert_array_equal(cached, vector(1))
+    assert second.stats()["disk_hits"] == 1
+
+def test_key_includes_model_and_task_type(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    digest = content_hash("hello")
+    cache.put(digest, vector(1), "model-a", "retrieval_document")
+    assert cache.get(digest, "model-a", "retrieval_query") is None
+    assert cache.get(digest, "model-b", "retrieval_document") is None
+
+def test_memory_lru_is_bounded_and_reports_hit_rate(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), memory_items=2)
+    hashes = [content_hash(str(i)) for i in range(3)]
+    cache.put_many([(h, vector(i)) for i, h in enumerate(hashes)], "m", "t")
+    assert cache.stats()["memory_entries"] == 2
+
+    found = cache.get_many(hashes + [content_hash("missing")], "m", "t")
+    assert set(found) == set(hashes)
+    stats = cache.stats()
+    assert stats["memory_hits"] == 2
+    assert stats["disk_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == pytest.approx(0.75)
+
+def test_least_recently_used_rows_are_evicted_by_size(tmp_path):
+    dim = 16
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_bytes=10 * dim * 4, memory_items=0)
+    for i in range(10):
+        cache.put(content_hash(str(i)), vector(i, dim), "m", "t")
+    # Touch the oldest entry so it survives eviction
+    assert cache.get(content_hash("0"), "m", "t") is not None
+    cache.put(content_hash("10"), vector(10, dim), "m", "t")
+
+    stats = cache.stats()
+    assert stats["stored_bytes"] <= cache.max_bytes
+    assert stats["evictions"] >= 1
+    assert cache.get(content_hash("0"), "m", "t") is not None
+    assert cache.get(content_hash("1"), "m", "t") is None
@@ -0,0 +1,121 @@
+import pytest
+
+import services.file_utils_light as file_utils_light
+import random
+import re
+from services.file_utils_light import (
+    iter_text_from_file,
+    extract_text_from_file,
+    clean_text_for_db,
+    chunk_text,
+    chunk_text_sliding_window
+)
+
+class DummyUploadFile:
+    def __init__(self, filename):
+        self.filename = filename
+
+def make_pdf(pages):
+    objects = []
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages)))
+    objects.append("<< /Type /Catalog /Pages 2 0 R >>")
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>")
+    objects.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, text in enumerate(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+@pytest.fixture(params=[0, 2], ids=["thread", "process-pool"])
+def extraction_workers(request, monkeypatch):
+    monkeypatch.setattr(file_utils_light, "EXTRACTION_WORKERS", request.param)
+    yield request.param
+    file_utils_light.shutdown_extraction_pool()
+
+@pytest.mark.asyncio
+async def test_pdf_pages_stream_in_order(extraction_workers):
+    pages = [f"Page number {i}" for i in range(7)]
+    content = make_pdf(pages)
+    segments = [s async for s in iter_text_from_file(DummyUploadFile("doc.pdf"), content)]
+    assert segments == pages
+
+@pytest.mark.asyncio
+async def test_extract_text_from_pdf_joins_pages(extraction_workers):
+    content = make_pdf(["Hello page one", "Second page here"])
+    text = await extract_text_from_file(DummyUploadFile("doc.pdf"), content)
+    assert text == "Hello page one Second page here"
+
+@pytest.mark.asyncio
+async def test_txt_segments_do_not_overlap(monkeypatch):
+    monkeypatch.setattr(file_utils_light, "TEXT_SEGMENT_SIZE", 10)
+    text = " ".join(f"word{i}" for i in range(50))
+    segments = [s async for s in iter_text_from_file(DummyUploadFile("a.txt"), text.encode())]
+    assert " ".join(segments) == text
+
+@pytest.mark.asyncio
+async def test_txt_without_whitespace_is_cut_at_segment_boundaries(monkeypatch):
+    monkeypatch.setattr(file_utils_light, "TEXT_SEGMENT_SIZE", 10)
+    monkeypatch.setattr(file_utils_light, "TEXT_CUT_WINDOW", 25)
+    text = "x" * 200 + " tail"
+    segments = [s async for s in iter_text_from_file(DummyUploadFile("a.txt"), text.encode())]
+    assert "".join(segments[:-1]) + " " + segments[-1] == text
+    assert max(len(s) for s in segments) <= 25 + 10
+
+@pytest.mark.asyncio
+async def test_slow_pdf_page_is_skipped_after_timeout(monkeypatch):
+    import time
+    monkeypatch.setattr(file_utils_light, "EXTRACTION_WORKERS", 0)
+    monkeypatch.setattr(file_utils_light, "EXTRACTION_PAGE_TIMEOUT", 0.2)
+    original = file_utils_light._extract_pdf_page
+
+    def slow_second_page(path, page_number):
+        if page_number == 1:
+            time.sleep(0.5)
+        return original(path, page_number)
+
+    monkeypatch.setattr(file_utils_light, "_extract_pdf_page", slow_second_page)
+    content = make_pdf(["first", "second", "third"])
+    segments = [s async for s in iter_text_from_file(DummyUploadFile("doc.pdf"), content)]
+    assert segments == ["first", "third"]
+
+@pytest.mark.asyncio
+async def test_concurrent_pdfs_in_threads_keep_their_own_readers(monkeypatch):
+    import asyncio
+    monkeypatch.setattr(file_utils_light, "EXTRACTION_WORKERS", 0)
+    documents = {name: [f"{name} page {i}" for i in range(6)] for name in ("alpha", "beta", "gamma")}
+
+    async def extract(name):
+        content = make_pdf(documents[name])
+        return [s async for s in iter_text_from_file(DummyUploadFile(f"{name}.pdf"), content)]
+
+    results = await asyncio.gather(*(extract(name) for name in documents))
+    assert results == list(documents.values())
+
+def _legacy_clean_text_for_db(text):
+    if not text:
+        return ""
+    text = text.translate(str.maketrans('', '', '\x00\x08\x0b\x0c\x0e\x0f'))
+    text = ''.join(char for char in text if ord(char) >= 32 or char in '\t\n\r')
+    return re.sub(r'\s+', ' ', text).strip()
+
+def test_clean_text_for_db_matches_legacy_output():
+    rng = random.Random(0)
+    alphabet = "ab .\t\n\r\x00\x01\x08\x0b\x0c\x1c\x1f\x7f\x85\xa0\u3000é中"
+    for _ in range(5000):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+        assert clean_text_for_db(text) == _legacy_clean_text_for_db(text)
+
+def test_pre_cleaned_chunking_matches_default():
+    text = clean_text_for_db(" ".join(f"word{i}\n" for i in range(500)))
+    assert chunk_text(text, 100, pre_cleaned=True) == chunk_text(text, 100)
+    assert chunk_text_sliding_window(text, 100, 10, pre_cleaned=True) == chunk_text_sliding_window(text, 100, 10)
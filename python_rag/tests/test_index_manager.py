@@ -0,0 +1,146 @@
+import numpy as np
+import pytest
+
+from db.index_manager import IndexManager, ivfflat_lists, parse_index_definition, set_index_manager, INDEX_NAME
+from db.retrieval_backend import PgVectorBackend
+
+class IndexConn:
+    """Just enough of a connection to drive IndexManager: one index row and a row count"""
+    def __init__(self, indexdef=None, note=None, rows=0):
+        self.indexdef = indexdef
+        self.note = note
+        self.rows = rows
+        self.executed = []
+        self.lease_owner = None
+    def transaction(self):
+        executed = self.executed
+        class Transaction:
+            async def __aenter__(self):
+                executed.append("BEGIN")
+                return self
+            async def __aexit__(self, *exc):
+                executed.append("COMMIT")
+                return False
+        return Transaction()
+    async def fetchrow(self, query, *args):
+        if self.indexdef is None:
+            return None
+        return {"indexdef": self.indexdef, "indisvalid": True, "size_bytes": 8192, "note": self.note, "idx_scan": 3}
+    async def fetchval(self, query, *args):
+        if "INSERT INTO index_maintenance_lock" in query:
+            if self.lease_owner is not None:
+                return None
+            self.lease_owner = args[0]
+            return args[0]
+        if "COUNT(*)" in query:
+            return self.rows
+        return '[{"Plan": {"Node Type": "Limit", "Total Cost": 12.5, "Plans": [{"Node Type": "Index Scan", "Index Name": "%s"}]}}]' % INDEX_NAME
+    async def fetch(self, query, *args):
+        self.executed.append(query)
+        return [{"id": 1, "content": "chunk"}]
+    async def execute(self, query, *args, timeout=None):
+        if "index_maintenance_lock" in query:
+            if "'-infinity'" in query and args[0] == self.lease_owner:
+                self.lease_owner = None
+            return "OK"
+        self.executed.append(query)
+        if query.startswith("CREATE INDEX"):
+            self.indexdef = query.replace("CONCURRENTLY ", "").replace(" = ", "='").replace(", ", "', ").replace(")", "')", 1)
+            self.indexdef = self.indexdef.replace(f"{INDEX_NAME}_new", INDEX_NAME)
+        if query.startswith("COMMENT"):
+            self.note = query.split("'")[1]
+        return "OK"
+
+class IndexPool:
+    def __init__(self, conn):
+        self.conn = conn
+    async def acquire(self):
+        return self.conn
+    async def release(self, conn):
+        pass
+
+def test_lists_follow_row_count():
+    assert ivfflat_lists(500) == 1
+    assert ivfflat_lists(250_000) == 250
+    assert ivfflat_lists(4_000_000) == 2000
+
+def test_parse_index_definition():
+    parsed = parse_index_definition(
+        "CREATE INDEX idx_documents_embedding ON public.documents USING ivfflat (embedding vector_cosine_ops) WITH (lists='120')"
+    )
+    assert parsed == {"method": "ivfflat", "opclass": "vector_cosine_ops", "options": {"lists": 120}}
+
+@pytest.mark.asyncio
+async def test_small_tables_get_no_ivfflat_index_until_they_grow():
+    conn = IndexConn(rows=200)
+    manager = IndexManager("ivfflat", "cosine")
+    assert await manager.ensure_index(IndexPool(conn)) is None
+    assert not any(query.startswith("CREATE INDEX") for query in conn.executed)
+
+    conn.rows = 50_000
+    assert await manager.ensure_index(IndexPool(conn)) == "create"
+    assert manager.state["options"] == {"lists": 50}
+    assert manager.state["rows_at_build"] == 50_000
+    assert manager.search_params(5) == {"ivfflat.probes": 15}
+
+@pytest.mark.asyncio
+async def test_mismatched_opclass_is_rebuilt_and_swapped():
+    conn = IndexConn(
+        indexdef=f"CREATE INDEX {INDEX_NAME} ON public.documents USING ivfflat (embedding vector_l2_ops)", rows=5000
+    )
+    manager = IndexManager("ivfflat", "cosine")
+    assert await manager.ensure_index(IndexPool(conn)) == "rebuild"
+    statements = [query for query in conn.executed if "INDEX" in query]
+    assert statements[1].startswith(f"CREATE INDEX CONCURRENTLY {INDEX_NAME}_new")
+    assert "vector_cosine_ops" in statements[1] and "lists = 5" in statements[1]
+    # The old index is dropped and the new one renamed in the same transaction
+    swap = conn.executed.index(f"DROP INDEX IF EXISTS {INDEX_NAME}")
+    assert conn.executed[swap - 2:swap + 3] == [
+        "BEGIN", "SET LOCAL lock_timeout = '10s'", f"DROP INDEX IF EXISTS {INDEX_NAME}",
+        f"ALTER INDEX {INDEX_NAME}_new RENAME TO {INDEX_NAME}", "COMMIT"]
+    assert manager.operator == "<=>"
+
+@pytest.mark.asyncio
+async def test_growth_triggers_reindex_concurrently():
+    conn = IndexConn(
+        indexdef=f"CREATE INDEX {INDEX_NAME} ON public.documents USING ivfflat (embedding vector_cosine_ops) WITH (lists='10')",
+        note="rows=10000", rows=15_000
+    )
+    manager = IndexManager("ivfflat", "cosine", reindex_growth=2.0)
+    assert await manager.ensure_index(IndexPool(conn)) is None
+    conn.rows = 20_000
+    assert await manager.ensure_index(IndexPool(conn)) == "reindex"
+    assert f"REINDEX INDEX CONCURRENTLY {INDEX_NAME}" in conn.executed
+    assert manager.state["rows_at_build"] == 20_000
+
+@pytest.mark.asyncio
+async def test_maintenance_is_skipped_while_another_process_holds_the_lease():
+    conn = IndexConn(rows=50_000)
+    conn.lease_owner = "worker"
+    manager = IndexManager("ivfflat", "cosine")
+    assert await manager.ensure_index(IndexPool(conn)) is None
+    assert not any(query.startswith("CREATE INDEX") for query in conn.executed)
+
+    conn.lease_owner = None
+    assert await manager.ensure_index(IndexPool(conn)) == "create"
+    # Released for the next run
+    assert conn.lease_owner is None
+
+@pytest.mark.asyncio
+async def test_hnsw_search_sets_ef_search_and_uses_matching_operator():
+    set_index_manager(IndexManager("hnsw", "l2", recall_target=0.98))
+    conn = IndexConn()
+    assert await PgVectorBackend().search(IndexPool(conn), np.zeros(768, dtype=np.float32), 5) == [(1, "chunk")]
+    assert conn.executed[:2] == ["BEGIN", "SET LOCAL hnsw.ef_search = 160"]
+    assert "ORDER BY embedding <-> $1::vector" in conn.executed[2]
+
+@pytest.mark.asyncio
+async def test_status_reports_planner_usage():
+    conn = IndexConn(
+        indexdef=f"CREATE INDEX {INDEX_NAME} ON public.documents USING hnsw (embedding vector_cosine_ops) WITH (m='16', ef_construction='64')",
+        note="rows=3000", rows=3000
+    )
+    status = await IndexManager("hnsw", "cosine").status(IndexPool(conn))
+    assert status["index"]["options"] == {"m": 16, "ef_construction": 64}
+    assert status["pending_action"] is None
+    assert status["planner"] == {"uses_index": True, "scan": "Index Scan", "estimated_cost": 12.5}
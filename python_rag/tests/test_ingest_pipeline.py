@@ -0,0 +1,91 @@
+import hashlib
+import pytest
+
+import services.ingest_pipeline as ingest_pipeline_module
+from services.batch_processor import EmbeddingFailed
+from services.ingest_pipeline import IngestPipeline
+from services.text_processor import TextProcessor
+
+class FakeTextProcessor(TextProcessor):
+    def __init__(self, segments):
+        super().__init__(max_chunk_size=20)
+        self.segments = segments
+
+    async def _segments(self):
+        for segment in self.segments:
+            yield segment
+
+    def iter_file_segments(self, filename, file_content, path=None):
+        return self._segments()
+
+class FakeDocumentManager:
+    def __init__(self, existing=()):
+        self.existing = {hashlib.sha256(c.encode()).hexdigest() for c in existing}
+        self.inserted = []
+        self.deleted = []
+
+    async def find_existing_chunk_hashes(self, chunk_hashes):
+        return {h for h in chunk_hashes if h in self.existing}
+
+    async def insert_documents(self, pairs, batch_size=100, ingest_id=None):
+        self.inserted.append((ingest_id, [chunk for chunk, _ in pairs]))
+        return len(pairs)
+
+    async def delete_ingest(self, ingest_id):
+        self.deleted.append(ingest_id)
+        return 0
+
+async def fake_embeddings(chunks, batch_size=50, use_gemini_batch=False, content_hashes=None):
+    return [(chunk, [0.1] * 3) for chunk in chunks]
+
+@pytest.mark.asyncio
+async def test_pipeline_streams_chunks_and_skips_duplicates(monkeypatch):
+    monkeypatch.setattr(ingest_pipeline_module, "process_embeddings_batch", fake_embeddings)
+    segments = ["alpha beta gamma delta", "epsilon zeta", "alpha beta gamma delta"]
+    manager = FakeDocumentManager(existing=["epsilon zeta"])
+    pipeline = IngestPipeline(FakeTextProcessor(segments), manager, dedup_batch_size=1, write_batch_size=1)
+
+    stats = await pipeline.run("doc.txt", b"", ingest_id="req-1")
+
+    written = [chunk for _, chunks in manager.inserted for chunk in chunks]
+    assert len(written) == len(set(written))
+    assert all(ingest_id == "req-1" for ingest_id, _ in manager.inserted)
+    assert stats["processed_chunks"] == len(written)
+    assert stats["total_chunks"] == stats["processed_chunks"] + stats["skipped_chunks"]
+    assert stats["time_to_first_row"] is not None
+    assert set(stats["max_queue_depth"]) == {"segments", "chunks", "new_chunks", "embeddings"}
+
+@pytest.mark.asyncio
+async def test_pipeline_cleans_up_written_rows_on_failure(monkeypatch):
+    calls = 0
+
+    async def flaky_embeddings(chunks, batch_size=50, use_gemini_batch=False, content_hashes=None):
+        nonlocal calls
+        calls += 1
+        if calls > 1:
+            raise RuntimeError("quota exceeded")
+        return await fake_embeddings(chunks)
+
+    monkeypatch.setattr(ingest_pipeline_module, "process_embeddings_batch", flaky_embeddings)
+    manager = FakeDocumentManager()
+    segments = [f"segment number {i} with words" for i in range(10)]
+    pipeline = IngestPipeline(FakeTextProcessor(segments), manager, dedup_batch_size=1, write_batch_size=1)
+
+    with pytest.raises(RuntimeError):
+        await pipeline.run("doc.txt", b"", ingest_id="req-2")
+    assert manager.deleted == ["req-2"]
+
+@pytest.mark.asyncio
+async def test_pipeline_fails_when_chunks_come_back_unembedded(monkeypatch):
+    async def short_embeddings(chunks, batch_size=50, use_gemini_batch=False, content_hashes=None):
+        return (await fake_embeddings(chunks))[1:]
+
+    monkeypatch.setattr(ingest_pipeline_module, "process_embeddings_batch", short_embeddings)
+    manager = FakeDocumentManager()
+    pipeline = IngestPipeline(FakeTextProcessor(["alpha beta gamma delta epsilon"]), manager)
+
+    with pytest.raises(EmbeddingFailed) as failure:
+        await pipeline.run("doc.txt", b"", ingest_id="req-3")
+    assert failure.value.positions == [0]
+    assert manager.inserted == []
+    assert manager.deleted == ["req-3"]
@@ -0,0 +1,126 @@
+import os
+import numpy as np
+import pytest
+
+from db import mmap_store
+from db.mmap_store import MmapVectorStore
+from db.quantization import ProductQuantizer, ScalarQuantizer, make_quantizer
+
+def rows(start, count, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    return [(start + i, f"chunk {start + i} é", vectors[i]) for i in range(count)]
+
+def brute_force(data, query, k):
+    dists = [(float(((vector - query) ** 2).sum()), chunk_id) for chunk_id, _, vector in data]
+    return [chunk_id for _, chunk_id in sorted(dists)[:k]]
+
+def test_search_is_exact_across_base_and_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(mmap_store, "SEARCH_BLOCK_ROWS", 7)
+    store = MmapVectorStore(str(tmp_path), dim=16)
+    base, log = rows(1, 40), rows(41, 25, seed=1)
+    store.append(base)
+    store.compact()
+    store.append(log)
+    assert {key: store.stats()[key] for key in ("rows", "base_rows", "log_rows")} == {"rows": 65, "base_rows": 40, "log_rows": 25}
+
+    query = np.random.default_rng(2).standard_normal(16).astype(np.float32)
+    results = store.search(query, 10)
+    assert [chunk_id for chunk_id, _, _ in results] == brute_force(base + log, query, 10)
+    chunk_id, content, dist = results[0]
+    assert content == f"chunk {chunk_id} é"
+    assert np.isclose(dist, ((dict((i, v) for i, _, v in base + log)[chunk_id] - query) ** 2).sum(), rtol=1e-4)
+
+def test_deletes_persist_and_compaction_drops_them(tmp_path):
+    store = MmapVectorStore(str(tmp_path), dim=16)
+    data = rows(1, 30)
+    store.append(data)
+    store.remove(range(1, 31, 2))
+    reopened = MmapVectorStore(str(tmp_path), dim=16)
+    assert len(reopened) == 15
+    found = [chunk_id for chunk_id, _, _ in reopened.search(data[0][2], 30)]
+    assert len(found) == 15 and all(chunk_id % 2 == 0 for chunk_id in found)
+
+    reopened.compact()
+    assert {key: reopened.stats()[key] for key in ("rows", "base_rows", "log_rows", "deleted_rows")} == \
+        {"rows": 15, "base_rows": 15, "log_rows": 0, "deleted_rows": 0}
+    assert reopened.search(data[3][2], 1)[0][:2] == (4, "chunk 4 é")
+    assert reopened.max_id() == 30
+
+def test_torn_append_is_ignored_and_repaired(tmp_path):
+    store = MmapVectorStore(str(tmp_path), dim=16)
+    store.append(rows(1, 5))
+    # A crash after the ids were written but before the vectors
+    with open(os.path.join(tmp_path, "ids.log"), "ab") as f:
+        f.write(np.array([99], dtype=np.int64).tobytes())
+    reopened = MmapVectorStore(str(tmp_path), dim=16)
+    assert len(reopened) == 5
+
+    reopened.append(rows(6, 2, seed=3))
+    assert len(reopened) == 7
+    assert reopened.search(rows(6, 2, seed=3)[1][2], 1)[0][0] == 7
+
+def test_writes_are_visible_to_other_handles(tmp_path):
+    writer = MmapVectorStore(str(tmp_path), dim=16)
+    reader = MmapVectorStore(str(tmp_path), dim=16)
+    data = rows(1, 3)
+    writer.append(data)
+    assert reader.search(data[2][2], 1)[0][0] == 3
+    writer.clear()
+    assert MmapVectorStore(str(tmp_path), dim=16).search(data[2][2], 1) == []
+
+def test_compaction_and_clear_by_another_handle_are_picked_up(tmp_path):
+    a = MmapVectorStore(str(tmp_path), dim=16)
+    b = MmapVectorStore(str(tmp_path), dim=16)
+    data = rows(1, 10)
+    a.append(data)
+    assert len(b) == 10
+    a.compact()
+    assert len(b) == 10 and b.stats()["base_rows"] == 10
+    assert b.search(data[4][2], 1)[0][:2] == (5, "chunk 5 é")
+
+    b.append(rows(11, 3, seed=1))
+    a.compact()
+    b.compact()
+    assert len(a) == len(b) == 13
+    a.clear()
+    assert len(b) == 0 and b.search(data[4][2], 1) == []
+
+def test_rows_already_stored_are_not_appended_twice(tmp_path):
+    a = MmapVectorStore(str(tmp_path), dim=16)
+    b = MmapVectorStore(str(tmp_path), dim=16)
+    a.append(rows(1, 5))
+    a.compact()
+    b.append(rows(1, 8))
+    assert len(a) == 8
+    assert sorted(chunk_id for chunk_id, _, _ in a.search(rows(1, 1)[0][2], 8)) == list(range(1, 9))
+
+def clustered(n, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((20, dim))
+    points = centers[rng.integers(0, 20, n)] + 0.5 * rng.standard_normal((n, dim))
+    return (points / np.linalg.norm(points, axis=1, keepdims=True)).astype(np.float32)
+
+@pytest.mark.parametrize("quantizer", [ScalarQuantizer(32), ProductQuantizer(32, subvectors=8)], ids=["int8", "pq"])
+def test_quantized_search_reranks_to_exact_results(tmp_path, quantizer):
+    vectors = clustered(600, 32)
+    data = [(i + 1, f"chunk {i + 1}", vector) for i, vector in enumerate(vectors)]
+    store = MmapVectorStore(str(tmp_path), dim=32, quantizer=quantizer, rerank=8)
+    store.append(data[:500])
+    store.remove([1, 2, 3])
+    store.compact()
+    store.append(data[500:])
+    stats = store.stats()
+    assert stats["quantization"] == quantizer.kind
+    assert stats["code_bytes"] == 497 * quantizer.code_size
+
+    recall = 0.0
+    for query in clustered(30, 32, seed=1):
+        found = [chunk_id for chunk_id, _, _ in store.search(query, 10)]
+        recall += len(set(found) & set(brute_force(data[3:], query, 10))) / 10
+        assert not {1, 2, 3} & set(found)
+    assert recall / 30 >= 0.95
+
+    reopened = MmapVectorStore(str(tmp_path), dim=32, quantizer=make_quantizer(quantizer.kind, 32, subvectors=8))
+    assert reopened.stats()["quantization"] == quantizer.kind
+    assert reopened.search(vectors[200], 1)[0][0] == 201
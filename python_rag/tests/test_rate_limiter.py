@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+from google.api_core import exceptions as google_exceptions
+
+import services.rate_limiter as rate_limiter_module
+from services.rate_limiter import AIMDLimiter, call_with_retry, is_retryable_error
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limiter_module.random, "uniform", lambda low, high: 0)
+
+class HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+def test_retryable_errors_are_classified():
+    assert is_retryable_error(google_exceptions.ResourceExhausted("Quota exceeded for metric"))
+    assert is_retryable_error(google_exceptions.ServiceUnavailable("Service Unavailable"))
+    assert is_retryable_error(google_exceptions.DeadlineExceeded("Deadline exceeded"))
+    assert is_retryable_error(asyncio.TimeoutError())
+    assert is_retryable_error(HTTPError(503))
+    assert not is_retryable_error(google_exceptions.InvalidArgument("400 invalid argument"))
+    assert not is_retryable_error(HTTPError(404))
+
+def test_status_codes_in_the_message_are_not_retried():
+    assert not is_retryable_error(ValueError("Document 4291 not found"))
+    assert not is_retryable_error(RuntimeError("Input of 5000 bytes exceeds the limit"))
+    assert not is_retryable_error(RuntimeError("timed out after 500ms: quota config invalid"))
+
+def test_limit_grows_additively_and_halves_once_per_burst():
+    limiter = AIMDLimiter(initial_limit=4, max_limit=6, cooldown=60)
+    for _ in range(8):
+        limiter.on_success(latency=0.1)
+    assert 5.5 < limiter.limit <= 6
+    limiter.on_throttle()
+    limiter.on_throttle()
+    assert limiter.limit == pytest.approx(limiter.max_limit / 2, rel=0.1)
+    assert limiter.throttle_events == 2
+
+def test_slow_responses_do_not_grow_the_limit():
+    limiter = AIMDLimiter(initial_limit=4, latency_target=1.0)
+    limiter.on_success(latency=5.0)
+    assert limiter.limit == 4
+
+@pytest.mark.asyncio
+async def test_in_flight_never_exceeds_limit():
+    limiter = AIMDLimiter(initial_limit=3, max_limit=3)
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.01)
+        return True
+
+    results = await asyncio.gather(*[call_with_retry(limiter, call) for _ in range(12)])
+    assert all(results)
+    assert peak == 3
+    assert limiter.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_retries_throttled_calls_and_backs_off():
+    limiter = AIMDLimiter(initial_limit=8)
+    attempts = 0
+
+    async def call():
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise google_exceptions.ResourceExhausted("429 rate limit")
+        return "ok"
+
+    assert await call_with_retry(limiter, call) == "ok"
+    assert attempts == 3
+    assert limiter.throttle_events == 2
+    assert limiter.limit < 8
+
+@pytest.mark.asyncio
+async def test_non_retryable_errors_raise_immediately():
+    limiter = AIMDLimiter()
+    attempts = 0
+
+    async def call():
+        nonlocal attempts
+        attempts += 1
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        await call_with_retry(limiter, call)
+    assert attempts == 1
+    assert limiter.throttle_events == 0
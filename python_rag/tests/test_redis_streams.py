@@ -0,0 +1,166 @@
+import asyncio
+import json
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from api.redis_streams import StreamConsumer, enqueue
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+def connect(server):
+    return fakeredis.aioredis.FakeRedis(server=server, decode_responses=True)
+
+def consumer(server, name, handler, **kwargs):
+    kwargs.setdefault("claim_idle_ms", 60000)
+    return StreamConsumer(connect(server), "requests", handler, group="workers", consumer=name, block_ms=10, **kwargs)
+
+@pytest.mark.asyncio
+async def test_consumers_in_a_group_split_the_work(server):
+    seen = {"a": [], "b": []}
+    workers = [consumer(server, name, lambda data, name=name: _record(seen[name], data), batch=3) for name in ("a", "b")]
+    await workers[0].ensure_group()
+    producer = connect(server)
+    for index in range(6):
+        await enqueue(producer, "requests", {"request_id": index})
+
+    # Messages queued before any worker read them are not lost
+    await workers[0].read()
+    await workers[1].read()
+
+    handled = sorted(data["request_id"] for data in seen["a"] + seen["b"])
+    assert handled == list(range(6))
+    assert len(seen["a"]) == len(seen["b"]) == 3
+    assert await producer.xpending("requests", "workers") == {"pending": 0, "min": None, "max": None, "consumers": []}
+
+async def _record(bucket, data):
+    bucket.append(data)
+
+@pytest.mark.asyncio
+async def test_entries_of_a_dead_consumer_are_reclaimed(server):
+    producer = connect(server)
+    crashed = consumer(server, "crashed", None)
+    await crashed.ensure_group()
+    await enqueue(producer, "requests", {"request_id": "r1"})
+    # Read but never acknowledged, as if the process died mid-request
+    await producer.xreadgroup("workers", "crashed", {"requests": ">"}, count=10)
+
+    handled = []
+    survivor = consumer(server, "survivor", lambda data: _record(handled, data), claim_idle_ms=0)
+    assert await survivor.read() == 0
+    assert await survivor.reclaim() == 1
+
+    assert handled == [{"request_id": "r1"}]
+    assert survivor.stats()["reclaimed"] == 1
+    assert (await producer.xpending("requests", "workers"))["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_failing_entry_is_retried_then_dead_lettered(server):
+    attempts = []
+
+    async def flaky(data):
+        attempts.append(data)
+        raise RuntimeError("boom")
+
+    worker = consumer(server, "a", flaky, claim_idle_ms=0, max_deliveries=2)
+    await worker.ensure_group()
+    producer = connect(server)
+    await enqueue(producer, "requests", {"request_id": "r1"})
+
+    await worker.read()      # delivery 1 fails, stays pending
+    await worker.reclaim()   # delivery 2 fails
+    await worker.reclaim()   # delivery 3 exceeds max_deliveries
+
+    assert len(attempts) == 2
+    assert worker.stats()["dead_lettered"] == 1
+    assert (await producer.xpending("requests", "workers"))["pending"] == 0
+    dead = await producer.xrange("requests:dead")
+    assert json.loads(dead[0][1]["data"]) == {"request_id": "r1"}
+
+@pytest.mark.asyncio
+async def test_restarted_consumer_recovers_its_own_pending_entries(server):
+    producer = connect(server)
+    worker = consumer(server, "a", None)
+    await worker.ensure_group()
+    await enqueue(producer, "requests", {"request_id": "r1"})
+    await producer.xreadgroup("workers", "a", {"requests": ">"}, count=10)
+
+    handled = []
+    restarted = consumer(server, "a", lambda data: _record(handled, data))
+    assert await restarted.recover() == 1
+    assert handled == [{"request_id": "r1"}]
+    assert await restarted.recover() == 0
+
+@pytest.mark.asyncio
+async def test_run_consumes_until_cancelled(server):
+    handled = []
+    worker = consumer(server, "a", lambda data: _record(handled, data))
+    task = asyncio.create_task(worker.run())
+    await asyncio.sleep(0.05)
+    await enqueue(connect(server), "requests", {"request_id": "r1"})
+    for _ in range(100):
+        if handled:
+            break
+        await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert handled == [{"request_id": "r1"}]
+
+@pytest.mark.asyncio
+async def test_dispatched_entries_run_concurrently_and_are_acked_when_done(server):
+    from utils.task_dispatcher import TaskDispatcher
+
+    dispatcher = TaskDispatcher("query", limit=3, max_queued=0)
+    release = asyncio.Event()
+    started = []
+
+    async def handler(data):
+        started.append(data["request_id"])
+        await release.wait()
+
+    worker = consumer(server, "a", handler, dispatcher=dispatcher)
+    await worker.ensure_group()
+    producer = connect(server)
+    for index in range(5):
+        await enqueue(producer, "requests", {"request_id": index})
+
+    # Only as many entries as the dispatcher can take are read; the rest stay for other workers
+    assert await worker.read() == 3
+    await asyncio.sleep(0.01)
+    assert sorted(started) == [0, 1, 2]
+    assert (await producer.xpending("requests", "workers"))["pending"] == 3
+
+    release.set()
+    await dispatcher.drain(timeout=1)
+    assert (await producer.xpending("requests", "workers"))["pending"] == 0
+    assert worker.stats()["processed"] == 3
+
+@pytest.mark.asyncio
+async def test_worker_leaves_transient_failures_pending_and_acks_bad_input(server):
+    from api.redis_worker_upstash import process_ingest_message
+
+    class FailingProcessor:
+        async def process_ingest_request(self, data):
+            raise data["error"]
+
+    class Responses:
+        published = []
+        async def publish(self, channel, message):
+            self.published.append((channel, json.loads(message)["request_id"]))
+
+    errors = {"r1": ConnectionError("database went away"), "r2": ValueError("Payload r2 checksum mismatch")}
+    worker = consumer(server, "a", lambda data: process_ingest_message(
+        Responses(), FailingProcessor(), {**data, "error": errors[data["request_id"]]}))
+    await worker.ensure_group()
+    producer = connect(server)
+    for request_id in errors:
+        await enqueue(producer, "requests", {"request_id": request_id})
+
+    assert await worker.read() == 2
+    # Both are answered, but only the checksum mismatch is acknowledged
+    assert Responses.published == [("ingest_responses", "r1"), ("ingest_responses", "r2")]
+    pending = await producer.xpending_range("requests", "workers", min="-", max="+", count=10)
+    assert len(pending) == 1 and worker.stats()["failed"] == 1
@@ -0,0 +1,44 @@
+import time
+import pytest
+
+from services.reranker import HeuristicScorer, Reranker
+
+CANDIDATES = [
+    (1, "Shipping usually takes three to five business days."),
+    (2, "Our office is closed on public holidays."),
+    (3, "Refunds for damaged items are issued within 14 days of the return."),
+    (4, "Damaged packaging should be photographed before opening."),
+    (5, "Gift cards cannot be refunded."),
+]
+
+class SlowScorer(HeuristicScorer):
+    def score_batch(self, question, passages, offset, context):
+        time.sleep(0.2)
+        return super().score_batch(question, passages, offset, context)
+
+class BrokenScorer(HeuristicScorer):
+    def score_batch(self, question, passages, offset, context):
+        raise RuntimeError("model crashed")
+
+@pytest.mark.asyncio
+async def test_heuristic_promotes_passages_matching_the_question():
+    reranker = Reranker(HeuristicScorer(), batch_size=2, budget_ms=1000)
+    chunks, reranked = await reranker.rerank("refund for damaged items", CANDIDATES, limit=2)
+    assert reranked
+    assert chunks[0] == CANDIDATES[2]
+    assert reranker.stats()["calls"] == 1
+
+@pytest.mark.asyncio
+async def test_no_lexical_signal_keeps_retrieval_order():
+    reranker = Reranker(HeuristicScorer(), batch_size=2, budget_ms=1000)
+    chunks, _ = await reranker.rerank("zzz", CANDIDATES, limit=5)
+    assert chunks == CANDIDATES
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("scorer", [SlowScorer(), BrokenScorer()], ids=["over-budget", "error"])
+async def test_falls_back_to_retrieval_order(scorer):
+    reranker = Reranker(scorer, batch_size=2, budget_ms=50)
+    chunks, reranked = await reranker.rerank("refund for damaged items", CANDIDATES, limit=3)
+    assert not reranked
+    assert chunks == CANDIDATES[:3]
+    assert reranker.stats()["timeouts"] == 1
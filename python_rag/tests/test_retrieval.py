@@ -0,0 +1,90 @@
+import asyncio
+import numpy as np
+import pytest
+
+import services.retrieval as retrieval_module
+from services.retrieval import is_keyword_query, retrieve, rrf_fuse
+
+@pytest.mark.parametrize("question, expected", [
+    ("ERR_CONN_RESET", True),
+    ("SKU-4411 price", True),
+    ('"connection refused"', True),
+    ("pg_stat_activity idle", True),
+    ("What does ERR_CONN_RESET mean?", False),
+    ("how do I reset my password", False),
+    ("refund policy for damaged items", False),
+])
+def test_keyword_query_detection(question, expected):
+    assert is_keyword_query(question) is expected
+
+def test_rrf_rewards_agreement_between_rankings():
+    vector = [(1, "a"), (2, "b"), (3, "c")]
+    lexical = [(3, "c"), (4, "d")]
+    # b and d tie; the vector ranking comes first, so b wins
+    assert rrf_fuse([vector, lexical], limit=3) == [(3, "c"), (1, "a"), (2, "b")]
+
+class FakeDocumentManager:
+    lexical_results = []
+    calls = []
+    def __init__(self, db_pool):
+        pass
+    async def search_lexical_chunks(self, question, limit=5):
+        self.calls.append(("lexical", limit))
+        await asyncio.sleep(0.05)
+        return self.lexical_results[:limit]
+    async def search_similar_chunks(self, embedding, limit=5):
+        self.calls.append(("vector", limit))
+        return [(1, "a"), (2, "b"), (3, "c")][:limit]
+
+@pytest.fixture
+def fakes(monkeypatch):
+    FakeDocumentManager.calls = []
+    embeddings = []
+    async def fake_embedding(question):
+        embeddings.append(question)
+        await asyncio.sleep(0.05)
+        return np.ones(768, dtype=np.float32)
+    monkeypatch.setattr(retrieval_module, "DocumentManager", FakeDocumentManager)
+    monkeypatch.setattr(retrieval_module, "generate_query_embedding_gemini", fake_embedding)
+    return embeddings
+
+@pytest.mark.asyncio
+async def test_hybrid_runs_legs_concurrently_and_fuses(fakes):
+    FakeDocumentManager.lexical_results = [(3, "c"), (9, "z")]
+    start = asyncio.get_running_loop().time()
+    result = await retrieve(None, "refund policy for damaged items", limit=2, mode="hybrid")
+    elapsed = asyncio.get_running_loop().time() - start
+    assert result.mode == "hybrid"
+    assert result.chunks == [(3, "c"), (1, "a")]
+    assert result.query_embedding is not None
+    assert {"lexical", "embedding", "vector", "fusion", "total"} <= set(result.timings)
+    # Lexical search overlaps the embedding call instead of following it
+    assert elapsed < 0.09
+
+@pytest.mark.asyncio
+async def test_keyword_query_skips_embedding_on_lexical_hit(fakes):
+    FakeDocumentManager.lexical_results = [(9, "ERR_CONN_RESET: peer closed")]
+    result = await retrieve(None, "ERR_CONN_RESET", limit=5, mode="hybrid")
+    assert result.mode == "lexical"
+    assert result.chunks == [(9, "ERR_CONN_RESET: peer closed")]
+    assert result.query_embedding is None
+    assert fakes == []
+
+@pytest.mark.asyncio
+async def test_keyword_query_without_lexical_hits_falls_back_to_hybrid(fakes):
+    FakeDocumentManager.lexical_results = []
+    result = await retrieve(None, "ERR_CONN_RESET", limit=2, mode="hybrid")
+    assert result.mode == "hybrid"
+    assert result.chunks == [(1, "a"), (2, "b")]
+    assert fakes == ["ERR_CONN_RESET"]
+
+@pytest.mark.asyncio
+async def test_reranker_overfetches_and_trims_to_top_k(fakes, monkeypatch):
+    from services.reranker import HeuristicScorer, Reranker
+    monkeypatch.setattr(retrieval_module, "get_reranker", lambda: Reranker(HeuristicScorer(), budget_ms=1000))
+    monkeypatch.setattr(retrieval_module, "RERANK_TOP_K", 2)
+    result = await retrieve(None, "tell me about c", limit=5, mode="vector")
+    assert ("vector", 50) in FakeDocumentManager.calls
+    assert result.mode == "vector+rerank"
+    assert result.chunks == [(3, "c"), (1, "a")]
+    assert "rerank" in result.timings
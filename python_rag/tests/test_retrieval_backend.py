@@ -0,0 +1,200 @@
+import asyncio
+import numpy as np
+import pytest
+
+from db.document_manager import DocumentManager
+from db.hnsw_index import HNSWIndex
+from db.retrieval_backend import HNSWBackend, MmapBackend, set_retrieval_backend
+
+def clustered(n, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((10, dim))
+    return (centers[rng.integers(0, 10, n)] + 0.3 * rng.standard_normal((n, dim))).astype(np.float32)
+
+def test_numpy_hnsw_recall_against_brute_force():
+    vectors = clustered(800, 32)
+    index = HNSWIndex(32, m=8, ef_construction=64, ef_search=32)
+    index.add(range(len(vectors)), vectors)
+    recall = 0.0
+    for query in clustered(50, 32, seed=1):
+        exact = np.argsort(((vectors - query) ** 2).sum(axis=1))[:10]
+        found, _ = index.search(query, 10)
+        recall += len(set(exact.tolist()) & set(found)) / 10
+    assert recall / 50 >= 0.95
+
+def test_removed_labels_are_not_returned():
+    vectors = clustered(200, 16)
+    index = HNSWIndex(16, m=8)
+    index.add(range(200), vectors)
+    index.remove(range(0, 200, 2))
+    found, _ = index.search(vectors[4], 10)
+    assert len(found) == 10
+    assert all(label % 2 == 1 for label in found)
+    assert len(index) == 100
+
+@pytest.mark.parametrize("compact_fraction", [1.0, 0.2], ids=["tombstones", "compacted"])
+def test_thousands_of_removed_labels_still_leave_k_results(monkeypatch, compact_fraction):
+    import db.hnsw_index as hnsw_index
+    monkeypatch.setattr(hnsw_index, "COMPACT_DELETED_FRACTION", compact_fraction)
+    vectors = clustered(1600, 8)
+    index = HNSWIndex(8, m=8, ef_construction=32)
+    index.add(range(1600), vectors)
+    index.remove(range(1200))
+    assert len(index._deleted) == (1200 if compact_fraction == 1.0 else 0)
+    for query in vectors[1200:1210]:
+        found, _ = index.search(query, 10)
+        assert len(found) == 10 and min(found) >= 1200
+
+class LoadConn:
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetches = []
+    def transaction(self):
+        class Transaction:
+            async def __aenter__(self): return self
+            async def __aexit__(self, *exc): return False
+        return Transaction()
+    async def _cursor(self, after_id):
+        for row in self.rows:
+            if row["id"] > after_id:
+                yield row
+    def cursor(self, query, after_id=0, prefetch=None):
+        return self._cursor(after_id)
+    async def fetch(self, query, *args):
+        self.fetches.append((query, args))
+        if query.strip().startswith("SELECT id, content_hash"):
+            self.rows.append({"id": 100, "content": "new chunk", "embedding": None})
+            return [{"id": 100, "content_hash": args[1][0]}]
+        if query.startswith("DELETE"):
+            self.rows = [row for row in self.rows if row["id"] != 100]
+            return [{"id": 100}]
+        if query == "SELECT id FROM documents":
+            return [{"id": row["id"]} for row in self.rows]
+        if "= ANY($1::bigint[])" in query:
+            return [row for row in self.rows if row["id"] in args[0]]
+        return []
+    async def fetchval(self, query, *args):
+        return len(self.rows)
+    async def fetchrow(self, query, *args):
+        return {"rows": len(self.rows), "max_id": max((row["id"] for row in self.rows), default=0)}
+    async def execute(self, query, *args):
+        return "INSERT 0 1"
+
+class LoadPool:
+    def __init__(self, conn):
+        self.conn = conn
+    async def acquire(self):
+        return self.conn
+    async def release(self, conn):
+        pass
+
+@pytest.fixture
+def hnsw_backend():
+    backend = HNSWBackend(dim=8, prefer_hnswlib=False)
+    set_retrieval_backend(backend)
+    yield backend
+    set_retrieval_backend(None)
+
+@pytest.mark.asyncio
+async def test_backend_loads_from_postgres_and_tracks_inserts_and_rollbacks(hnsw_backend):
+    vectors = clustered(21, 8)
+    pool = LoadPool(LoadConn([
+        {"id": i, "content": f"chunk {i}", "embedding": vectors[i]} for i in range(1, 21)
+    ]))
+    await hnsw_backend.load(pool)
+    manager = DocumentManager(pool)
+    assert await manager.search_similar_chunks(vectors[3], limit=1) == [(3, "chunk 3")]
+    assert not any("ORDER BY embedding" in query for query, _ in pool.conn.fetches)
+
+    new_vector = np.full(8, 50, dtype=np.float32)
+    await manager.insert_documents([("new chunk", new_vector)], ingest_id="ingest-1")
+    assert hnsw_backend.stats()["rows"] == 21
+    assert await manager.search_similar_chunks(new_vector, limit=1) == [(100, "new chunk")]
+
+    await manager.delete_ingest("ingest-1")
+    assert hnsw_backend.stats()["rows"] == 20
+    assert (100, "new chunk") not in await manager.search_similar_chunks(new_vector, limit=3)
+
+@pytest.mark.asyncio
+async def test_mmap_backend_reopens_without_rebuilding(tmp_path):
+    vectors = clustered(20, 8)
+    conn = LoadConn([{"id": i, "content": f"chunk {i}", "embedding": vectors[i]} for i in range(1, 20)])
+    backend = MmapBackend(str(tmp_path), dim=8)
+    set_retrieval_backend(backend)
+    try:
+        await backend.load(LoadPool(conn))
+        assert backend.rebuilt and backend.stats()["rows"] == 19
+        manager = DocumentManager(LoadPool(conn))
+        assert await manager.search_similar_chunks(vectors[3], limit=1) == [(3, "chunk 3")]
+        await manager.insert_documents([("new chunk", vectors[0] * 10)], ingest_id="ingest-1")
+        await manager.delete_ingest("ingest-1")
+
+        reopened = MmapBackend(str(tmp_path), dim=8)
+        await reopened.load(LoadPool(conn))
+        assert not reopened.rebuilt
+        assert (await reopened.search(None, vectors[7], 2))[0] == (7, "chunk 7")
+
+        conn.rows = conn.rows[:10]
+        await reopened.load(LoadPool(conn))
+        assert reopened.rebuilt and reopened.stats()["rows"] == 10
+    finally:
+        set_retrieval_backend(None)
+
+@pytest.mark.asyncio
+async def test_processes_sharing_an_mmap_store_rebuild_it_once(tmp_path):
+    vectors = clustered(20, 8)
+    conn = LoadConn([{"id": i, "content": f"chunk {i}", "embedding": vectors[i]} for i in range(1, 20)])
+    api, worker = MmapBackend(str(tmp_path), dim=8), MmapBackend(str(tmp_path), dim=8)
+    await asyncio.gather(api.load(LoadPool(conn)), worker.load(LoadPool(conn)))
+    assert [api.rebuilt, worker.rebuilt].count(True) == 1
+    assert api.stats()["rows"] == worker.stats()["rows"] == 19
+    assert (await worker.search(None, vectors[7], 1)) == [(7, "chunk 7")]
+
+@pytest.fixture(params=["hnsw", "mmap"])
+def local_backend(request, tmp_path):
+    if request.param == "hnsw":
+        backend = HNSWBackend(dim=8, prefer_hnswlib=False)
+    else:
+        backend = MmapBackend(str(tmp_path), dim=8)
+    set_retrieval_backend(backend)
+    yield backend
+    set_retrieval_backend(None)
+
+@pytest.mark.asyncio
+async def test_writes_from_other_processes_are_caught_up_when_the_version_moves(local_backend, corpus_version):
+    vectors = clustered(30, 8)
+    conn = LoadConn([{"id": i, "content": f"chunk {i}", "embedding": vectors[i]} for i in range(1, 20)])
+    pool = LoadPool(conn)
+    await local_backend.load(pool)
+    manager = DocumentManager(pool)
+
+    # The worker inserts rows (one committed below the highest id) and deletes one
+    conn.rows = [row for row in conn.rows if row["id"] != 5]
+    conn.rows += [{"id": i, "content": f"chunk {i}", "embedding": vectors[i]} for i in (20, 21, 25)]
+    # Not seen until the shared version says the corpus changed
+    assert (await local_backend.search(pool, vectors[25], 1))[0][0] != 25
+    corpus_version.bump()
+    assert await manager.search_similar_chunks(vectors[25], limit=1) == [(25, "chunk 25")]
+    assert (5, "chunk 5") not in await local_backend.search(pool, vectors[5], 3)
+    assert local_backend.stats()["rows"] == 21
+
+    conn.rows.append({"id": 22, "content": "chunk 22", "embedding": vectors[22]})
+    corpus_version.bump()
+    assert await local_backend.search(pool, vectors[22], 1) == [(22, "chunk 22")]
+    assert local_backend.stats()["rows"] == 22
+
+    conn.rows = []
+    corpus_version.bump()
+    assert await local_backend.search(pool, vectors[22], 1) == []
+
+@pytest.mark.asyncio
+async def test_writers_without_a_shared_version_are_caught_up_on_the_interval(hnsw_backend, monkeypatch):
+    import db.retrieval_backend as retrieval_backend
+    vectors = clustered(20, 8)
+    conn = LoadConn([{"id": i, "content": f"chunk {i}", "embedding": vectors[i]} for i in range(1, 10)])
+    await hnsw_backend.load(LoadPool(conn))
+    conn.rows.append({"id": 15, "content": "chunk 15", "embedding": vectors[15]})
+    assert (await hnsw_backend.search(LoadPool(conn), vectors[15], 1))[0][0] != 15
+
+    monkeypatch.setattr(retrieval_backend, "LOCAL_INDEX_SYNC_SECONDS", 0)
+    assert await hnsw_backend.search(LoadPool(conn), vectors[15], 1) == [(15, "chunk 15")]
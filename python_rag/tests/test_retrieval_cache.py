@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from db.corpus_state import CorpusVersion, notify_corpus_change
+from db.document_manager import DocumentManager
+from db.retrieval_cache import RetrievalCache, retrieval_key
+
+class CountingConn:
+    def __init__(self):
+        self.fetches = 0
+    async def fetch(self, query, *args):
+        self.fetches += 1
+        return [{"id": 7, "content": "chunk"}]
+
+class CountingPool:
+    def __init__(self):
+        self.conn = CountingConn()
+    async def acquire(self):
+        return self.conn
+    async def release(self, conn):
+        pass
+
+def test_key_ignores_float_noise_and_scale():
+    query = np.random.default_rng(0).standard_normal(768).astype(np.float32)
+    assert retrieval_key(query, 5) == retrieval_key(query * 2 + 1e-7, 5)
+    assert retrieval_key(query, 5) != retrieval_key(query, 10)
+    assert retrieval_key(query, 5) != retrieval_key(-query, 5)
+
+def test_entries_persist_and_go_stale_on_new_version(tmp_path):
+    path = str(tmp_path / "retrieval.sqlite3")
+    RetrievalCache(path).put("k", 1, [(7, "chunk")])
+
+    reopened = RetrievalCache(path)
+    assert reopened.get("k", 1) == [(7, "chunk")]
+    assert reopened.get("k", 2) is None
+    assert reopened.get("k", 1) is None
+    assert reopened.stats()["stale"] == 1
+
+@pytest.mark.asyncio
+async def test_repeated_search_skips_the_db_until_corpus_changes(retrieval_cache, corpus_version):
+    pool = CountingPool()
+    manager = DocumentManager(pool)
+    query = np.ones(768, dtype=np.float32)
+
+    assert await manager.search_similar_chunks(query) == [(7, "chunk")]
+    assert await manager.search_similar_chunks(query) == [(7, "chunk")]
+    assert pool.conn.fetches == 1
+
+    # A write by another process (the Vercel app, a worker) only moves the counter in Postgres
+    corpus_version.bump()
+    await manager.search_similar_chunks(query)
+    assert pool.conn.fetches == 2
+    assert retrieval_cache.stats()["corpus_version"] == 1
+
+@pytest.mark.asyncio
+async def test_version_reads_are_reused_until_max_age_or_a_local_write(corpus_version):
+    corpus_version.max_age = 60
+    assert await corpus_version.current(None) == 0
+    corpus_version.bump()
+    assert await corpus_version.current(None) == 0
+    assert corpus_version.reads == 1
+
+    # This process's own writes are seen at once
+    await notify_corpus_change("insert")
+    assert await corpus_version.current(None) == 1
+    assert corpus_version.reads == 2
+
+@pytest.mark.asyncio
+async def test_version_is_the_sum_of_the_counter_slots_in_postgres():
+    class VersionConn:
+        query = None
+        async def fetchval(self, query, *args):
+            VersionConn.query = query
+            return 7
+
+    class VersionPool(CountingPool):
+        def __init__(self):
+            self.conn = VersionConn()
+
+    assert await CorpusVersion(max_age=0).current(VersionPool()) == 7
+    assert VersionConn.query == "SELECT COALESCE(SUM(version), 0) FROM corpus_version"
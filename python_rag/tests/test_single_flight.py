@@ -0,0 +1,62 @@
+import asyncio
+import pytest
+
+from utils.single_flight import SingleFlight
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_execution():
+    flight = SingleFlight("test")
+    executions = 0
+
+    async def work():
+        nonlocal executions
+        executions += 1
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    results = await asyncio.gather(*[flight.do("q", work, label="what is rag?") for _ in range(5)])
+    assert results == ["answer"] * 5
+    assert executions == 1
+    stats = flight.stats()
+    assert stats["coalesced"] == 4
+    assert stats["top_coalesced_keys"] == {"what is rag?": 4}
+    assert stats["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_sequential_calls_are_not_cached():
+    flight = SingleFlight("test")
+    executions = 0
+
+    async def work():
+        nonlocal executions
+        executions += 1
+        return executions
+
+    assert await flight.do("q", work) == 1
+    assert await flight.do("q", work) == 2
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_waiter_and_clear_the_key():
+    flight = SingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(*[flight.do("q", fail) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert flight.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_shared_work():
+    flight = SingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    first = asyncio.create_task(flight.do("q", work))
+    second = asyncio.create_task(flight.do("q", work))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == "done"
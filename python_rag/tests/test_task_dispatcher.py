@@ -0,0 +1,92 @@
+import asyncio
+import pytest
+
+from utils.task_dispatcher import TaskDispatcher
+
+@pytest.mark.asyncio
+async def test_runs_at_most_limit_tasks_and_submit_does_not_wait_for_them():
+    dispatcher = TaskDispatcher("test", limit=2, max_queued=10)
+    release = asyncio.Event()
+    running = []
+
+    async def work(index):
+        running.append(index)
+        await release.wait()
+
+    for index in range(5):
+        await dispatcher.submit(work, index)
+    await asyncio.sleep(0)
+
+    assert running == [0, 1]
+    assert dispatcher.stats()["in_flight"] == 2
+    assert dispatcher.stats()["queued"] == 3
+
+    release.set()
+    assert await dispatcher.drain(timeout=1) == 0
+    assert dispatcher.stats()["completed"] == 5
+    assert dispatcher.stats()["in_flight"] == dispatcher.stats()["queued"] == 0
+
+@pytest.mark.asyncio
+async def test_submit_waits_when_the_queue_is_full():
+    dispatcher = TaskDispatcher("test", limit=1, max_queued=1)
+    release = asyncio.Event()
+
+    async def work():
+        await release.wait()
+
+    await dispatcher.submit(work)
+    await dispatcher.submit(work)
+    assert dispatcher.room() == 0
+    blocked = asyncio.create_task(dispatcher.submit(work))
+    await asyncio.sleep(0.01)
+    assert not blocked.done()
+
+    release.set()
+    await asyncio.wait_for(blocked, timeout=1)
+    await dispatcher.drain(timeout=1)
+    assert dispatcher.stats()["completed"] == 3
+
+@pytest.mark.asyncio
+async def test_slow_class_does_not_hold_up_the_other():
+    ingest = TaskDispatcher("ingest", limit=1, max_queued=10)
+    query = TaskDispatcher("query", limit=4, max_queued=10)
+    done = []
+
+    async def slow_ingest():
+        await asyncio.sleep(0.2)
+        done.append("ingest")
+
+    async def quick_query(index):
+        done.append(f"query {index}")
+
+    await ingest.submit(slow_ingest)
+    await ingest.submit(slow_ingest)
+    for index in range(3):
+        await query.submit(quick_query, index)
+    await asyncio.sleep(0.01)
+
+    assert done == ["query 0", "query 1", "query 2"]
+    await ingest.drain(timeout=1)
+    assert done[-2:] == ["ingest", "ingest"]
+
+@pytest.mark.asyncio
+async def test_drain_refuses_new_work_and_cancels_after_timeout():
+    dispatcher = TaskDispatcher("test", limit=1, max_queued=10)
+    failures = []
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def fail():
+        failures.append(True)
+        raise RuntimeError("boom")
+
+    await dispatcher.submit(fail)
+    await dispatcher.submit(hang)
+    await dispatcher.submit(hang)
+
+    assert await dispatcher.drain(timeout=0.05) == 2
+    with pytest.raises(RuntimeError):
+        await dispatcher.submit(hang)
+    stats = dispatcher.stats()
+    assert (stats["failed"], stats["cancelled"], stats["in_flight"], stats["queued"]) == (1, 2, 0, 0)
@@ -0,0 +1,63 @@
+import pytest
+
+from services.token_chunker import TokenChunker, count_tokens
+from services.text_processor import TextProcessor
+
+TEXT = (
+    "Retrieval works best with focused chunks. Each chunk should fit the model window! "
+    "Otherwise the embedding API silently truncates the input and the tail is lost? "
+    "Supercalifragilisticexpialidocious words are split into several tokens."
+)
+
+@pytest.mark.parametrize("max_tokens,overlap", [(8, 0), (16, 4), (40, 10), (2048, 0)])
+def test_chunks_respect_token_budget(max_tokens, overlap):
+    chunker = TokenChunker(max_tokens, overlap)
+    spans = chunker.chunk_spans(TEXT)
+    assert spans[0][0] == 0
+    assert spans[-1][1] == len(TEXT)
+    for start, end in spans:
+        assert chunker.count_tokens(TEXT[start:end]) <= max_tokens
+
+def test_chunks_cover_text_without_gaps():
+    spans = TokenChunker(10).chunk_spans(TEXT)
+    for (_, previous_end), (start, _) in zip(spans, spans[1:]):
+        assert TEXT[previous_end:start].strip() == ""
+
+def test_overlap_repeats_whole_words():
+    text = " ".join(f"w{i}" for i in range(100))
+    spans = TokenChunker(12, 4).chunk_spans(text)
+    for (_, previous_end), (start, _) in zip(spans, spans[1:]):
+        assert start < previous_end
+        assert text[start - 1] == " "
+
+def test_prefers_sentence_boundaries():
+    chunks = TokenChunker(12).chunks(TEXT)
+    assert chunks[0] == "Retrieval works best with focused chunks."
+
+def test_single_chunk_for_short_text():
+    assert TokenChunker().chunks("short text") == ["short text"]
+    assert TokenChunker().chunks("") == []
+
+def test_invalid_overlap_is_rejected():
+    with pytest.raises(ValueError):
+        TokenChunker(10, 10)
+
+def test_cjk_characters_and_digits_count_one_token_each():
+    assert count_tokens("日本語のテキスト") == 8
+    assert count_tokens("20241018") == 8
+    assert count_tokens("tokenizer") == 3
+
+def test_unspaced_cjk_chunks_respect_token_budget():
+    text = "検索拡張生成は文書を小さな断片に分割する。" * 40
+    chunker = TokenChunker(64)
+    for chunk in chunker.chunks(text):
+        assert count_tokens(chunk) <= 64
+
+def test_character_chunks_are_split_to_fit_the_model_window(monkeypatch):
+    import services.text_processor as text_processor
+    monkeypatch.setattr(text_processor, "EMBEDDING_MAX_TOKENS", 100)
+    processor = TextProcessor(max_chunk_size=500)
+    # One "word" of 1000 characters: word-based chunking cannot split it
+    chunks = processor.chunk("短い文。 " + "長" * 1000)
+    assert "".join(chunks).replace(" ", "") == ("短い文。" + "長" * 1000)
+    assert all(count_tokens(chunk) <= 100 for chunk in chunks)
@@ -0,0 +1,49 @@
+import struct
+import numpy as np
+import pytest
+from unittest.mock import AsyncMock
+
+from db.vector_codec import encode_vector, decode_vector, register_vector_codec, to_vector_array
+
+def test_encode_vector_matches_pgvector_wire_format():
+    payload = encode_vector([1.0, -2.5, 0.25])
+    assert payload == struct.pack('>HH3f', 3, 0, 1.0, -2.5, 0.25)
+
+def test_round_trip_preserves_float32_values():
+    embedding = np.random.default_rng(1).standard_normal(768).astype(np.float32)
+    decoded = decode_vector(encode_vector(embedding))
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, embedding)
+
+def test_encode_vector_rejects_matrices():
+    with pytest.raises(ValueError):
+        encode_vector(np.zeros((2, 3)))
+
+def test_to_vector_array_accepts_lists():
+    array = to_vector_array([0.1, 0.2])
+    assert array.dtype == np.float32
+    assert array.flags['C_CONTIGUOUS']
+
+@pytest.mark.asyncio
+async def test_register_vector_codec_uses_binary_format():
+    conn = AsyncMock()
+    conn.fetchval.return_value = 'public'
+    await register_vector_codec(conn)
+    conn.set_type_codec.assert_awaited_once()
+    args, kwargs = conn.set_type_codec.await_args
+    assert args == ('vector',)
+    assert kwargs['format'] == 'binary'
+
+@pytest.mark.asyncio
+async def test_register_vector_codec_follows_the_extension_schema():
+    conn = AsyncMock()
+    conn.fetchval.return_value = 'extensions'
+    await register_vector_codec(conn)
+    assert conn.set_type_codec.await_args.kwargs['schema'] == 'extensions'
+
+@pytest.mark.asyncio
+async def test_register_vector_codec_skips_when_pgvector_is_missing():
+    conn = AsyncMock()
+    conn.fetchval.return_value = None
+    await register_vector_codec(conn)
+    conn.set_type_codec.assert_not_awaited()
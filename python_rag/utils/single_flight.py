@@ -0,0 +1,60 @@
+import asyncio
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Per-key counters kept for reporting; the least coalesced keys are dropped beyond this
+MAX_TRACKED_KEYS = 1000
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: the first caller for a key starts the
+    work, later callers for the same key await the same task instead of
+    repeating it. Nothing is cached once the task finishes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self._coalesced_by_key: Counter = Counter()
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[T]], label: Optional[str] = None) -> T:
+        """Run func for key, or join the call already in flight for it"""
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _, key=key: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+            self._count(label if label is not None else str(key))
+        # Shield so one cancelled caller does not cancel the work for the others
+        return await asyncio.shield(task)
+
+    def _count(self, label: str) -> None:
+        self._coalesced_by_key[label[:100]] += 1
+        if len(self._coalesced_by_key) > MAX_TRACKED_KEYS:
+            self._coalesced_by_key = Counter(dict(self._coalesced_by_key.most_common(MAX_TRACKED_KEYS // 2)))
+
+    def stats(self, top: int = 10) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+            "top_coalesced_keys": dict(self._coalesced_by_key.most_common(top))
+        }
+
+# Query path: embedding, retrieval and answer generation
+query_embedding_flight = SingleFlight("query_embedding")
+retrieval_flight = SingleFlight("retrieval")
+answer_flight = SingleFlight("answer")
+
+def get_single_flight_stats() -> Dict[str, Dict[str, Any]]:
+    return {flight.name: flight.stats() for flight in (query_embedding_flight, retrieval_flight, answer_flight)}
@@ -0,0 +1,106 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+from utils.logger import logger
+
+class TaskDispatcher:
+    """
+    Runs submitted coroutines as tasks, at most `limit` at a time.
+
+    `submit` returns as soon as the work is queued, so a message loop can keep
+    reading while earlier messages are processed. It only waits when `limit`
+    tasks are running and `max_queued` more are waiting for a slot, which
+    pushes back on the reader. Handlers are expected to report their own
+    errors; anything that escapes is logged and counted. `drain` stops new
+    submissions and waits for everything queued or running.
+    """
+
+    def __init__(self, name: str, limit: int, max_queued: int):
+        self.name = name
+        self.limit = limit
+        self.max_queued = max_queued
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.draining = False
+        self._tasks: Set[asyncio.Task] = set()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._admitted: Optional[asyncio.Semaphore] = None
+        self._loop = None
+
+    def _primitives(self) -> Tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        # Module-level dispatchers outlive event loops (tests, asyncio.run), so bind to the running one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._slots = asyncio.Semaphore(self.limit)
+            self._admitted = asyncio.Semaphore(self.limit + self.max_queued)
+            self._loop = loop
+        return self._slots, self._admitted
+
+    def room(self) -> int:
+        """How many more submissions fit without waiting"""
+        return max(0, self.limit + self.max_queued - self.in_flight - self.queued)
+
+    async def submit(self, func: Callable[..., Awaitable[Any]], *args) -> asyncio.Task:
+        """Queue func(*args); returns its task"""
+        if self.draining:
+            raise RuntimeError(f"{self.name} dispatcher is draining")
+        _, admitted = self._primitives()
+        await admitted.acquire()
+        self.queued += 1
+        task = asyncio.create_task(self._run(func, args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, func: Callable[..., Awaitable[Any]], args: tuple) -> None:
+        slots, admitted = self._primitives()
+        started = False
+        try:
+            async with slots:
+                started = True
+                self.queued -= 1
+                self.in_flight += 1
+                try:
+                    await func(*args)
+                    self.completed += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"{self.name} task failed: {e}")
+                finally:
+                    self.in_flight -= 1
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            if not started:
+                self.queued -= 1
+            admitted.release()
+
+    async def drain(self, timeout: float) -> int:
+        """Refuse new work and wait up to timeout for queued and running tasks; returns how many were cancelled"""
+        self.draining = True
+        pending = set(self._tasks)
+        if not pending:
+            return 0
+        logger.info(f"Draining {len(pending)} {self.name} tasks ({self.in_flight} running, {self.queued} queued)")
+        _, unfinished = await asyncio.wait(pending, timeout=timeout)
+        for task in unfinished:
+            task.cancel()
+        if unfinished:
+            await asyncio.gather(*unfinished, return_exceptions=True)
+            logger.warn(f"Cancelled {len(unfinished)} {self.name} tasks still running after {timeout:.0f}s")
+        return len(unfinished)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "max_queued": self.max_queued,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "draining": self.draining
+        }
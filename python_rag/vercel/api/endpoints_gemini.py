@@ -7,8 +7,13 @@ from services.embedding_gemini import (
     get_cache_stats
 )
 from services.batch_processor import process_embeddings_batch
+from services.rate_limiter import embedding_limiter
 from services.text_processor import TextProcessor
+from services.context_packer import context_packer
+from services.admission import INGEST, QUERY, Overloaded, Ticket, get_admission_controller
 from db.database import get_db_pool, get_db_conn_with_retry
+from db.vector_codec import to_vector_array
+from config import ADMISSION_TENANT_HEADER
 import asyncio
 import time
 from dotenv import load_dotenv
@@ -18,11 +23,28 @@ load_dotenv()
 router = APIRouter()
 text_processor = TextProcessor()
 
+# Above this many rows a binary COPY beats executemany round trips
+COPY_THRESHOLD_ROWS = 500
+
 async def get_database():
     return await get_db_pool()
 
+def _tenant(request: Request) -> str:
+    """Caller identity for per-tenant admission limits: the trusted tenant header if configured, else the client address"""
+    if ADMISSION_TENANT_HEADER and request.headers.get(ADMISSION_TENANT_HEADER):
+        return request.headers[ADMISSION_TENANT_HEADER]
+    return request.client.host if request.client else "anonymous"
+
+async def _admit(request: Request, request_class: str) -> Ticket:
+    """Admission slot for this request, or an immediate 429/503 with a Retry-After hint"""
+    try:
+        return await get_admission_controller().acquire(request_class, tenant=_tenant(request))
+    except Overloaded as e:
+        print(f"🚦 Rejected {request_class} ({e.status_code}): {e.reason}")
+        raise HTTPException(status_code=e.status_code, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
 @router.post("/ingest/", response_class=JSONResponse)
-async def ingest(file: UploadFile = File(...)):
+async def ingest(request: Request, file: UploadFile = File(...)):
     """
     FAST ingestion - no table creation overhead
     """
@@ -46,6 +68,8 @@ async def ingest(file: UploadFile = File(...)):
     
     print(f"📁 File size: {len(content)} bytes")
     
+    # Turned away up front when busy, rather than timing out halfway through
+    ticket = await _admit(request, INGEST)
     try:
         # Extract text and chunk with dynamic parameters
         text, chunks = await text_processor.process_file_content(file.filename, content)
@@ -53,22 +77,16 @@ async def ingest(file: UploadFile = File(...)):
         print(f"📝 Extracted text length: {len(text)} characters")
 
         # Get the dynamic parameters used for logging
-        chunk_size, overlap = text_processor.get_dynamic_chunk_params(len(content))
+        max_tokens, overlap_tokens = text_processor.get_dynamic_token_params(len(content))
         content_size_kb = len(content) / 1024
-        print(f"📏 File size: {content_size_kb:.1f}KB - using chunk size: {chunk_size} chars, overlap: {overlap}")
+        print(f"📏 File size: {content_size_kb:.1f}KB - using chunk budget: {max_tokens} tokens, overlap: {overlap_tokens}")
         print(f"🧩 Created {len(chunks)} chunks")
         
         # FAST: Serverless-optimized concurrent embedding generation
         embedding_start = time.time()
         
-        # Use larger batch size for better performance
-        optimal_batch_size = min(100, max(20, len(chunks) // 10))
-        print(f"🔄 Using batch size: {optimal_batch_size} for {len(chunks)} chunks")
-        
-        chunk_embedding_pairs = await process_embeddings_batch(
-            chunks, 
-            batch_size=optimal_batch_size
-        )
+        # Concurrency adapts to the API quota inside the batch processor
+        chunk_embedding_pairs = await process_embeddings_batch(chunks)
         embedding_time = time.time() - embedding_start
         print(f"✅ Generated {len(chunk_embedding_pairs)} embeddings in {embedding_time:.2f}s")
         
@@ -80,13 +98,21 @@ async def ingest(file: UploadFile = File(...)):
             async with get_db_conn_with_retry(get_db_pool) as conn:
                 try:
                     batch_data = [
-                        (chunk, "[" + ",".join(str(x) for x in embedding) + "]")
+                        (chunk, to_vector_array(embedding))
                         for chunk, embedding in chunk_embedding_pairs
                     ]
-                    await conn.executemany(
-                        "INSERT INTO documents (content, embedding) VALUES ($1, $2)",
-                        batch_data
-                    )
+                    if len(batch_data) >= COPY_THRESHOLD_ROWS:
+                        # Binary COPY streams every row in a single round trip
+                        await conn.copy_records_to_table(
+                            'documents',
+                            records=batch_data,
+                            columns=['content', 'embedding']
+                        )
+                    else:
+                        await conn.executemany(
+                            "INSERT INTO documents (content, embedding) VALUES ($1, $2)",
+                            batch_data
+                        )
                     print(f"🚀 FAST batch inserted {len(batch_data)} documents")
                 except Exception as e:
                     print(f"❌ Error during batch insert: {str(e)}")
@@ -98,6 +124,8 @@ async def ingest(file: UploadFile = File(...)):
         
         print(f"🎉 FAST ingestion completed in {total_time:.2f}s!")
         print(f"   📊 Embedding: {embedding_time:.2f}s, DB: {db_time:.2f}s")
+        if processed_count and db_time > 0:
+            print(f"   💾 DB throughput: {processed_count / db_time:.1f} rows/s")
         
         return {
             "status": "success",
@@ -113,9 +141,11 @@ async def ingest(file: UploadFile = File(...)):
     except Exception as e:
         print(f"❌ Error during ingestion: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+    finally:
+        ticket.release()
 
 @router.post("/query/", response_model=QueryResponse)
-async def query(query_request: QueryRequest):
+async def query(request: Request, query_request: QueryRequest):
     """
     Serverless-optimized query with timeout handling
     """
@@ -125,6 +155,9 @@ async def query(query_request: QueryRequest):
     if not question or not question.strip():
         raise HTTPException(status_code=400, detail="Question cannot be empty.")
     
+    # Fast 429/503 + Retry-After when queries are already queued past the SLO,
+    # instead of waiting out the 45-120s timeouts below
+    ticket = await _admit(request, QUERY)
     try:
         # Generate query embedding with timeout
         print(f"🔍 Generating embedding for query: {question[:50]}...")
@@ -139,7 +172,7 @@ async def query(query_request: QueryRequest):
         
         # Search database with timeout
         search_start = time.time()
-        embedding_str = "[" + ",".join([str(x) for x in query_embedding]) + "]"
+        query_vector = to_vector_array(query_embedding)
         
         print(f"🔍 Searching database for similar documents...")
         try:
@@ -149,11 +182,12 @@ async def query(query_request: QueryRequest):
             async def database_search():
                 async with get_db_conn_with_retry(get_db_pool) as conn:
                     print(f"✅ Database connection acquired, executing query...")
+                    # <=> matches the vector_cosine_ops index the main service maintains on this table
                     return await conn.fetch("""
-                        SELECT content FROM documents
-                        ORDER BY embedding <-> $1::vector
+                        SELECT id, content FROM documents
+                        ORDER BY embedding <=> $1::vector
                         LIMIT 5
-                    """, embedding_str)
+                    """, query_vector)
             
             rows = await asyncio.wait_for(
                 database_search(),
@@ -171,7 +205,11 @@ async def query(query_request: QueryRequest):
         print(f"📊 Database search completed in {search_time:.2f}s, found {len(rows)} results")
         
         # Generate answer with timeout
-        context = " ".join([r["content"] for r in rows]) if rows else ""
+        # Stitch overlapping chunks, drop near-duplicates and keep within CONTEXT_TOKEN_BUDGET
+        packed = context_packer.pack([(r["id"], r["content"]) for r in rows])
+        context = packed.text
+        if rows:
+            print(f"🧩 Context: {packed.stats['tokens_out']} tokens ({packed.stats['tokens_saved']} saved)")
         
         if context:
             answer_start = time.time()
@@ -195,6 +233,8 @@ async def query(query_request: QueryRequest):
     except Exception as e:
         print(f"❌ Query error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Query processing failed: {str(e)}")
+    finally:
+        ticket.release()
 
 @router.delete("/clear-documents/", response_class=JSONResponse)
 async def clear_all_documents(request: Request):
@@ -232,4 +272,14 @@ async def clear_all_documents(request: Request):
 @router.get("/cache-info/")
 async def cache_info():
     """Get cache statistics for monitoring"""
-    return get_cache_stats()
\ No newline at end of file
+    return {**get_cache_stats(), "context_packing": context_packer.stats()}
+
+@router.get("/admission/")
+async def admission_info():
+    """Running and waiting requests per class, service times and 429/503 rejections"""
+    return get_admission_controller().stats()
+
+@router.get("/embedding-limiter/")
+async def embedding_limiter_info():
+    """Current adaptive concurrency limit, in-flight requests and throttle events"""
+    return embedding_limiter.stats()
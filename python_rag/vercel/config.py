@@ -10,4 +10,26 @@ DB_HOST = os.getenv("DB_HOST", "aws-0-us-east-2.pooler.supabase.com")
 DB_PORT = os.getenv("DB_PORT", "6543")
 
 # AI Model Configuration
-GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
\ No newline at end of file
+GEMINI_API_KEY = os.getenv('GEMINI_API_KEY', '')
+# Input window of the embedding model (text-embedding-004)
+EMBEDDING_MAX_TOKENS = int(os.getenv('EMBEDDING_MAX_TOKENS', '2048'))
+# Embedding requests in flight: the adaptive limiter starts at the initial value
+# and grows up to the maximum while the API responds without throttling
+EMBEDDING_INITIAL_CONCURRENCY = int(os.getenv('EMBEDDING_INITIAL_CONCURRENCY', '8'))
+EMBEDDING_MAX_CONCURRENT_REQUESTS = int(os.getenv('EMBEDDING_MAX_CONCURRENT_REQUESTS', '50'))
+# Context packing: merged, de-duplicated chunks are packed best-first into at most this many
+# prompt tokens; chunks overlapping by at least CONTEXT_MIN_OVERLAP_CHARS are stitched together
+CONTEXT_TOKEN_BUDGET = int(os.getenv('CONTEXT_TOKEN_BUDGET', '3000'))
+CONTEXT_DEDUP_SIMILARITY = float(os.getenv('CONTEXT_DEDUP_SIMILARITY', '0.85'))
+CONTEXT_MIN_OVERLAP_CHARS = int(os.getenv('CONTEXT_MIN_OVERLAP_CHARS', '20'))
+# Admission control: at most ADMISSION_CAPACITY requests run at once per instance,
+# ADMISSION_QUERY_RESERVE of them only for queries. Requests that would queue longer than
+# their SLO (seconds) get 503 + Retry-After; a tenant over ADMISSION_TENANT_LIMIT gets 429
+ADMISSION_CAPACITY = int(os.getenv('ADMISSION_CAPACITY', '10'))
+ADMISSION_QUERY_RESERVE = int(os.getenv('ADMISSION_QUERY_RESERVE', '8'))
+ADMISSION_QUERY_SLO = float(os.getenv('ADMISSION_QUERY_SLO', '5'))
+ADMISSION_INGEST_SLO = float(os.getenv('ADMISSION_INGEST_SLO', '30'))
+ADMISSION_TENANT_LIMIT = int(os.getenv('ADMISSION_TENANT_LIMIT', '8'))
+# Tenants are keyed by client address. Name a header here (e.g. X-Tenant-ID) only when a trusted
+# gateway sets it after authenticating the caller; clients could otherwise pick any tenant
+ADMISSION_TENANT_HEADER = os.getenv('ADMISSION_TENANT_HEADER', '')
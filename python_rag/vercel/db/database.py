@@ -2,6 +2,7 @@ import asyncpg
 import asyncio
 import contextlib
 from config import DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+from db.vector_codec import register_vector_codec
 
 async def get_db_pool():
     """Always create a new pool for serverless safety"""
@@ -14,7 +15,8 @@ async def get_db_pool():
         min_size=1,
         max_size=10,
         statement_cache_size=0,
-        command_timeout=60
+        command_timeout=60,
+        init=register_vector_codec
     )
 
 @contextlib.asynccontextmanager
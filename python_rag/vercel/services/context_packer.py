@@ -0,0 +1,186 @@
+import re
+import threading
+from typing import Dict, FrozenSet, List, Tuple
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_DEDUP_SIMILARITY, CONTEXT_MIN_OVERLAP_CHARS
+from .token_chunker import TokenChunker, count_tokens
+
+Chunks = List[Tuple[int, str]]
+
+# Word n-gram length for near-duplicate detection
+SHINGLE_SIZE = 3
+# Passages are separated by a blank line in the prompt (whitespace costs no tokens)
+SEPARATOR = "\n\n"
+
+def _shingles(text: str) -> FrozenSet[int]:
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < SHINGLE_SIZE:
+        return frozenset([hash(tuple(words))]) if words else frozenset()
+    return frozenset(hash(tuple(words[i:i + SHINGLE_SIZE])) for i in range(len(words) - SHINGLE_SIZE + 1))
+
+def _overlap(left: str, right: str, min_chars: int) -> int:
+    """Length of the longest suffix of left that is a prefix of right, if at least min_chars"""
+    probe = right[:min_chars]
+    if len(probe) < min_chars:
+        return 0
+    # Earliest match first, so the first full match is the longest overlap
+    position = left.find(probe, max(0, len(left) - len(right)))
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(probe, position + 1)
+    return 0
+
+class _Passage:
+    """One or more retrieved chunks that became a single piece of context"""
+
+    __slots__ = ("rank", "ids", "text", "shingles")
+
+    def __init__(self, rank: int, chunk_id: int, text: str):
+        self.rank = rank
+        self.ids = [chunk_id]
+        self.text = text
+        self.shingles = _shingles(text)
+
+class PackedContext:
+    """Prompt context, the chunk ids that made it in, and packing statistics"""
+
+    def __init__(self, text: str, chunk_ids: List[int], stats: Dict):
+        self.text = text
+        self.chunk_ids = chunk_ids
+        self.stats = stats
+
+class ContextPacker:
+    """
+    Turns retrieved (id, content) chunks, best first, into prompt context.
+
+    Sliding-window chunks repeat the end of their predecessor, and the same
+    passage is often stored more than once, so before packing:
+      - near-duplicates (word-shingle containment >= `similarity`) collapse
+        into the longer text, at the better of the two ranks;
+      - chunks where one's suffix is the other's prefix (at least
+        `min_overlap` characters) are stitched into one span.
+    Passages are then taken in rank order while they fit `token_budget`;
+    the best one is cut at a sentence or word boundary if it alone is too
+    big. Chunks with consecutive ids that both make it in are written next
+    to each other in id order, as they were in the source document.
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, similarity: float = CONTEXT_DEDUP_SIMILARITY,
+                 min_overlap: int = CONTEXT_MIN_OVERLAP_CHARS):
+        self.token_budget = token_budget
+        self.similarity = similarity
+        self.min_overlap = min_overlap
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def _deduplicate(self, passages: List[_Passage]) -> int:
+        kept: List[_Passage] = []
+        for passage in passages:
+            duplicate = None
+            for other in kept:
+                smaller = min(len(passage.shingles), len(other.shingles))
+                if smaller and len(passage.shingles & other.shingles) / smaller >= self.similarity:
+                    duplicate = other
+                    break
+            if duplicate is None:
+                kept.append(passage)
+            elif len(passage.text) > len(duplicate.text):
+                # Lower-ranked but longer: it covers the earlier one, so keep its text
+                duplicate.text, duplicate.shingles = passage.text, passage.shingles
+                duplicate.ids.extend(passage.ids)
+            else:
+                duplicate.ids.extend(passage.ids)
+        removed = len(passages) - len(kept)
+        passages[:] = kept
+        return removed
+
+    def _merge_overlaps(self, passages: List[_Passage]) -> int:
+        merged = 0
+        changed = True
+        while changed:
+            changed = False
+            for left in passages:
+                for right in passages:
+                    if left is right:
+                        continue
+                    overlap = _overlap(left.text, right.text, self.min_overlap)
+                    if overlap:
+                        left.text += right.text[overlap:]
+                        left.rank = min(left.rank, right.rank)
+                        left.ids.extend(right.ids)
+                        passages.remove(right)
+                        merged += 1
+                        changed = True
+                        break
+                if changed:
+                    break
+        return merged
+
+    def _pack(self, passages: List[_Passage]) -> Tuple[List[_Passage], int, bool]:
+        packed: List[_Passage] = []
+        used = 0
+        truncated = False
+        for passage in sorted(passages, key=lambda p: p.rank):
+            tokens = count_tokens(passage.text)
+            if used + tokens <= self.token_budget:
+                packed.append(passage)
+                used += tokens
+            elif not packed:
+                start, end = TokenChunker(max_tokens=self.token_budget).chunk_spans(passage.text)[0]
+                passage.text = passage.text[start:end]
+                packed.append(passage)
+                used = count_tokens(passage.text)
+                truncated = True
+        return packed, len(passages) - len(packed), truncated
+
+    @staticmethod
+    def _order(packed: List[_Passage]) -> List[_Passage]:
+        """Rank order, except that runs of consecutive chunk ids sit together in id order"""
+        runs: List[List[_Passage]] = []
+        for passage in sorted(packed, key=lambda p: min(p.ids)):
+            if runs and min(passage.ids) == max(runs[-1][-1].ids) + 1:
+                runs[-1].append(passage)
+            else:
+                runs.append([passage])
+        runs.sort(key=lambda run: min(p.rank for p in run))
+        return [passage for run in runs for passage in run]
+
+    def pack(self, chunks: Chunks) -> PackedContext:
+        passages = [_Passage(rank, chunk_id, content) for rank, (chunk_id, content) in enumerate(chunks) if content.strip()]
+        duplicates = self._deduplicate(passages)
+        merged = self._merge_overlaps(passages)
+        packed, over_budget, truncated = self._pack(passages)
+        ordered = self._order(packed)
+        text = SEPARATOR.join(passage.text for passage in ordered)
+
+        tokens_in = count_tokens(" ".join(content for _, content in chunks))
+        tokens_out = count_tokens(text)
+        with self._lock:
+            self.calls += 1
+            self.tokens_in += tokens_in
+            self.tokens_out += tokens_out
+        return PackedContext(text, [chunk_id for passage in ordered for chunk_id in passage.ids], {
+            "chunks": len(chunks),
+            "passages": len(ordered),
+            "duplicates_removed": duplicates,
+            "overlaps_merged": merged,
+            "over_budget": over_budget,
+            "truncated": truncated,
+            "tokens_in": tokens_in,
+            "tokens_out": tokens_out,
+            "tokens_saved": tokens_in - tokens_out
+        })
+
+    def stats(self) -> Dict:
+        return {
+            "token_budget": self.token_budget,
+            "calls": self.calls,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "tokens_saved": self.tokens_in - self.tokens_out,
+            "saved_ratio": round(1 - self.tokens_out / self.tokens_in, 4) if self.tokens_in else 0.0
+        }
+
+context_packer = ContextPacker()
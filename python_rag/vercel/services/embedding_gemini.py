@@ -3,6 +3,7 @@ import asyncio
 import google.generativeai as genai
 # from async_lru import alru_cache
 from config import GEMINI_API_KEY
+from .rate_limiter import call_with_retry, embedding_limiter
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -20,15 +21,12 @@ async def _generate_embedding_api_call(text: str, task_type: str):
         )
         return result['embedding']
     except Exception as e:
+        # Raise on quota errors too, so the rate limiter can back off and retry
         error_str = str(e)
         if "429" in error_str or "quota" in error_str.lower():
             print("❌ Gemini API quota exceeded.")
-            return (
-                "Error: Gemini API quota exceeded. "
-                "Please check your plan and billing details. "
-                "See: https://ai.google.dev/gemini-api/docs/rate-limits"
-            )
-        print(f"❌ Embedding API error: {e}")
+        else:
+            print(f"❌ Embedding API error: {e}")
         raise
 
 # Public functions
@@ -39,7 +37,10 @@ async def generate_document_embedding_gemini(text: str):
 async def generate_query_embedding_gemini(text: str):
     """Generate query embedding"""
     print(f"🔍 Processing query embedding")
-    return await _generate_embedding_api_call(text, "retrieval_query")
+    return await call_with_retry(
+        embedding_limiter,
+        lambda: _generate_embedding_api_call(text, "retrieval_query")
+    )
 
 # @alru_cache(maxsize=128)
 async def get_answer_gemini(question: str, context: str):
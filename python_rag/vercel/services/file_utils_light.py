@@ -1,24 +1,28 @@
 from fastapi import UploadFile, HTTPException
 import re
 
+# Control characters PostgreSQL/UTF-8 text should not carry (tab, newline and CR are kept as whitespace)
+_CONTROL_CHARS = '\x00-\x08\x0b\x0c\x0e-\x1f'
+_CONTROL_CHARS_TABLE = dict.fromkeys(range(0x20))
+for _kept in '\t\n\r':
+    del _CONTROL_CHARS_TABLE[ord(_kept)]
+_CONTROL_CHARS_RE = re.compile(f'[{_CONTROL_CHARS}]+')
+
 def clean_text_for_db(text: str) -> str:
     """Optimized text cleaning for PostgreSQL UTF-8"""
     if not text:
         return ""
     
-    # Use translate for faster character removal (much faster than multiple replace calls)
-    # Create translation table to remove problematic characters
-    chars_to_remove = '\x00\x08\x0b\x0c\x0e\x0f'
-    translation_table = str.maketrans('', '', chars_to_remove)
-    text = text.translate(translation_table)
-    
-    # Remove control characters in one pass (faster than char-by-char)
-    text = ''.join(char for char in text if ord(char) >= 32 or char in '\t\n\r')
-    
-    # Normalize whitespace once
-    text = re.sub(r'\s+', ' ', text)
+    # Drop control characters: translate is fastest on ASCII strings, the
+    # precompiled regex avoids per-character table lookups on everything else
+    if text.isascii():
+        text = text.translate(_CONTROL_CHARS_TABLE)
+    else:
+        text = _CONTROL_CHARS_RE.sub('', text)
     
-    return text.strip()
+    # split() breaks on runs of whitespace and drops the ends, so joining
+    # normalizes and strips in one C-level pass
+    return ' '.join(text.split())
 
 async def extract_text_from_file(file: UploadFile, content: bytes) -> str:
     filename = file.filename.lower()
@@ -60,13 +64,14 @@ def fast_sentence_split(text: str) -> list[str]:
     # Filter empty sentences in one pass
     return [s.strip() for s in sentences if len(s.strip()) > 10]  # Min length filter
 
-def chunk_text(text: str, max_chunk_size: int = 500) -> list[str]:
+def chunk_text(text: str, max_chunk_size: int = 500, pre_cleaned: bool = False) -> list[str]:
     """Optimized chunking - prioritizes speed over perfect sentence boundaries"""
     if not text:
         return []
     
-    # Clean text once
-    text = clean_text_for_db(text)
+    # Clean text once (skipped when the caller already passed it through clean_text_for_db)
+    if not pre_cleaned:
+        text = clean_text_for_db(text)
     
     # For short texts, return as single chunk
     if len(text) <= max_chunk_size:
@@ -97,12 +102,13 @@ def chunk_text(text: str, max_chunk_size: int = 500) -> list[str]:
     
     return chunks
 
-def chunk_text_sliding_window(text: str, chunk_size: int = 500, overlap: int = 50) -> list[str]:
+def chunk_text_sliding_window(text: str, chunk_size: int = 500, overlap: int = 50, pre_cleaned: bool = False) -> list[str]:
     """Alternative: Sliding window chunking for better context preservation"""
     if not text:
         return []
     
-    text = clean_text_for_db(text)
+    if not pre_cleaned:
+        text = clean_text_for_db(text)
     
     if len(text) <= chunk_size:
         return [text] if text.strip() else []
@@ -130,7 +136,7 @@ def chunk_text_sliding_window(text: str, chunk_size: int = 500, overlap: int = 5
     return chunks
 
 # Fast utility function for very large texts
-def quick_chunk_by_lines(text: str, max_lines: int = 10) -> list[str]:
+def quick_chunk_by_lines(text: str, max_lines: int = 10, pre_cleaned: bool = False) -> list[str]:
     """Emergency fast chunking for very large documents"""
     if not text:
         return []
@@ -142,6 +148,6 @@ def quick_chunk_by_lines(text: str, max_lines: int = 10) -> list[str]:
         chunk_lines = lines[i:i + max_lines]
         chunk = '\n'.join(line.strip() for line in chunk_lines if line.strip())
         if chunk:
-            chunks.append(clean_text_for_db(chunk))
+            chunks.append(chunk if pre_cleaned else clean_text_for_db(chunk))
     
     return chunks
\ No newline at end of file
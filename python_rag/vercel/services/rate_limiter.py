@@ -0,0 +1,144 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, TypeVar
+from google.api_core import exceptions as google_exceptions
+from config import EMBEDDING_INITIAL_CONCURRENCY, EMBEDDING_MAX_CONCURRENT_REQUESTS
+
+T = TypeVar("T")
+
+_RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# What the Gemini SDK raises for throttling, transient server errors and server-side timeouts
+_RETRYABLE_TYPES = (
+    asyncio.TimeoutError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.BadGateway,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.GatewayTimeout,
+    google_exceptions.DeadlineExceeded,
+)
+
+def is_retryable_error(error: BaseException) -> bool:
+    """True for throttling (429), transient server errors (5xx) and timeouts"""
+    if isinstance(error, _RETRYABLE_TYPES):
+        return True
+    # Other HTTP clients: classify by status code, never by message text
+    status = getattr(error, "code", None) or getattr(error, "status_code", None)
+    return isinstance(status, int) and status in _RETRYABLE_STATUS
+
+class AIMDLimiter:
+    """
+    Additive-increase / multiplicative-decrease concurrency limit.
+
+    Each healthy response (latency under target) grows the limit by roughly one
+    slot per window of completed calls; a throttle (429/5xx/timeout) cuts it by
+    `decrease`. Throttles arriving within `cooldown` seconds of a cut count as
+    the same congestion event, so a burst of concurrent 429s halves only once.
+    """
+
+    def __init__(self, initial_limit: float = 8, min_limit: float = 1, max_limit: float = 64,
+                 decrease: float = 0.5, latency_target: float = 10.0, cooldown: float = 1.0):
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.decrease = decrease
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.waiting = 0
+        self.throttle_events = 0
+        self.successes = 0
+        self._last_decrease = 0.0
+        self._condition = None
+        self._loop = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        # The shared instance outlives event loops (tests, asyncio.run per job),
+        # so bind the condition to whichever loop is running
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+        return self._condition
+
+    async def acquire(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            self.waiting += 1
+            try:
+                await condition.wait_for(lambda: self.in_flight < max(1, int(self.limit)))
+            finally:
+                self.waiting -= 1
+            self.in_flight += 1
+
+    async def release(self) -> None:
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one concurrency slot for the duration of a call"""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release()
+
+    def on_success(self, latency: float) -> None:
+        self.successes += 1
+        if latency <= self.latency_target:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self) -> None:
+        self.throttle_events += 1
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+            self._last_decrease = now
+
+    def stats(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "throttle_events": self.throttle_events,
+            "successes": self.successes
+        }
+
+async def call_with_retry(limiter: AIMDLimiter, func: Callable[[], Awaitable[T]], max_retries: int = 4,
+                          base_delay: float = 0.5, max_delay: float = 20.0, timeout: float = 60.0) -> T:
+    """
+    Run func inside a limiter slot, feeding latency and throttles back to the
+    limiter. Retryable failures are retried with full-jitter exponential
+    backoff; anything else is raised immediately.
+    """
+    attempt = 0
+    while True:
+        async with limiter.slot():
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(func(), timeout=timeout)
+            except Exception as e:
+                if not is_retryable_error(e) or attempt >= max_retries:
+                    raise
+                limiter.on_throttle()
+                error = e
+            else:
+                limiter.on_success(time.monotonic() - start)
+                return result
+        # Back off outside the slot so other callers can use it
+        delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+        print(f"⏳ Retrying after {type(error).__name__} in {delay:.2f}s (attempt {attempt + 1}/{max_retries})")
+        await asyncio.sleep(delay)
+        attempt += 1
+
+# Shared by every embedding caller in this process
+embedding_limiter = AIMDLimiter(
+    initial_limit=EMBEDDING_INITIAL_CONCURRENCY,
+    max_limit=EMBEDDING_MAX_CONCURRENT_REQUESTS
+)
@@ -1,6 +1,8 @@
 # Clean, focused imports for TextProcessor
 from typing import List, Tuple
-from .file_utils_light import extract_text_from_file, chunk_text_sliding_window
+from config import EMBEDDING_MAX_TOKENS
+from .file_utils_light import extract_text_from_file
+from .token_chunker import TokenChunker, CHARS_PER_TOKEN
 
 class TextProcessor:
     """Handle text extraction and chunking operations"""
@@ -35,6 +37,19 @@ class TextProcessor:
         else:  # Very huge files (>3MB)
             return 16000, 1600  # Extreme chunking for sub-60s demo
     
+    def get_dynamic_token_params(self, content_size_bytes: int) -> Tuple[int, int]:
+        """
+        Token budget and overlap per chunk, derived from the character sizes
+        above but capped at the embedding model's input window
+        
+        Returns:
+            Tuple of (max_tokens, overlap_tokens)
+        """
+        chunk_size, overlap = self.get_dynamic_chunk_params(content_size_bytes)
+        max_tokens = min(EMBEDDING_MAX_TOKENS, chunk_size // CHARS_PER_TOKEN)
+        overlap_tokens = min(overlap // CHARS_PER_TOKEN, max_tokens // 2)
+        return max_tokens, overlap_tokens
+    
     async def process_file_content(self, filename: str, file_content: bytes) -> Tuple[str, List[str]]:
         """
         Extract text from file content and chunk it with dynamic parameters
@@ -58,10 +73,10 @@ class TextProcessor:
         if not text or not text.strip():
             raise ValueError("No text extracted from file")
         
-        # Get dynamic chunk parameters based on file size
-        chunk_size, overlap = self.get_dynamic_chunk_params(len(file_content))
+        # Get dynamic token budget based on file size
+        max_tokens, overlap_tokens = self.get_dynamic_token_params(len(file_content))
         
-        # Chunk text with dynamic parameters
-        chunks = chunk_text_sliding_window(text, chunk_size=chunk_size, overlap=overlap)
+        # Chunk on precomputed token offsets so every chunk fits the embedding window
+        chunks = TokenChunker(max_tokens, overlap_tokens).chunks(text)
         
         return text, chunks
\ No newline at end of file
@@ -0,0 +1,114 @@
+import re
+from bisect import bisect_left, bisect_right
+from typing import Iterator, List, Tuple
+
+# text-embedding-004 accepts up to 2048 input tokens
+DEFAULT_MAX_TOKENS = 2048
+# Latin-script words are counted as one token per this many letters, which over- rather
+# than under-estimates subword tokenizers, so chunks never spill past the model window
+CHARS_PER_TOKEN = 4
+# Other word characters (CJK and other scripts, digits, "_") often map to a token each,
+# so they are counted one per character; so is every punctuation mark
+_LATIN_LETTERS = "A-Za-z\u00c0-\u00d6\u00d8-\u00f6\u00f8-\u024f"
+
+_TOKEN_RE = re.compile(r"[%s]{1,%d}|\w|[^\w\s]" % (_LATIN_LETTERS, CHARS_PER_TOKEN))
+_SENTENCE_END = frozenset(".!?")
+
+def count_tokens(text: str) -> int:
+    """Estimated token count of text"""
+    return sum(1 for _ in _TOKEN_RE.finditer(text))
+
+class TokenizedText:
+    """Token, word and sentence boundary offsets for a text, computed in one pass"""
+
+    def __init__(self, text: str):
+        self.starts: List[int] = []
+        self.ends: List[int] = []
+        # Token indices where a word begins / a word or sentence ends (sorted)
+        self.word_starts: List[int] = []
+        self.word_ends: List[int] = []
+        self.sentence_ends: List[int] = []
+
+        previous_end = -1
+        for index, match in enumerate(_TOKEN_RE.finditer(text)):
+            start, end = match.span()
+            if start != previous_end:
+                # Whitespace before this token: a new word starts and the previous one ended
+                self.word_starts.append(index)
+                if index:
+                    self.word_ends.append(index - 1)
+            self.starts.append(start)
+            self.ends.append(end)
+            previous_end = end
+            if text[start] in _SENTENCE_END and (end == len(text) or text[end].isspace()):
+                self.sentence_ends.append(index)
+        if self.starts:
+            self.word_ends.append(len(self.starts) - 1)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+class TokenChunker:
+    """
+    Split text into spans that fit a token budget.
+
+    The text is tokenized once; chunk boundaries are then found with binary
+    searches over the precomputed offsets, preferring sentence ends, then word
+    ends. Chunks are returned as (start, end) character spans over the source
+    text, so substrings are only created when needed.
+    """
+
+    def __init__(self, max_tokens: int = DEFAULT_MAX_TOKENS, overlap_tokens: int = 0):
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be positive")
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("overlap_tokens must be in [0, max_tokens)")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def count_tokens(self, text: str) -> int:
+        """Estimated token count of text"""
+        return count_tokens(text)
+
+    def chunk_spans(self, text: str) -> List[Tuple[int, int]]:
+        """Chunk boundaries as (start, end) character offsets into text"""
+        tokens = TokenizedText(text)
+        total = len(tokens)
+        spans = []
+        first = 0
+        while first < total:
+            limit = min(first + self.max_tokens, total)
+            cut = limit if limit == total else self._find_cut(tokens, first, limit)
+            spans.append((tokens.starts[first], tokens.ends[cut - 1]))
+            if cut >= total:
+                break
+            # Start the next chunk on a word boundary, overlap_tokens back from the cut
+            next_first = cut
+            if self.overlap_tokens:
+                word = bisect_left(tokens.word_starts, cut - self.overlap_tokens)
+                if word < len(tokens.word_starts) and tokens.word_starts[word] < cut:
+                    next_first = tokens.word_starts[word]
+            first = max(next_first, first + 1)
+        return spans
+
+    def _find_cut(self, tokens: TokenizedText, first: int, limit: int) -> int:
+        """Exclusive token index to end a chunk starting at first, at most limit"""
+        # Last sentence end inside the window, if it keeps the chunk at least half full
+        index = bisect_right(tokens.sentence_ends, limit - 1) - 1
+        if index >= 0 and tokens.sentence_ends[index] + 1 - first >= max(1, self.max_tokens // 2):
+            return tokens.sentence_ends[index] + 1
+        # Otherwise the last complete word
+        index = bisect_right(tokens.word_ends, limit - 1) - 1
+        if index >= 0 and tokens.word_ends[index] >= first:
+            return tokens.word_ends[index] + 1
+        # A single word longer than the budget: hard split
+        return limit
+
+    def iter_chunks(self, text: str) -> Iterator[str]:
+        """Lazily materialize chunk strings"""
+        for start, end in self.chunk_spans(text):
+            yield text[start:end]
+
+    def chunks(self, text: str) -> List[str]:
+        """Chunk strings for text"""
+        return list(self.iter_chunks(text))